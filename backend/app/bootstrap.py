@@ -0,0 +1,169 @@
+# backend/app/bootstrap.py
+"""
+Inicialização compartilhada entre as aplicações: a API principal (main.py)
+e o serviço dedicado ao Kiosk (kiosk_main.py). Cada uma monta só os serviços
+e blueprints de que precisa, mas todas usam a mesma configuração e as mesmas
+classes de serviço.
+"""
+
+import os
+import logging
+from types import SimpleNamespace
+from werkzeug.middleware.proxy_fix import ProxyFix
+import firebase_admin
+from firebase_admin import credentials
+from flask_cors import CORS
+from flask_mail import Mail
+from app.models.db import db as firestore_db
+
+# Tarefas adiadas para cada worker do gunicorn, logo após o fork (ver reinit_firebase_after_fork)
+_after_fork = []
+
+ALLOWED_ORIGINS = [
+    "https://jitakyoapp.web.app",
+    "https://aluno-jitakyoapp.web.app"
+]
+
+
+def configure_app(app):
+    """Middlewares, CORS e e-mail. Retorna a instância do Flask-Mail."""
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+    CORS(app, resources={r"/api/*": {"origins": ALLOWED_ORIGINS}}, supports_credentials=True)
+
+    app.config.update(
+        MAIL_SERVER=os.getenv('MAIL_SERVER'),
+        MAIL_PORT=int(os.getenv('MAIL_PORT', 587)),
+        MAIL_USE_TLS=os.getenv('MAIL_USE_TLS', 'true').lower() in ('true', '1', 't'),
+        MAIL_USERNAME=os.getenv('MAIL_USERNAME'),
+        MAIL_PASSWORD=os.getenv('MAIL_PASSWORD'),
+        MAIL_DEFAULT_SENDER=os.getenv('MAIL_DEFAULT_SENDER')
+    )
+    return Mail(app)
+
+
+def init_firebase():
+    """
+    Inicializa o Firebase Admin SDK (uma vez por processo) e retorna o proxy
+    do Firestore (`app.models.db.db`). As coleções que os serviços guardam no
+    __init__ são resolvidas no cliente atual a cada uso (`CollectionProxy`),
+    então o cliente pode ser trocado depois do fork sem recriar os serviços.
+    Referências a documentos e consultas não devem ser guardadas entre
+    requisições.
+    """
+    try:
+        if not firebase_admin._apps:
+            cred = credentials.ApplicationDefault()
+            firebase_admin.initialize_app(cred)
+    except Exception as e:
+        print(f"ERRO FATAL ao inicializar o Firebase Admin SDK: {e}")
+
+    firestore_db.init_app()
+    return firestore_db
+
+
+def reinit_firebase_after_fork():
+    """
+    Chamado em cada worker do gunicorn logo após o fork (`post_fork`, com
+    `preload_app`). Canais gRPC e sessões HTTP abertos no processo mestre não
+    podem ser usados no filho: o app do Firebase é recriado com a mesma
+    credencial e o proxy do Firestore passa a usar um cliente novo. Em
+    seguida rodam as tarefas que precisam do Firestore e foram adiadas na
+    subida (ex: carregar a galeria facial).
+    """
+    try:
+        if firebase_admin._apps:
+            current = firebase_admin.get_app()
+            cred, project_id = current.credential, current.project_id
+            firebase_admin.delete_app(current)
+            firebase_admin.initialize_app(cred, {'projectId': project_id} if project_id else None)
+        else:
+            firebase_admin.initialize_app(credentials.ApplicationDefault())
+    except Exception as e:
+        print(f"ERRO FATAL ao reinicializar o Firebase Admin SDK após o fork: {e}")
+
+    firestore_db.reset()
+    firestore_db.init_app()
+
+    for task in _after_fork:
+        try:
+            task()
+        except Exception as e:
+            logging.error(f"Erro ao preparar o worker após o fork: {e}", exc_info=True)
+
+
+def _loading_before_fork():
+    """Se a aplicação está sendo carregada no mestre do gunicorn, antes do fork dos workers (preload_app)."""
+    return os.getenv('GUNICORN_PRELOAD', 'false').lower() in ('true', '1', 't')
+
+
+def create_core_services(db, mail=None):
+    """
+    Serviços usados por todas as aplicações: usuários, professores, turmas,
+    matrículas e presenças, já com as dependências entre eles resolvidas.
+    """
+    from app.services.enrollment_service import EnrollmentService
+    from app.services.user_service import UserService
+    from app.services.teacher_service import TeacherService
+    from app.services.training_class_service import TrainingClassService
+    from app.services.attendance_service import AttendanceService
+
+    # Nível 0
+    user_service = UserService(db, mail=mail)
+    teacher_service = TeacherService(db, user_service=user_service)
+    training_class_service = TrainingClassService(db, teacher_service=teacher_service)
+
+    # Nível 1
+    enrollment_service = EnrollmentService(db, user_service=user_service, training_class_service=training_class_service)
+
+    # Nível 2
+    attendance_service = AttendanceService(db, user_service, enrollment_service, training_class_service)
+
+    # Resolução de dependência circular
+    user_service.set_enrollment_service(enrollment_service)
+
+    return SimpleNamespace(
+        user_service=user_service,
+        teacher_service=teacher_service,
+        training_class_service=training_class_service,
+        enrollment_service=enrollment_service,
+        attendance_service=attendance_service
+    )
+
+
+def create_facial_recognition_service(user_service, preload=False):
+    """
+    Serviço de reconhecimento facial, criado só na primeira requisição facial
+    (o dlib e os modelos não são carregados em instâncias que não os usam).
+    Com `preload` (ou FACE_PRELOAD=true), galeria e modelos são carregados já
+    na subida, como no serviço dedicado ao Kiosk. Com o gunicorn em preload,
+    o mestre carrega só os modelos (compartilhados com os workers) e cada
+    worker carrega a galeria depois do fork, já com o seu cliente do Firestore.
+
+    Com FACE_SHARED_GALLERY=true (vários workers do gunicorn), a galeria em
+    memória compartilhada é criada aqui mesmo, antes do fork, para que todos
+    os workers publiquem e leiam o mesmo bloco.
+    """
+    from app.services.lazy_service import LazyService
+
+    shared_gallery = None
+    if os.getenv('FACE_SHARED_GALLERY', 'false').lower() in ('true', '1', 't'):
+        from app.services.shared_gallery import SharedFaceGallery
+        shared_gallery = SharedFaceGallery()
+
+    def build():
+        from app.services.facial_recognition_service import FacialRecognitionService
+        from app.services.face_worker_pool import FaceWorkerPool, DEFAULT_WORKERS
+        # Encoding facial em processos separados (FACE_WORKERS=0 mantém tudo no processo da API)
+        face_worker_pool = FaceWorkerPool() if DEFAULT_WORKERS > 0 else None
+        return FacialRecognitionService(
+            user_service=user_service, worker_pool=face_worker_pool, shared_gallery=shared_gallery
+        )
+
+    service = LazyService(build, 'reconhecimento facial')
+    if os.getenv('FACE_PRELOAD', str(preload)).lower() in ('true', '1', 't'):
+        if _loading_before_fork():
+            service.load_models()
+            _after_fork.append(service.warm_up)
+        else:
+            service.warm_up()
+    return service
@@ -2,6 +2,21 @@
 
 from firebase_admin import firestore
 
+class CollectionProxy:
+    """
+    Coleção resolvida no cliente atual a cada uso. Os serviços guardam a
+    coleção no __init__, que com o gunicorn em preload roda no processo mestre:
+    cada chamada (.document(), .where(), .stream()...) usa o cliente do
+    processo que a faz, e não o canal gRPC herdado do mestre.
+    """
+    def __init__(self, owner, path):
+        self._owner = owner
+        self._path = path
+
+    def __getattr__(self, name):
+        return getattr(self._owner.client.collection(*self._path), name)
+
+
 class FirestoreClient:
     """
     Um proxy para o cliente do Firestore que permite a inicialização tardia.
@@ -14,14 +29,28 @@ class FirestoreClient:
         if not self._client:
             self._client = firestore.client()
 
+    def reset(self):
+        """Descarta o cliente atual (ex: no worker do gunicorn, após o fork); o próximo init_app cria outro."""
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            raise RuntimeError("Cliente do Firestore não foi inicializado. Chame db.init_app() primeiro.")
+        return self._client
+
+    def collection(self, *path):
+        """Coleção que acompanha a troca do cliente (ver CollectionProxy)."""
+        return CollectionProxy(self, path)
+
     def __getattr__(self, name):
         """
-        Delega chamadas de método (como .collection(), .document())
+        Delega chamadas de método (como .batch(), .transaction(), .get_all())
         para o cliente real do Firestore.
         """
-        if self._client is None:
-            raise RuntimeError("Cliente do Firestore não foi inicializado. Chame db.init_app() primeiro.")
-        return getattr(self._client, name)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.client, name)
 
 # Cria a instância do proxy que será importada em toda a aplicação
 db = FirestoreClient()
\ No newline at end of file
@@ -0,0 +1,92 @@
+import numpy as np
+
+EMBEDDING_SIZE = 128
+# float32 little-endian: 128 × 4 = 512 bytes por embedding
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+# Tags de modelo/versão. Os dois modelos geram vetores de 128 dimensões na mesma
+# escala (o face-api.js é um port da rede do dlib), mas a origem fica registrada.
+MODEL_DLIB = 'dlib_resnet_v1'        # face_recognition no servidor (antigo 'face_encoding')
+MODEL_FACE_API = 'face_api_v1'       # face-api.js no navegador (antigo 'face_descriptor')
+
+# Modelos cujos vetores podem ser comparados com a galeria
+COMPATIBLE_MODELS = (MODEL_DLIB, MODEL_FACE_API)
+
+# Campos legados, em ordem de prioridade, e o modelo de cada um
+LEGACY_FIELDS = (('face_encoding', MODEL_DLIB), ('face_descriptor', MODEL_FACE_API))
+
+
+class FaceEmbedding:
+    """
+    Embedding facial armazenado no Firestore como 512 bytes (float32) no campo
+    'face_embedding', acompanhado do modelo em 'face_embedding_model'.
+    A leitura usa np.frombuffer, sem copiar nem converter lista de floats.
+
+    No cadastro com várias fotos, `vector` é o centroide das amostras aceitas
+    e `exemplars` guarda algumas delas (matriz K × 128, em 'face_exemplars'),
+    com o total de fotos usadas em 'face_sample_count'.
+    """
+    def __init__(self, vector, model=MODEL_DLIB, exemplars=None, sample_count=1):
+        self.vector = vector
+        self.model = model
+        self.exemplars = exemplars
+        self.sample_count = sample_count
+
+    @staticmethod
+    def from_values(values, model=MODEL_DLIB):
+        """Cria a partir de uma lista/array de 128 números, validando tamanho e valores."""
+        vector = np.asarray(values, dtype=EMBEDDING_DTYPE).reshape(-1)
+        if vector.shape[0] != EMBEDDING_SIZE:
+            raise ValueError(f"Embedding facial deve ter {EMBEDDING_SIZE} valores (recebido: {vector.shape[0]}).")
+        if not np.isfinite(vector).all():
+            raise ValueError("Embedding facial contém valores inválidos (NaN ou infinito).")
+        return FaceEmbedding(vector, model)
+
+    @staticmethod
+    def from_bytes(data, model=MODEL_DLIB):
+        if len(data) != EMBEDDING_SIZE * EMBEDDING_DTYPE.itemsize:
+            raise ValueError(f"Embedding facial binário deve ter {EMBEDDING_SIZE * EMBEDDING_DTYPE.itemsize} bytes.")
+        return FaceEmbedding(np.frombuffer(data, dtype=EMBEDDING_DTYPE), model)
+
+    @staticmethod
+    def from_firestore(source_dict):
+        """
+        Lê o embedding de um documento de usuário: o campo binário
+        'face_embedding' ou, para documentos ainda não migrados, os campos
+        legados em lista. Retorna None se não houver embedding válido.
+        """
+        if not source_dict:
+            return None
+        data = source_dict.get('face_embedding')
+        try:
+            if data:
+                embedding = FaceEmbedding.from_bytes(bytes(data), source_dict.get('face_embedding_model') or MODEL_DLIB)
+                exemplars = source_dict.get('face_exemplars')
+                if exemplars and len(exemplars) % (EMBEDDING_SIZE * EMBEDDING_DTYPE.itemsize) == 0:
+                    embedding.exemplars = np.frombuffer(bytes(exemplars), dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_SIZE)
+                    embedding.sample_count = int(source_dict.get('face_sample_count') or len(embedding.exemplars))
+                return embedding
+            for field, model in LEGACY_FIELDS:
+                if source_dict.get(field):
+                    return FaceEmbedding.from_values(source_dict[field], model)
+        except (ValueError, TypeError) as e:
+            print(f"Aviso: embedding facial inválido ignorado: {e}")
+        return None
+
+    def to_bytes(self):
+        return np.ascontiguousarray(self.vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+    def to_firestore(self):
+        """Campos gravados no documento do usuário."""
+        fields = {'face_embedding': self.to_bytes(), 'face_embedding_model': self.model}
+        if self.exemplars is not None and len(self.exemplars):
+            fields['face_exemplars'] = np.ascontiguousarray(self.exemplars, dtype=EMBEDDING_DTYPE).tobytes()
+            fields['face_sample_count'] = self.sample_count
+        return fields
+
+    def to_list(self):
+        """Lista de floats para a API (o front-end ainda consome 'face_descriptor' como lista)."""
+        return [float(v) for v in self.vector]
+
+    def __repr__(self):
+        return f"<FaceEmbedding(model='{self.model}', size={len(self.vector)}, samples={self.sample_count})>"
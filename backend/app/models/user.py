@@ -1,4 +1,5 @@
 from datetime import date, datetime
+from app.models.face_embedding import FaceEmbedding
 
 class User:
     """
@@ -9,7 +10,7 @@ class User:
                  date_of_birth=None, phone=None, guardians=None, 
                  enrolled_disciplines=None, created_at=None, updated_at=None,
                  par_q_data=None, par_q_filled=False, 
-                 has_face_registered=False, face_descriptor=None):
+                 has_face_registered=False, face_embedding=None):
         
         self.id = id
         self.name = name
@@ -26,7 +27,7 @@ class User:
         self.par_q_data = par_q_data
         self.par_q_filled = par_q_filled
         self.has_face_registered = has_face_registered
-        self.face_descriptor = face_descriptor
+        self.face_embedding = face_embedding
 
     @staticmethod
     def from_dict(source_dict, doc_id):
@@ -75,7 +76,8 @@ class User:
             par_q_data=source_dict.get('par_q_data'),
             par_q_filled=source_dict.get('par_q_filled', False),
             has_face_registered=source_dict.get('has_face_registered', False),
-            face_descriptor=source_dict.get('face_descriptor')
+            # Embedding binário (ou campos legados em lista, antes da migração)
+            face_embedding=FaceEmbedding.from_firestore(source_dict)
         )
 
     def to_dict(self):
@@ -95,7 +97,9 @@ class User:
             "par_q_data": self.par_q_data,
             "par_q_filled": self.par_q_filled,
             "has_face_registered": self.has_face_registered,
-            "face_descriptor": self.face_descriptor,
+            # Mantido como lista para compatibilidade com o front-end
+            "face_descriptor": self.face_embedding.to_list() if self.face_embedding else None,
+            "face_embedding_model": self.face_embedding.model if self.face_embedding else None,
             # Datas
             "date_of_birth": self.date_of_birth.isoformat() if isinstance(self.date_of_birth, (datetime, date)) else None,
             "created_at": self.created_at.isoformat() if isinstance(self.created_at, (datetime, date)) else None,
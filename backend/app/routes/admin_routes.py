@@ -2,7 +2,7 @@
 
 import logging
 import os
-from flask import Blueprint, jsonify, render_template, request, redirect, url_for, flash, current_app, g
+from flask import Blueprint, jsonify, render_template, request, redirect, url_for, flash, current_app, g, Response, stream_with_context
 from datetime import datetime, date, time, timedelta 
 from werkzeug.utils import secure_filename
 from firebase_admin import auth
@@ -18,7 +18,6 @@ from app.services.enrollment_service import EnrollmentService
 from app.services.attendance_service import AttendanceService
 from app.services.payment_service import PaymentService
 from app.services.notification_service import NotificationService # <-- NOVO
-from app.services.facial_recognition_service import FacialRecognitionService # <-- NOVO
 
 admin_api_bp = Blueprint('admin_api', __name__, url_prefix='/api/admin')
 
@@ -30,11 +29,13 @@ enrollment_service = None
 attendance_service = None
 payment_service = None
 notification_service = None # <-- NOVO
-facial_recognition_service = None # <-- NOVO
+attendance_analytics_service = None
+churn_risk_service = None
+billing_job_service = None
 db = None
 
-def init_admin_bp(database, us, ts, tcs, es_param, as_param, ps_param, ns, frs=None): # <-- frs ADICIONADO
-    global db, user_service, teacher_service, training_class_service, enrollment_service, attendance_service, payment_service, notification_service, facial_recognition_service
+def init_admin_bp(database, us, ts, tcs, es_param, as_param, ps_param, ns, aas=None, crs=None, bjs=None):
+    global db, user_service, teacher_service, training_class_service, enrollment_service, attendance_service, payment_service, notification_service, attendance_analytics_service, churn_risk_service, billing_job_service
     db = database
     user_service = us
     teacher_service = ts
@@ -43,7 +44,9 @@ def init_admin_bp(database, us, ts, tcs, es_param, as_param, ps_param, ns, frs=N
     attendance_service = as_param
     payment_service = ps_param
     notification_service = ns # <-- NOVO
-    facial_recognition_service = frs # <-- NOVO
+    attendance_analytics_service = aas
+    churn_risk_service = crs
+    billing_job_service = bjs
 
 
 # --- NOVA ROTA PARA O DASHBOARD ---
@@ -76,7 +79,8 @@ def get_dashboard_summary():
                 "students_by_discipline": payment_service.get_students_by_discipline()
             },
             "lists": {
-                "recent_payments": payment_service.get_recent_payments(limit=5)
+                "recent_payments": payment_service.get_recent_payments(limit=5),
+                "churn_risk": churn_risk_service.get_latest_ranking(limit=5).get('students', []) if churn_risk_service else []
             }
         }
         return jsonify(summary_data), 200
@@ -148,42 +152,6 @@ def send_student_guide(student_id):
 
 
 
-# --- NOVO ENDPOINT: SALVAR DESCRITOR FACIAL (CLIENT-SIDE) ---
-@admin_api_bp.route('/students/<string:student_id>/face', methods=['POST'])
-@login_required
-@role_required('admin', 'super_admin')
-def save_student_face(student_id):
-    """
-    Recebe o descritor facial e salva no Firestore.
-    Suporta o payload envolvido em 'user_data' para manter consistência 
-    com o formulário de edição.
-    """
-    try:
-        data = request.get_json()
-        
-        # Tenta pegar de 'user_data' (novo padrão) ou da raiz (padrão antigo)
-        user_data = data.get('user_data', {})
-        descriptor = user_data.get('face_descriptor') or data.get('face_descriptor')
-
-        if not descriptor or not isinstance(descriptor, list):
-            return jsonify(error="Descritor facial ausente ou em formato inválido."), 400
-
-        # Atualiza o usuário. O UserService agora aceita esses campos.
-        success = user_service.update_user(student_id, {
-            'face_descriptor': descriptor,
-            'has_face_registered': True
-        })
-
-        if success:
-            return jsonify(success=True, message="Biometria salva com sucesso."), 200
-        return jsonify(error="Aluno não encontrado ou falha na persistência."), 404
-
-    except Exception as e:
-        logging.error(f"Erro ao salvar biometria: {e}")
-        return jsonify(error=str(e)), 500
-
-
-
 # --- BUSCA DE ALUNOS (CASE-INSENSITIVE) ---
 @admin_api_bp.route('/students/search', methods=['GET'])
 @login_required
@@ -604,6 +572,133 @@ def save_attendance():
         return jsonify({"error": "Ocorreu uma falha interna ao salvar a chamada."}), 500
 
 
+MAX_BULK_ATTENDANCE_ENTRIES = 1000
+
+@admin_api_bp.route('/attendance/bulk', methods=['POST'])
+@login_required
+@role_required('admin', 'super_admin', 'teacher')
+def save_attendance_bulk():
+    """
+    Sincroniza várias chamadas em uma única requisição (dispositivos offline).
+    Espera {"entries": [{"class_id", "date", "present_student_ids"}, ...]}.
+    """
+    data = request.get_json(silent=True) or {}
+    entries = data.get('entries')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "A lista 'entries' é obrigatória."}), 400
+    if len(entries) > MAX_BULK_ATTENDANCE_ENTRIES:
+        return jsonify({"error": f"Envie no máximo {MAX_BULK_ATTENDANCE_ENTRIES} chamadas por requisição."}), 400
+
+    try:
+        result = attendance_service.bulk_create_or_update_attendance(entries)
+        # 207: cada entrada tem o seu próprio status no corpo da resposta
+        status_code = 200 if result['summary']['failed'] == 0 else 207
+        return jsonify(result), status_code
+    except Exception as e:
+        logging.error(f"Erro inesperado ao sincronizar chamadas: {e}", exc_info=True)
+        return jsonify({"error": "Ocorreu uma falha interna ao sincronizar as chamadas."}), 500
+
+
+@admin_api_bp.route('/attendance/export', methods=['GET'])
+@login_required
+@role_required('admin', 'super_admin')
+def export_attendance():
+    """
+    Exporta as presenças em streaming (CSV ou NDJSON), com filtros opcionais
+    por turma, aluno e período (start/end no formato AAAA-MM-DD).
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    class_id = request.args.get('class_id') or None
+    student_id = request.args.get('student_id') or None
+    try:
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+        end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"error": "Datas devem estar no formato AAAA-MM-DD."}), 400
+
+    try:
+        rows = attendance_service.stream_attendance_export(fmt, class_id, student_id, start_date, end_date)
+        # Antecipa o cabeçalho para que erros de configuração virem 400/500 e não um arquivo vazio
+        first_chunk = next(rows, '')
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        logging.error(f"Erro ao iniciar exportação de presenças: {e}", exc_info=True)
+        return jsonify({"error": "Falha ao exportar presenças."}), 500
+
+    def generate():
+        yield first_chunk
+        yield from rows
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"presencas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+def _parse_analytics_period():
+    """Lê start/end (AAAA-MM-DD) da query string; o padrão são os últimos 90 dias."""
+    today = date.today()
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start_date = datetime.strptime(start, '%Y-%m-%d').date() if start else today - timedelta(days=90)
+    end_date = datetime.strptime(end, '%Y-%m-%d').date() if end else today
+    if start_date > end_date:
+        raise ValueError("A data inicial deve ser anterior à data final.")
+    return start_date, end_date
+
+@admin_api_bp.route('/attendance/analytics/heatmap', methods=['GET'])
+@login_required
+@role_required('admin', 'super_admin')
+def get_attendance_heatmap():
+    """Ocupação média por dia da semana e horário no período."""
+    try:
+        start_date, end_date = _parse_analytics_period()
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    try:
+        heatmap = attendance_analytics_service.get_occupancy_heatmap(start_date, end_date, request.args.get('class_id') or None)
+        return jsonify(heatmap), 200
+    except Exception as e:
+        logging.error(f"Erro ao gerar mapa de ocupação: {e}", exc_info=True)
+        return jsonify({"error": "Falha ao gerar mapa de ocupação."}), 500
+
+@admin_api_bp.route('/attendance/analytics/students', methods=['GET'])
+@login_required
+@role_required('admin', 'super_admin', 'teacher')
+def get_attendance_student_trends():
+    """Taxa de presença, tendência semanal e sequências de cada aluno no período."""
+    try:
+        start_date, end_date = _parse_analytics_period()
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    window_weeks = request.args.get('window_weeks', 4, type=int)
+    try:
+        trends = attendance_analytics_service.get_student_trends(
+            start_date, end_date, request.args.get('class_id') or None, window_weeks
+        )
+        return jsonify(trends), 200
+    except Exception as e:
+        logging.error(f"Erro ao gerar tendências de frequência: {e}", exc_info=True)
+        return jsonify({"error": "Falha ao gerar tendências de frequência."}), 500
+
+
+@admin_api_bp.route('/analytics/churn-risk', methods=['GET'])
+@login_required
+@role_required('admin', 'super_admin')
+def get_churn_risk():
+    """Retorna o último ranking de risco de evasão calculado pelo job diário."""
+    try:
+        limit = request.args.get('limit', type=int)
+        return jsonify(churn_risk_service.get_latest_ranking(limit=limit)), 200
+    except Exception as e:
+        logging.error(f"Erro ao buscar ranking de risco de evasão: {e}", exc_info=True)
+        return jsonify({"error": "Falha ao buscar ranking de risco de evasão."}), 500
+
+
 @admin_api_bp.route('/classes/<class_id>/attendance-semesters', methods=['GET'])
 @login_required
 @role_required('admin', 'super_admin', 'teacher')
@@ -634,111 +729,6 @@ def get_attendance_history(class_id):
         logging.error(f"Erro ao buscar histórico de chamadas para a turma {class_id}: {e}")
         return jsonify({"error": f"Erro ao buscar histórico de chamadas para a turma {class_id}: {e}"}), 500
 
-# --- ROTAS DE RECONHECIMENTO FACIAL (KIOSK) ---
-
-@admin_api_bp.route('/students/<string:student_id>/face-registration', methods=['POST'])
-@login_required
-@role_required('admin', 'super_admin')
-def register_student_face(student_id):
-    """Recebe uma foto de referência, gera o encoding e salva no perfil do aluno."""
-    if 'file' not in request.files:
-        return jsonify(error="Nenhum arquivo enviado."), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify(error="Nome de arquivo inválido."), 400
-
-    try:
-        # Gera o encoding (vetor numérico)
-        encoding = facial_recognition_service.get_face_encoding_from_stream(file)
-        
-        if encoding is None:
-            return jsonify(error="Nenhum rosto detectado na imagem. Tente uma foto mais clara."), 400
-        
-        # Atualiza o usuário com o novo campo 'face_encoding'
-        # Nota: O user_service precisa suportar atualização de campos arbitrários ou você deve adicionar isso ao modelo
-        success = user_service.update_user(student_id, {'face_encoding': encoding, 'has_face_registered': True})
-        
-        if success:
-            return jsonify(success=True, message="Face registrada com sucesso!"), 200
-        else:
-            return jsonify(error="Erro ao salvar dados faciais no banco."), 500
-            
-    except Exception as e:
-        logging.error(f"Erro no registro facial: {e}", exc_info=True)
-        return jsonify(error=f"Erro interno: {e}"), 500
-
-@admin_api_bp.route('/attendance/kiosk/recognize', methods=['POST'])
-# @login_required -> Kiosk pode usar um token especial ou estar na rede interna, mas vamos manter login por enquanto
-def kiosk_recognize_attendance():
-    """
-    Recebe uma foto do tablet na entrada.
-    1. Identifica o aluno.
-    2. Verifica se há aula agora.
-    3. Registra presença.
-    """
-    if 'file' not in request.files:
-        return jsonify(error="Imagem não fornecida."), 400
-        
-    try:
-        # 1. Buscar todos os alunos que têm face cadastrada
-        # Otimização: Em produção, cachear isso ou buscar apenas ativos
-        all_students = user_service.get_users_by_role('student')
-        students_with_face = [s.to_dict() for s in all_students if s.to_dict().get('face_encoding')]
-        
-        # 2. Identificar Aluno
-        file = request.files['file']
-        identified_student = facial_recognition_service.identify_student(file, students_with_face)
-        
-        if not identified_student:
-            return jsonify(success=False, message="Aluno não identificado."), 404
-            
-        # 3. Verificar Turma no Horário Atual
-        now = datetime.now()
-        current_weekday = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo'][now.weekday()]
-        current_time_minutes = now.hour * 60 + now.minute
-        
-        all_classes = training_class_service.get_all_classes()
-        matching_class = None
-        
-        for cls in all_classes:
-            for slot in cls.get('schedule', []):
-                if slot['day_of_week'] == current_weekday:
-                    start_h, start_m = map(int, slot['start_time'].split(':'))
-                    start_minutes = start_h * 60 + start_m
-                    # Aceita presença se estiver dentro de uma janela (ex: 30 min antes até 30 min depois do início)
-                    if abs(current_time_minutes - start_minutes) <= 45: 
-                        matching_class = cls
-                        break
-            if matching_class: break
-        
-        if matching_class:
-            # 4. Registrar Presença
-            attendance_data = {
-                'class_id': matching_class['id'],
-                'date': now.strftime('%Y-%m-%d'),
-                'students': [{'student_id': identified_student['id'], 'status': 'present', 'method': 'facial_recognition'}]
-            }
-            attendance_service.create_or_update_attendance(attendance_data)
-            
-            return jsonify({
-                "success": True, 
-                "student_name": identified_student['name'],
-                "class_name": matching_class['name'],
-                "message": f"Bem-vindo, {identified_student['name']}! Presença confirmada."
-            }), 200
-        else:
-            return jsonify({
-                "success": False, 
-                "student_name": identified_student['name'],
-                "message": f"Olá {identified_student['name']}, nenhuma aula encontrada para agora."
-            }), 200
-
-    except Exception as e:
-        logging.error(f"Erro no Kiosk: {e}", exc_info=True)
-        return jsonify(error=f"Erro de processamento: {e}"), 500
-
-
 @admin_api_bp.route('/classes/<string:class_id>/unenroll/<string:student_id>', methods=['POST'])
 @login_required
 @role_required('admin', 'super_admin')
@@ -762,12 +752,21 @@ def unenroll_student_from_class(class_id, student_id):
 @login_required
 @role_required('admin', 'super_admin')
 def get_financial_status():
+    """
+    Status financeiro do mês. Com `page_size` (até 500), a resposta é paginada
+    por cursor: passe o `next_cursor` recebido em `cursor` para a próxima página.
+    """
     year = request.args.get('year', type=int)
     month = request.args.get('month', type=int)
     if not year or not month:
         return jsonify({"error": "Ano e mês são obrigatórios"}), 400
+    page_size = request.args.get('page_size', type=int)
+    if page_size is not None and not 1 <= page_size <= 500:
+        return jsonify({"error": "page_size deve estar entre 1 e 500"}), 400
     try:
-        status = payment_service.get_financial_status(year, month)
+        status = payment_service.get_financial_status(
+            year, month, page_size=page_size, cursor=request.args.get('cursor')
+        )
         return jsonify(status)
     except Exception as e:
         logging.error(f"Erro ao obter status financeiro: {e}", exc_info=True)
@@ -777,21 +776,46 @@ def get_financial_status():
 @login_required
 @role_required('admin', 'super_admin')
 def generate_monthly_billings():
-    """Gera as cobranças do mês corrente ou do mês/ano especificado."""
+    """
+    Inicia a geração das cobranças do mês corrente ou do mês/ano especificado
+    em segundo plano e responde na hora com o job; o progresso é consultado
+    em /financial/billing-jobs/<job_id>.
+    """
     try:
         today = datetime.utcnow()
         # A rota pode receber o ano e mês pelo corpo do JSON para testes ou execuções manuais.
         # Se não receber, usa o mês e ano atuais.
         year = request.json.get('year', today.year) if request.is_json else today.year
         month = request.json.get('month', today.month) if request.is_json else today.month
-        
-        result = payment_service.generate_monthly_payments(year, month)
-        return jsonify(success=True, message=f"{result['generated']} cobranças geradas. {result['skipped']} já existiam.", details=result), 201
+
+        job, created = billing_job_service.start_monthly_billing(year, month, started_by=g.user.id)
+        message = "Geração de cobranças iniciada." if created else "A geração de cobranças deste mês já está em andamento."
+        return jsonify(success=True, message=message, job=job), 202
+    except ValueError as ve:
+        return jsonify(error=str(ve)), 400
     except Exception as e:
         logging.error(f"Erro ao gerar cobranças: {e}", exc_info=True)
         return jsonify(error=f"Erro ao gerar cobranças: {e}"), 500
 
+@admin_api_bp.route('/financial/billing-jobs/<string:job_id>', methods=['GET'])
+@login_required
+@role_required('admin', 'super_admin')
+def get_billing_job(job_id):
+    """Progresso de uma geração de cobranças (contadores, percentual e erros)."""
+    try:
+        job = billing_job_service.get_job_progress(job_id)
+        if job is None:
+            return jsonify(error="Job de cobrança não encontrado."), 404
+        return jsonify(job), 200
+    except Exception as e:
+        logging.error(f"Erro ao consultar job de cobrança {job_id}: {e}", exc_info=True)
+        return jsonify(error=f"Erro ao consultar job de cobrança: {e}"), 500
+
 # --- NOVA ROTA PARA FATURAS AVULSAS ---
+def _is_true(value):
+    """Flag vinda do JSON (booleano) ou da query string (texto): 'false' e '0' não a ligam."""
+    return str(value).strip().lower() in ('true', '1', 't')
+
 @admin_api_bp.route('/financial/generate-misc-invoice', methods=['POST'])
 @login_required
 @role_required('admin', 'super_admin')
@@ -799,8 +823,15 @@ def generate_misc_invoice():
     """Gera faturas avulsas para múltiplos alunos."""
     try:
         data = request.get_json()
-        created_count = payment_service.create_misc_invoices(data)
-        return jsonify(success=True, message=f"{created_count} faturas avulsas geradas com sucesso."), 201
+        # dry_run=true: apenas calcula as faturas e os totais, sem gravar
+        dry_run = _is_true(data.get('dry_run', False)) or _is_true(request.args.get('dry_run', 'false'))
+        result = payment_service.create_misc_invoices(data, dry_run=dry_run)
+        if dry_run:
+            return jsonify(success=True, message=f"{result['to_create']} faturas avulsas seriam geradas ({result['skipped']} já existem).", details=result), 200
+        message = f"{result['created']} faturas avulsas geradas com sucesso."
+        if result['skipped']:
+            message += f" {result['skipped']} já existiam."
+        return jsonify(success=True, message=message, details=result), 201
     except ValueError as ve:
         return jsonify(error=str(ve)), 400
     except Exception as e:
@@ -816,6 +847,8 @@ def register_payment():
         if payment_service.record_payment(data):
             return jsonify({"message": "Pagamento registrado com sucesso"}), 201
         return jsonify({"error": "Falha ao registrar pagamento"}), 500
+    except ValueError as ve:
+        return jsonify(error=str(ve)), 400
     except Exception as e:
         return jsonify({"error": f"Erro interno: {e}"}), 500
 
@@ -0,0 +1,328 @@
+# backend/app/routes/kiosk_routes.py
+
+import io
+import logging
+from flask import Blueprint, jsonify, request
+from datetime import datetime
+
+from app.utils.decorators import login_required, role_required
+from app.services.face_worker_pool import FaceQueueFullError, FaceJobTimeoutError
+from app.services.kiosk_frame_cache import KioskFrameCache
+from app.services.face_enrollment import build_enrollment_embedding, FaceEnrollmentError
+from app.models.face_embedding import FaceEmbedding, MODEL_FACE_API, COMPATIBLE_MODELS
+
+# Mesmo prefixo das rotas de administração: as URLs usadas pelo tablet e pelo painel não mudam.
+# Registrado tanto na API principal (main.py) quanto no serviço dedicado ao Kiosk (kiosk_main.py).
+kiosk_api_bp = Blueprint('kiosk_api', __name__, url_prefix='/api/admin')
+
+user_service = None
+training_class_service = None
+enrollment_service = None
+attendance_service = None
+facial_recognition_service = None
+
+def init_kiosk_bp(us, tcs, es, as_param, frs):
+    global user_service, training_class_service, enrollment_service, attendance_service, facial_recognition_service
+    user_service = us
+    training_class_service = tcs
+    enrollment_service = es
+    attendance_service = as_param
+    facial_recognition_service = frs
+
+
+# --- NOVO ENDPOINT: SALVAR DESCRITOR FACIAL (CLIENT-SIDE) ---
+@kiosk_api_bp.route('/students/<string:student_id>/face', methods=['POST'])
+@login_required
+@role_required('admin', 'super_admin')
+def save_student_face(student_id):
+    """
+    Recebe o descritor facial e salva no Firestore.
+    Suporta o payload envolvido em 'user_data' para manter consistência 
+    com o formulário de edição.
+    """
+    try:
+        data = request.get_json()
+        
+        # Tenta pegar de 'user_data' (novo padrão) ou da raiz (padrão antigo)
+        user_data = data.get('user_data', {})
+        descriptor = user_data.get('face_descriptor') or data.get('face_descriptor')
+
+        if not descriptor or not isinstance(descriptor, list):
+            return jsonify(error="Descritor facial ausente ou em formato inválido."), 400
+
+        # Atualiza o usuário. O UserService agora aceita esses campos.
+        success = user_service.update_user(student_id, {
+            'face_descriptor': descriptor,
+            'has_face_registered': True
+        })
+
+        if success:
+            if facial_recognition_service:
+                facial_recognition_service.refresh_student(student_id)
+            return jsonify(success=True, message="Biometria salva com sucesso."), 200
+        return jsonify(error="Aluno não encontrado ou falha na persistência."), 404
+
+    except ValueError as e:
+        # Descritor com tamanho errado ou valores não numéricos
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        logging.error(f"Erro ao salvar biometria: {e}")
+        return jsonify(error=str(e)), 500
+
+
+# --- ROTAS DE RECONHECIMENTO FACIAL (KIOSK) ---
+
+def _face_busy_response(error):
+    """Resposta de backpressure quando o pool do reconhecimento facial está saturado."""
+    logging.warning(f"Reconhecimento facial indisponível: {error}")
+    response = jsonify(success=False, status='busy', message="Sistema ocupado. Tente novamente em instantes.")
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+# Fotos aceitas por cadastro facial (amostras de ângulos/iluminações diferentes)
+MAX_FACE_REGISTRATION_PHOTOS = 8
+
+@kiosk_api_bp.route('/students/<string:student_id>/face-registration', methods=['POST'])
+@login_required
+@role_required('admin', 'super_admin')
+def register_student_face(student_id):
+    """
+    Recebe uma ou mais fotos de referência ('files', ou 'file' com uma só),
+    codifica todas em paralelo, descarta as discrepantes e salva no perfil do
+    aluno o centroide das amostras aceitas com algumas amostras representativas.
+    """
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify(error="Nenhum arquivo enviado."), 400
+    if len(files) > MAX_FACE_REGISTRATION_PHOTOS:
+        return jsonify(error=f"Máximo de {MAX_FACE_REGISTRATION_PHOTOS} fotos por cadastro."), 400
+
+    try:
+        # Gera os encodings (um vetor por foto, None se não houver rosto)
+        encodings = facial_recognition_service.encode_samples([f.read() for f in files])
+        found = [position for position, encoding in enumerate(encodings) if encoding is not None]
+        if not found:
+            return jsonify(error="Nenhum rosto detectado nas imagens. Tente fotos mais claras."), 400
+
+        try:
+            enrollment = build_enrollment_embedding([encodings[position] for position in found])
+        except FaceEnrollmentError as e:
+            return jsonify(error=str(e)), 400
+        embedding = enrollment['embedding']
+
+        # Atualiza o usuário; o centroide é gravado como embedding binário (float32)
+        success = user_service.update_user(student_id, {'face_embedding': embedding, 'has_face_registered': True})
+        
+        if success:
+            facial_recognition_service.upsert_student(student_id, success.name, embedding.vector)
+            return jsonify(
+                success=True,
+                message="Face registrada com sucesso!",
+                photos=len(files),
+                accepted=[files[found[position]].filename for position in enrollment['accepted']],
+                rejected=[files[found[position]].filename for position in enrollment['rejected']],
+                no_face=[files[position].filename for position, encoding in enumerate(encodings) if encoding is None],
+                spread=round(enrollment['spread'], 4)
+            ), 200
+        else:
+            return jsonify(error="Erro ao salvar dados faciais no banco."), 500
+            
+    except (FaceQueueFullError, FaceJobTimeoutError) as e:
+        return _face_busy_response(e)
+    except Exception as e:
+        logging.error(f"Erro no registro facial: {e}", exc_info=True)
+        return jsonify(error=f"Erro interno: {e}"), 500
+
+# Rostos aceitos por requisição no reconhecimento por descritor (grupo na frente do tablet)
+MAX_KIOSK_DESCRIPTORS = 10
+# Respostas que podem ser reaproveitadas para quadros repetidos do mesmo tablet
+KIOSK_CACHEABLE_STATUS = (200, 404, 409)
+kiosk_frame_cache = KioskFrameCache()
+
+def _kiosk_device_id():
+    """
+    Identifica o tablet pelo cabeçalho X-Kiosk-Device (gerado e guardado pelo
+    kiosk.js). Sem ele, retorna None e o resultado não é reaproveitado: atrás
+    do proxy e de NAT, o IP é o mesmo para todos os tablets da academia.
+    """
+    device_id = (request.headers.get('X-Kiosk-Device') or '').strip()
+    return device_id[:64] or None
+
+def _kiosk_candidates():
+    """
+    Turmas em horário agora (da mais próxima para a mais distante) e os alunos
+    matriculados nelas, usados para restringir a comparação facial. Retorna
+    (turmas, roster {class_id: set(student_ids)}, candidate_ids).
+    """
+    try:
+        active_classes = training_class_service.get_active_classes()
+        if not active_classes:
+            return [], {}, None
+        roster_map = enrollment_service.get_roster_map()
+        roster = {cls.id: roster_map.get(cls.id, set()) for cls in active_classes}
+        candidate_ids = set().union(*roster.values())
+        return active_classes, roster, candidate_ids or None
+    except Exception as e:
+        # Sem turmas/matrículas, a comparação segue contra a galeria inteira
+        logging.warning(f"Kiosk: não foi possível montar os candidatos da turma: {e}")
+        return [], {}, None
+
+def _kiosk_checkin(face_results, active_classes, roster):
+    """
+    Registra a presença dos alunos reconhecidos e monta a resposta do Kiosk,
+    retornando (payload, status HTTP).
+    1. Separa os rostos reconhecidos.
+    2. Associa cada aluno a uma turma em horário (a dele, se matriculado).
+    3. Registra a presença de cada turma em uma única escrita.
+    """
+    faces = [
+        {
+            'status': face['status'],
+            'student_id': face['student']['id'] if face['student'] else None,
+            'student_name': face['student']['name'] if face['student'] else None,
+            'location': face.get('location')
+        }
+        for face in face_results
+    ]
+    identified_students = [face['student'] for face in face_results if face['status'] == 'match']
+
+    if not identified_students:
+        if any(face['status'] == 'ambiguous' for face in face_results):
+            # Dois alunos parecidos (ex: irmãos) ficaram próximos demais para decidir
+            return dict(success=False, status='ambiguous', faces=faces, message="Não foi possível confirmar sua identidade. Tente novamente olhando para a câmera."), 409
+        return dict(success=False, faces=faces, message="Aluno não identificado."), 404
+    names = ', '.join(student['name'] for student in identified_students)
+
+    if not active_classes:
+        return {
+            "success": False, 
+            "student_name": names,
+            "faces": faces,
+            "message": f"Olá {names}, nenhuma aula encontrada para agora."
+        }, 200
+
+    # 2. Cada aluno vai para a turma em horário em que está matriculado; quem não
+    # está em nenhuma (ex: aula experimental) fica na turma mais próxima do horário
+    student_ids_by_class = {}
+    for student in identified_students:
+        target = next((cls for cls in active_classes if student['id'] in roster.get(cls.id, ())), active_classes[0])
+        student_ids_by_class.setdefault(target.id, []).append(student['id'])
+
+    # 3. Registrar Presença (acrescenta os alunos à chamada do dia de cada turma)
+    date_str = datetime.now().strftime('%Y-%m-%d')
+    for class_id, student_ids in student_ids_by_class.items():
+        attendance_service.register_checkin(class_id, date_str, student_ids)
+    class_names = ', '.join(cls.name for cls in active_classes if cls.id in student_ids_by_class)
+    greeting = "Bem-vindo" if len(identified_students) == 1 else "Bem-vindos"
+
+    return {
+        "success": True, 
+        "student_name": names,
+        "class_name": class_names,
+        "faces": faces,
+        "message": f"{greeting}, {names}! Presença confirmada."
+    }, 200
+
+
+@kiosk_api_bp.route('/attendance/kiosk/recognize', methods=['POST'])
+# @login_required -> Kiosk pode usar um token especial ou estar na rede interna, mas vamos manter login por enquanto
+def kiosk_recognize_attendance():
+    """
+    Recebe uma foto do tablet na entrada, identifica todos os alunos da foto
+    (ex: um grupo entrando junto) e registra a presença dos reconhecidos.
+    """
+    if 'file' not in request.files:
+        return jsonify(error="Imagem não fornecida."), 400
+        
+    try:
+        device_id = _kiosk_device_id()
+        image_bytes = request.files['file'].read()
+        frame = None
+        if device_id:
+            try:
+                frame = kiosk_frame_cache.decode_frame(image_bytes)
+            except Exception:
+                frame = None # Imagem ilegível: o pipeline devolve o erro adequado
+
+        # Mesmo(s) rosto(s), no mesmo lugar, do quadro anterior deste tablet: mesmo resultado, sem reprocessar
+        cached = kiosk_frame_cache.lookup_frame(device_id, frame) if frame is not None else None
+        if cached:
+            payload, status = cached
+            return jsonify({**payload, 'cached': True}), status
+
+        # Identificar Alunos: primeiro entre os matriculados nas turmas em horário
+        active_classes, roster, candidate_ids = _kiosk_candidates()
+        result = facial_recognition_service.identify_students(io.BytesIO(image_bytes), candidate_ids=candidate_ids)
+        payload, status = _kiosk_checkin(result['faces'], active_classes, roster)
+        if frame is not None and status in KIOSK_CACHEABLE_STATUS:
+            boxes = kiosk_frame_cache.face_boxes(
+                [face.get('location') for face in result['faces'] if face.get('location')], result.get('image_size')
+            )
+            kiosk_frame_cache.store_frame(device_id, frame, boxes, (payload, status))
+        return jsonify(payload), status
+
+    except (FaceQueueFullError, FaceJobTimeoutError) as e:
+        return _face_busy_response(e)
+    except Exception as e:
+        logging.error(f"Erro no Kiosk: {e}", exc_info=True)
+        return jsonify(error=f"Erro de processamento: {e}"), 500
+
+
+@kiosk_api_bp.route('/attendance/kiosk/recognize-descriptor', methods=['POST'])
+# @login_required -> mesmo critério do reconhecimento por foto
+def kiosk_recognize_descriptor():
+    """
+    Reconhecimento com os descritores calculados no próprio tablet (face-api.js).
+    Recebe {"descriptors": [[128 números], ...], "model": "face_api_v1"}
+    (ou "descriptor" com um único vetor). O servidor só valida, compara contra
+    a galeria e registra a presença, sem decodificar nem detectar rostos.
+    """
+    data = request.get_json(silent=True) or {}
+    descriptors = data.get('descriptors')
+    if descriptors is None and data.get('descriptor') is not None:
+        descriptors = [data['descriptor']]
+    if not isinstance(descriptors, list) or not descriptors:
+        return jsonify(error="Informe 'descriptors' (lista de descritores) ou 'descriptor'."), 400
+    if len(descriptors) > MAX_KIOSK_DESCRIPTORS:
+        return jsonify(error=f"Máximo de {MAX_KIOSK_DESCRIPTORS} descritores por requisição."), 400
+
+    model = data.get('model', MODEL_FACE_API)
+    if model not in COMPATIBLE_MODELS:
+        return jsonify(error=f"Modelo de descritor não suportado: '{model}'. Aceitos: {', '.join(COMPATIBLE_MODELS)}."), 400
+
+    try:
+        vectors = [FaceEmbedding.from_values(d, model).vector for d in descriptors]
+    except (ValueError, TypeError) as e:
+        return jsonify(error=f"Descritor inválido: {e}"), 400
+
+    try:
+        device_id = _kiosk_device_id()
+        cached = kiosk_frame_cache.lookup_embeddings(device_id, vectors) if device_id else None
+        if cached:
+            payload, status = cached
+            return jsonify({**payload, 'cached': True}), status
+
+        active_classes, roster, candidate_ids = _kiosk_candidates()
+        face_results = facial_recognition_service.identify_encodings(vectors, candidate_ids=candidate_ids)
+        payload, status = _kiosk_checkin(face_results, active_classes, roster)
+        if device_id and status in KIOSK_CACHEABLE_STATUS:
+            kiosk_frame_cache.store_embeddings(device_id, vectors, (payload, status))
+        return jsonify(payload), status
+    except Exception as e:
+        logging.error(f"Erro no Kiosk (descritor): {e}", exc_info=True)
+        return jsonify(error=f"Erro de processamento: {e}"), 500
+
+
+@kiosk_api_bp.route('/attendance/kiosk/timings', methods=['GET'])
+@login_required
+@role_required('admin', 'super_admin')
+def get_kiosk_timings():
+    """API que retorna o p50/p95 de cada etapa do reconhecimento facial nas últimas fotos."""
+    try:
+        summary = facial_recognition_service.pipeline.timing_summary()
+        summary['gallery_size'] = facial_recognition_service.gallery_size
+        return jsonify(summary), 200
+    except Exception as e:
+        print(f"Erro ao buscar tempos do Kiosk: {e}")
+        return jsonify(error="Erro interno ao buscar tempos do Kiosk."), 500
@@ -1,15 +1,17 @@
 from flask import Blueprint, request, jsonify
 import logging
 
-# Esta variável será injetada com a instância do PaymentService
+# Estas variáveis serão injetadas com as instâncias do PaymentService e do WebhookService
 payment_service = None
+webhook_service = None
 
 webhook_api_bp = Blueprint('webhook_api', __name__, url_prefix='/api/payments')
 
-def init_webhook_bp(ps):
-    """Inicializa o Blueprint com a instância do PaymentService."""
-    global payment_service
+def init_webhook_bp(ps, ws=None):
+    """Inicializa o Blueprint com as instâncias do PaymentService e do WebhookService."""
+    global payment_service, webhook_service
     payment_service = ps
+    webhook_service = ws
 
 @webhook_api_bp.route('/webhook', methods=['POST'])
 def receive_webhook():
@@ -18,10 +20,17 @@ def receive_webhook():
     Esta rota não tem autenticação, pois é chamada por um serviço externo.
     """
     try:
-        notification = request.get_json()
+        notification = request.get_json(silent=True) or {}
+        if not notification and request.args.get('data.id'):
+            # Formato antigo: tipo e ID do pagamento na query string
+            notification = {'type': request.args.get('type'), 'data': {'id': request.args.get('data.id')}}
         print(f"INFO: Webhook recebido: {notification}")
-        
-        # O processamento real é delegado para o serviço
+
+        if webhook_service:
+            # Só grava a notificação; a consulta ao Mercado Pago e a baixa são feitas em segundo plano
+            webhook_service.receive(notification)
+            return jsonify(status="received"), 200
+
         if payment_service.handle_webhook_notification(notification):
             # Retorna 200 OK para confirmar ao Mercado Pago que a notificação foi recebida
             return jsonify(status="received"), 200
@@ -31,5 +40,6 @@ def receive_webhook():
             return jsonify(error="Failed to process webhook"), 500
             
     except Exception as e:
+        # Se nem a gravação funcionou, o erro faz o Mercado Pago reenviar a notificação
         logging.error(f"Erro fatal no endpoint de webhook: {e}", exc_info=True)
         return jsonify(error=str(e)), 500
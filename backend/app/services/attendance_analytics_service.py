@@ -0,0 +1,212 @@
+from datetime import datetime, date, timedelta
+import logging
+import numpy as np
+from app.services.attendance_service import WEEKDAY_NAMES
+from app.utils.cache import TTLCache
+
+
+class AttendanceAnalyticsService:
+    """
+    Análises de frequência calculadas de forma vetorizada.
+
+    Os registros de um período são carregados em uma matriz booleana
+    aulas × alunos (presença) e outra de mesmo formato indicando se o aluno
+    deveria estar naquela aula (matriculado). Todas as métricas saem dessas
+    duas matrizes, sem laços por aluno.
+    """
+    def __init__(self, db, attendance_service, enrollment_service, training_class_service, user_service):
+        self.db = db
+        self.attendance_service = attendance_service
+        self.enrollment_service = enrollment_service
+        self.training_class_service = training_class_service
+        self.user_service = user_service
+        self._cache = TTLCache(ttl_seconds=600, max_entries=64)
+
+    def get_attendance_matrix(self, start_date, end_date, class_id=None):
+        """
+        Carrega as chamadas do período e monta as matrizes de presença.
+        Retorna um dicionário com as aulas (sessões), os alunos e as matrizes.
+        """
+        def load():
+            classes_map = self.training_class_service.get_classes_map()
+
+            session_class_ids = []
+            session_dates = []
+            session_present = []
+            for _, record in self.attendance_service.iter_attendance_records(class_id, None, start_date, end_date):
+                record_date = record.get('date')
+                if isinstance(record_date, datetime):
+                    record_date = record_date.date()
+                if not isinstance(record_date, date):
+                    continue
+                session_class_ids.append(record.get('class_id'))
+                session_dates.append(record_date)
+                session_present.append(record.get('present_student_ids', []))
+
+            # Matrículas ativas por turma (com data de início) definem quem era esperado em cada aula
+            roster = {}
+            for enrollment in self.enrollment_service.get_active_enrollments():
+                if class_id and enrollment.class_id != class_id:
+                    continue
+                start = enrollment.enrollment_date.date() if isinstance(enrollment.enrollment_date, datetime) else None
+                roster.setdefault(enrollment.class_id, []).append((enrollment.student_id, start))
+
+            student_ids = sorted(
+                {sid for present in session_present for sid in present}
+                | {sid for members in roster.values() for sid, _ in members}
+            )
+            student_index = {sid: i for i, sid in enumerate(student_ids)}
+
+            # Ordena as aulas por data para que acumulados e sequências façam sentido
+            order = sorted(range(len(session_dates)), key=lambda i: session_dates[i])
+            num_sessions, num_students = len(order), len(student_ids)
+            presence = np.zeros((num_sessions, num_students), dtype=bool)
+            expected = np.zeros((num_sessions, num_students), dtype=bool)
+            dates = np.array([np.datetime64(session_dates[i], 'D') for i in order], dtype='datetime64[D]')
+            hours = np.full(num_sessions, -1, dtype=np.int16)
+
+            for row, i in enumerate(order):
+                cols = [student_index[sid] for sid in session_present[i] if sid in student_index]
+                presence[row, cols] = True
+
+                members = roster.get(session_class_ids[i], [])
+                cols = [student_index[sid] for sid, start in members if start is None or start <= session_dates[i]]
+                expected[row, cols] = True
+
+                hours[row] = self._session_hour(classes_map.get(session_class_ids[i]), session_dates[i])
+
+            # Quem compareceu sem estar matriculado também conta como esperado naquela aula
+            expected |= presence
+
+            return {
+                'student_ids': student_ids,
+                'dates': dates,
+                'hours': hours,
+                'presence': presence,
+                'expected': expected
+            }
+
+        key = ('period', start_date, end_date, class_id)
+        return self._cache.get_or_load(key, load)
+
+    @staticmethod
+    def _session_hour(target_class, session_date):
+        """Hora de início da aula no dia da semana da sessão (ou -1 se desconhecida)."""
+        if not target_class:
+            return -1
+        day_name = WEEKDAY_NAMES[session_date.weekday()]
+        for slot in target_class.schedule:
+            if slot.day_of_week == day_name and slot.start_time:
+                try:
+                    return int(slot.start_time.split(':')[0])
+                except ValueError:
+                    return -1
+        return -1
+
+    def get_occupancy_heatmap(self, start_date, end_date, class_id=None):
+        """
+        Ocupação média por dia da semana × hora de início das aulas.
+        Retorna matrizes 7×24 de número de aulas, presenças e média de presentes.
+        """
+        def compute():
+            period = self.get_attendance_matrix(start_date, end_date, class_id)
+            presence, hours = period['presence'], period['hours']
+
+            sessions = np.zeros((7, 24), dtype=np.int64)
+            attendees = np.zeros((7, 24), dtype=np.int64)
+            valid = hours >= 0
+            if valid.any():
+                # datetime64[D] conta dias desde 1970-01-01 (uma quinta-feira, weekday 3)
+                weekdays = ((period['dates'].astype(np.int64) + 3) % 7)[valid]
+                counts = presence.sum(axis=1)[valid]
+                np.add.at(sessions, (weekdays, hours[valid]), 1)
+                np.add.at(attendees, (weekdays, hours[valid]), counts)
+
+            average = np.divide(attendees, sessions, out=np.zeros((7, 24)), where=sessions > 0)
+            return {
+                'weekdays': WEEKDAY_NAMES,
+                'hours': list(range(24)),
+                'sessions': sessions.tolist(),
+                'total_presences': attendees.tolist(),
+                'average_presence': np.round(average, 2).tolist()
+            }
+
+        return self._cache.get_or_load(('heatmap', start_date, end_date, class_id), compute)
+
+    def get_student_trends(self, start_date, end_date, class_id=None, window_weeks=4):
+        """
+        Para cada aluno: taxa de presença no período, série semanal de taxa móvel
+        (janela de `window_weeks` semanas), sequência atual e maior sequência de
+        presenças consecutivas nas aulas em que era esperado.
+        """
+        def compute():
+            period = self.get_attendance_matrix(start_date, end_date, class_id)
+            presence, expected = period['presence'], period['expected']
+            student_ids = period['student_ids']
+            if not student_ids:
+                return {'weeks': [], 'students': []}
+
+            attended_total = presence.sum(axis=0)
+            expected_total = expected.sum(axis=0)
+            rate = np.divide(attended_total, expected_total, out=np.zeros(len(student_ids)), where=expected_total > 0)
+
+            # --- Taxa móvel semanal ---
+            week_start = np.datetime64(start_date - timedelta(days=start_date.weekday()), 'D')
+            num_weeks = int((np.datetime64(end_date, 'D') - week_start).astype(int) // 7) + 1
+            week_idx = ((period['dates'] - week_start).astype(int) // 7).clip(0, num_weeks - 1)
+            weekly_attended = np.zeros((num_weeks, len(student_ids)), dtype=np.int64)
+            weekly_expected = np.zeros((num_weeks, len(student_ids)), dtype=np.int64)
+            np.add.at(weekly_attended, week_idx, presence)
+            np.add.at(weekly_expected, week_idx, expected)
+
+            window = max(1, int(window_weeks))
+            rolling_attended = self._rolling_sum(weekly_attended, window)
+            rolling_expected = self._rolling_sum(weekly_expected, window)
+            rolling_rate = np.divide(
+                rolling_attended, rolling_expected,
+                out=np.full(rolling_attended.shape, np.nan), where=rolling_expected > 0
+            )
+
+            # --- Sequências de presença ---
+            # Aulas em que o aluno não era esperado não contam nem quebram a sequência.
+            attended_count = np.cumsum(presence, axis=0)
+            missed = expected & ~presence
+            count_at_last_miss = np.maximum.accumulate(np.where(missed, attended_count, 0), axis=0)
+            streaks = attended_count - count_at_last_miss
+            if len(streaks):
+                current_streak, longest_streak = streaks[-1], streaks.max(axis=0)
+            else:
+                current_streak = longest_streak = np.zeros(len(student_ids), dtype=np.int64)
+
+            names = self.user_service.get_student_names_map()
+            weeks = [str(week_start + np.timedelta64(7 * w, 'D')) for w in range(num_weeks)]
+            students = []
+            for col, sid in enumerate(student_ids):
+                series = rolling_rate[:, col]
+                students.append({
+                    'id': sid,
+                    'name': names.get(sid, 'Aluno Desconhecido'),
+                    'presence_count': int(attended_total[col]),
+                    'expected_count': int(expected_total[col]),
+                    'attendance_rate': round(float(rate[col]) * 100, 2),
+                    'rolling_rate': [None if np.isnan(v) else round(float(v) * 100, 2) for v in series],
+                    'current_streak': int(current_streak[col]),
+                    'longest_streak': int(longest_streak[col])
+                })
+            students.sort(key=lambda s: s['name'] or '')
+            return {'weeks': weeks, 'window_weeks': window, 'students': students}
+
+        try:
+            return self._cache.get_or_load(('trends', start_date, end_date, class_id, window_weeks), compute)
+        except Exception as e:
+            logging.error(f"Erro ao calcular tendências de frequência: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _rolling_sum(matrix, window):
+        """Soma móvel ao longo do eixo 0 (janela terminando em cada linha)."""
+        cumulative = np.cumsum(matrix, axis=0)
+        shifted = np.zeros_like(cumulative)
+        if window < len(cumulative):
+            shifted[window:] = cumulative[:-window]
+        return cumulative - shifted
@@ -1,8 +1,27 @@
+import os
 from datetime import datetime, date
+import csv
+import io
+import json
+import logging
 from firebase_admin import firestore
 from app.models.attendance import Attendance
+from app.utils.cache import TTLCache
 import calendar
 
+WEEKDAY_NAMES = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
+
+# Limite de operações por lote de escrita do Firestore
+BATCH_LIMIT = 500
+
+EXPORT_FIELDS = ['date', 'class_id', 'class_name', 'student_id', 'student_name']
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# Por quanto tempo (s) um check-in do Kiosk (aluno + turma + dia) dispensa nova escrita. Cobre a
+# rajada de quadros de um aluno parado na frente do tablet; curto porque as edições da chamada
+# feitas pela API principal (outro serviço) não limpam este cache do serviço do Kiosk
+CHECKIN_DEDUP_SECONDS = float(os.getenv('KIOSK_CHECKIN_DEDUP_SECONDS', 60))
+
 class AttendanceService:
     def __init__(self, db, user_service, enrollment_service, training_class_service):
         self.db = db
@@ -10,6 +29,8 @@ class AttendanceService:
         self.enrollment_service = enrollment_service
         self.training_class_service = training_class_service
         self.collection = self.db.collection('attendance')
+        # (turma, data, aluno) já registrados pelo Kiosk nesta instância; cada check-in expira sozinho
+        self._recent_checkins = TTLCache(CHECKIN_DEDUP_SECONDS, 2048)
 
     def get_available_semesters(self, class_id):
         """
@@ -70,6 +91,37 @@ class AttendanceService:
                         
         return total_days
 
+    def _validate_attendance_date(self, target_class, attendance_date):
+        """
+        Garante que a data da chamada cai em um dia de aula da turma.
+        Lança ValueError com uma mensagem amigável caso contrário.
+        """
+        if not target_class or not target_class.schedule:
+            raise ValueError("Turma não encontrada ou não possui horários definidos.")
+
+        scheduled_days_of_week = {slot.day_of_week for slot in target_class.schedule}
+        attendance_day_name = WEEKDAY_NAMES[attendance_date.weekday()]
+
+        if attendance_day_name not in scheduled_days_of_week:
+            # A mensagem de erro agora é mais detalhada, incluindo a data selecionada.
+            data_formatada = attendance_date.strftime('%d/%m/%Y')
+            raise ValueError(
+                f"A data selecionada ({data_formatada}) é uma {attendance_day_name}. "
+                f"As aulas para esta turma ocorrem somente em: {', '.join(sorted(scheduled_days_of_week))}."
+            )
+
+    def _build_attendance_write(self, class_id, date_str, present_student_ids):
+        """Monta a referência e o payload de um registro de chamada."""
+        attendance_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        doc_ref = self.collection.document(f"{class_id}_{date_str}")
+        attendance_data = {
+            'class_id': class_id,
+            'date': datetime.combine(attendance_date, datetime.min.time()),
+            'present_student_ids': present_student_ids,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        }
+        return doc_ref, attendance_data
+
     def create_or_update_attendance(self, data):
         """
         Cria ou atualiza um registro de chamada para uma turma em uma data específica,
@@ -87,44 +139,105 @@ class AttendanceService:
 
             # --- VALIDAÇÃO DO DIA DA SEMANA ---
             target_class = self.training_class_service.get_class_by_id(class_id)
-            if not target_class or not target_class.schedule:
-                raise ValueError("Turma não encontrada ou não possui horários definidos.")
-
-            scheduled_days_of_week = {slot.day_of_week for slot in target_class.schedule}
-            
-            weekday_map_to_str = {
-                0: 'Segunda', 1: 'Terça', 2: 'Quarta', 3: 'Quinta',
-                4: 'Sexta', 5: 'Sábado', 6: 'Domingo'
-            }
-            attendance_day_name = weekday_map_to_str.get(attendance_date.weekday())
-
-            if attendance_day_name not in scheduled_days_of_week:
-                # A mensagem de erro agora é mais detalhada, incluindo a data selecionada.
-                data_formatada = attendance_date.strftime('%d/%m/%Y')
-                raise ValueError(
-                    f"A data selecionada ({data_formatada}) é uma {attendance_day_name}. "
-                    f"As aulas para esta turma ocorrem somente em: {', '.join(sorted(scheduled_days_of_week))}."
-                )
+            self._validate_attendance_date(target_class, attendance_date)
             # --- FIM DA VALIDAÇÃO ---
 
-            doc_id = f"{class_id}_{date_str}"
-            doc_ref = self.collection.document(doc_id)
-
-            attendance_datetime = datetime.combine(attendance_date, datetime.min.time())
-
-            attendance_data = {
-                'class_id': class_id,
-                'date': attendance_datetime,
-                'present_student_ids': present_student_ids,
-                'updated_at': firestore.SERVER_TIMESTAMP
-            }
-
+            doc_ref, attendance_data = self._build_attendance_write(class_id, date_str, present_student_ids)
             doc_ref.set(attendance_data, merge=True)
+            # A chamada foi sobrescrita (ex: professor removeu um aluno); o Kiosk volta a gravar
+            self._recent_checkins.invalidate()
             return True
         except Exception as e:
             print(f"Erro ao salvar chamada: {e}")
             raise e
 
+    def register_checkin(self, class_id, date_str, student_ids):
+        """
+        Acrescenta alunos à chamada do dia (check-in do Kiosk) sem sobrescrever
+        quem já estava presente. Alunos que fizeram check-in nesta aula há menos
+        de CHECKIN_DEDUP_SECONDS (1 minuto por padrão) são ignorados sem ir ao Firestore.
+
+        Retorna a lista de alunos efetivamente gravados.
+        """
+        new_ids = [
+            sid for sid in dict.fromkeys(student_ids)
+            if self._recent_checkins.get((class_id, date_str, sid)) is None
+        ]
+        if not new_ids:
+            return []
+        doc_ref, attendance_data = self._build_attendance_write(class_id, date_str, firestore.ArrayUnion(new_ids))
+        doc_ref.set(attendance_data, merge=True)
+        for sid in new_ids:
+            self._recent_checkins.set((class_id, date_str, sid), True)
+        return new_ids
+
+    def bulk_create_or_update_attendance(self, entries):
+        """
+        Sincroniza várias chamadas de uma vez (ex: dispositivo do professor que
+        ficou offline). Valida cada entrada contra o mapa de horários em cache e
+        grava em lotes de até 500 operações.
+
+        Retorna um resumo e o resultado de cada entrada, na mesma ordem recebida.
+        """
+        results = [None] * len(entries)
+        classes_map = self.training_class_service.get_classes_map()
+
+        # Valida tudo antes de escrever. Se a mesma chamada (turma + data) vier
+        # repetida, apenas a última ocorrência é gravada.
+        valid_by_doc_id = {}
+        for index, entry in enumerate(entries):
+            class_id = entry.get('class_id') if isinstance(entry, dict) else None
+            date_str = entry.get('date') if isinstance(entry, dict) else None
+            result = {'index': index, 'class_id': class_id, 'date': date_str}
+            try:
+                if not class_id or not date_str:
+                    raise ValueError("class_id e date são obrigatórios.")
+                if not isinstance(class_id, str) or not isinstance(date_str, str):
+                    raise ValueError("class_id e date devem ser textos (date no formato AAAA-MM-DD).")
+                present_student_ids = entry.get('present_student_ids', [])
+                if not isinstance(present_student_ids, list):
+                    raise ValueError("present_student_ids deve ser uma lista.")
+
+                attendance_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+                self._validate_attendance_date(classes_map.get(class_id), attendance_date)
+
+                doc_id = f"{class_id}_{date_str}"
+                previous = valid_by_doc_id.get(doc_id)
+                if previous is not None:
+                    results[previous[0]]['status'] = 'superseded'
+                valid_by_doc_id[doc_id] = (index, present_student_ids)
+                result['status'] = 'pending'
+            except ValueError as ve:
+                result['status'] = 'error'
+                result['error'] = str(ve)
+            results[index] = result
+
+        pending = list(valid_by_doc_id.values())
+        for chunk_start in range(0, len(pending), BATCH_LIMIT):
+            chunk = pending[chunk_start:chunk_start + BATCH_LIMIT]
+            batch = self.db.batch()
+            for index, present_student_ids in chunk:
+                entry = results[index]
+                doc_ref, attendance_data = self._build_attendance_write(entry['class_id'], entry['date'], present_student_ids)
+                batch.set(doc_ref, attendance_data, merge=True)
+            try:
+                batch.commit()
+                self._recent_checkins.invalidate()
+                for index, _ in chunk:
+                    results[index]['status'] = 'saved'
+            except Exception as e:
+                logging.error(f"Erro ao gravar lote de chamadas: {e}", exc_info=True)
+                for index, _ in chunk:
+                    results[index]['status'] = 'error'
+                    results[index]['error'] = "Falha ao gravar a chamada."
+
+        summary = {
+            'saved': sum(1 for r in results if r['status'] == 'saved'),
+            'superseded': sum(1 for r in results if r['status'] == 'superseded'),
+            'failed': sum(1 for r in results if r['status'] == 'error')
+        }
+        return {'summary': summary, 'results': results}
+
     def get_attendance_history_for_class(self, class_id, year, semester):
         """
         Busca o histórico de chamadas e calcula o percentual de presença dos alunos
@@ -178,3 +291,67 @@ class AttendanceService:
             print(f"Erro ao buscar histórico de chamadas para a turma {class_id}: {e}")
             raise e
 
+    def iter_attendance_records(self, class_id=None, student_id=None, start_date=None, end_date=None, page_size=500):
+        """
+        Percorre os registros da coleção 'attendance' em páginas ordenadas por data,
+        sem carregar todo o histórico em memória. Gera (doc_id, dict) por registro.
+        """
+        query = self.collection
+        if class_id:
+            query = query.where(filter=firestore.FieldFilter('class_id', '==', class_id))
+        if student_id:
+            query = query.where(filter=firestore.FieldFilter('present_student_ids', 'array_contains', student_id))
+        if start_date:
+            query = query.where(filter=firestore.FieldFilter('date', '>=', datetime.combine(start_date, datetime.min.time())))
+        if end_date:
+            query = query.where(filter=firestore.FieldFilter('date', '<=', datetime.combine(end_date, datetime.min.time())))
+        query = query.order_by('date').limit(page_size)
+
+        last_doc = None
+        while True:
+            page = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page.stream())
+            for doc in docs:
+                yield doc.id, doc.to_dict()
+            if len(docs) < page_size:
+                break
+            last_doc = docs[-1]
+
+    def stream_attendance_export(self, fmt='csv', class_id=None, student_id=None, start_date=None, end_date=None):
+        """
+        Gera a exportação de presenças (uma linha por aluno presente em cada aula)
+        em CSV ou NDJSON, pedaço a pedaço, para uso com respostas em streaming.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Formato inválido. Use um de: {', '.join(EXPORT_FORMATS)}.")
+
+        student_names = self.user_service.get_student_names_map()
+        classes_map = self.training_class_service.get_classes_map()
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(EXPORT_FIELDS)
+            yield buffer.getvalue()
+
+        for _, record in self.iter_attendance_records(class_id, student_id, start_date, end_date):
+            record_date = record.get('date')
+            date_str = record_date.strftime('%Y-%m-%d') if isinstance(record_date, (datetime, date)) else str(record_date)
+            record_class_id = record.get('class_id')
+            target_class = classes_map.get(record_class_id)
+            class_name = target_class.name if target_class else 'Turma desconhecida'
+
+            present_ids = record.get('present_student_ids', [])
+            if student_id:
+                present_ids = [sid for sid in present_ids if sid == student_id]
+
+            buffer.seek(0)
+            buffer.truncate()
+            for sid in present_ids:
+                row = [date_str, record_class_id, class_name, sid, student_names.get(sid, 'Aluno Desconhecido')]
+                if fmt == 'csv':
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + '\n')
+            if buffer.tell():
+                yield buffer.getvalue()
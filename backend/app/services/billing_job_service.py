@@ -0,0 +1,366 @@
+import os
+import uuid
+import string
+import logging
+import calendar
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from firebase_admin import firestore
+
+# Faixas de IDs de matrícula processadas em paralelo (cada uma com o seu cursor)
+DEFAULT_PARTITIONS = int(os.getenv('BILLING_JOB_PARTITIONS', 4))
+# Threads que processam faixas neste processo
+DEFAULT_WORKERS = int(os.getenv('BILLING_JOB_WORKERS', 4))
+# Matrículas lidas por página; o cursor é gravado no job ao fim de cada página
+PAGE_SIZE = 200
+# Tempo sem progresso após o qual outra thread/instância pode assumir a faixa
+LEASE_SECONDS = 120
+# Tentativas por faixa antes de marcá-la como falha
+MAX_ATTEMPTS = 3
+# Erros guardados no documento do job (os mais recentes)
+MAX_ERRORS = 50
+
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# Ordem em que o Firestore compara os IDs automáticos (dígitos < maiúsculas < minúsculas)
+_ID_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+
+def partition_bounds(count):
+    """
+    Divide o espaço de IDs automáticos do Firestore em `count` faixas
+    contíguas [início, fim). A primeira começa em None e a última termina em
+    None, então IDs fora do alfabeto também ficam cobertos.
+    """
+    count = max(1, min(count, len(_ID_ALPHABET)))
+    cuts = [_ID_ALPHABET[len(_ID_ALPHABET) * i // count] for i in range(1, count)]
+    starts = [None] + cuts
+    ends = cuts + [None]
+    return list(zip(starts, ends))
+
+
+class BillingJobService:
+    """
+    Geração das mensalidades como job em segundo plano, persistido em
+    'billing_jobs/monthly_{aaaamm}'.
+
+    As matrículas ativas são divididas em faixas de ID; cada faixa guarda um
+    cursor (último ID processado), contadores e uma concessão (`lease_until`)
+    renovada a cada página. Uma faixa sem progresso por LEASE_SECONDS (ex:
+    instância reiniciada) pode ser assumida por outra thread ou instância:
+    o job retoma do cursor a cada consulta de progresso, ao ser disparado de
+    novo ou pelo script billing_job.py. As faturas têm ID determinístico e
+    são criadas com `create`, então reprocessar uma página não duplica nada.
+
+    No Cloud Run, as threads só têm CPU garantida enquanto há requisições em
+    andamento; o painel consulta o progresso enquanto o job roda, e uma
+    execução interrompida é retomada na consulta seguinte.
+    """
+    def __init__(self, db, payment_service, enrollment_service, partitions=DEFAULT_PARTITIONS,
+                 max_workers=DEFAULT_WORKERS, page_size=PAGE_SIZE, lease_seconds=LEASE_SECONDS):
+        self.db = db
+        self.collection = self.db.collection('billing_jobs')
+        self.payment_service = payment_service
+        self.enrollment_service = enrollment_service
+        self.partitions = partitions
+        self.page_size = page_size
+        self.lease_seconds = lease_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='billing-job')
+        # Faixas em andamento neste processo (evita submeter a mesma duas vezes)
+        self._running = set()
+        self._running_lock = threading.Lock()
+
+    @staticmethod
+    def job_id(year, month):
+        return f"monthly_{int(year):04d}{int(month):02d}"
+
+    # --- Início e progresso ---
+
+    def start_monthly_billing(self, year, month, started_by=None):
+        """
+        Inicia (ou retoma) a geração das mensalidades do mês e retorna na hora.
+        Se já existe um job em andamento para o mês, ele é reaproveitado.
+        Retorna (progresso do job, True se uma nova execução foi criada).
+        """
+        year, month = int(year), int(month)
+        if not 1 <= month <= 12:
+            raise ValueError("Mês inválido.")
+        job_ref = self.collection.document(self.job_id(year, month))
+        total = self.enrollment_service.count_active_enrollments()
+
+        @firestore.transactional
+        def create_run(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            previous = snapshot.to_dict() if snapshot.exists else None
+            if previous and previous.get('status') == RUNNING:
+                return False
+            now = datetime.now(timezone.utc)
+            transaction.set(job_ref, {
+                'type': 'monthly_billing',
+                'year': year,
+                'month': month,
+                'run': (previous or {}).get('run', 0) + 1,
+                'status': RUNNING,
+                'total': total,
+                'processed': 0,
+                'generated': 0,
+                'skipped': 0,
+                'dropped': 0,
+                'errors': [],
+                'partitions': {
+                    str(key): {
+                        'start': start, 'end': end, 'cursor': None, 'done': False, 'failed': False,
+                        'attempts': 0, 'lease_until': None, 'owner': None,
+                        'processed': 0, 'generated': 0, 'skipped': 0
+                    }
+                    for key, (start, end) in enumerate(partition_bounds(self.partitions))
+                },
+                'started_by': started_by,
+                'created_at': now,
+                'updated_at': now,
+                'finished_at': None
+            })
+            return True
+
+        created = create_run(self.db.transaction())
+        job = self._dispatch(job_ref.id)
+        return job, created
+
+    def get_job_progress(self, job_id):
+        """
+        Retorna o estado do job (ou None) para o painel acompanhar. Faixas
+        paradas com a concessão vencida são retomadas aqui.
+        """
+        return self._dispatch(job_id)
+
+    def resume_running_jobs(self):
+        """Retoma todos os jobs ainda em andamento (ex: chamado periodicamente pelo billing_job.py)."""
+        docs = self.collection.where(filter=firestore.FieldFilter('status', '==', RUNNING)).stream()
+        return [self._dispatch(doc.id) for doc in docs]
+
+    def wait(self, poll_seconds=1.0):
+        """Aguarda as faixas em andamento neste processo (usado pelo script de linha de comando)."""
+        while True:
+            with self._running_lock:
+                if not self._running:
+                    return
+            time.sleep(poll_seconds)
+
+    def _dispatch(self, job_id):
+        snapshot = self.collection.document(job_id).get()
+        if not snapshot.exists:
+            return None
+        job = snapshot.to_dict()
+        if job.get('status') == RUNNING:
+            now = datetime.now(timezone.utc)
+            for key, part in job.get('partitions', {}).items():
+                lease = part.get('lease_until')
+                if part.get('done') or part.get('failed') or (lease and lease > now):
+                    continue
+                with self._running_lock:
+                    if (job_id, key) in self._running:
+                        continue
+                    self._running.add((job_id, key))
+                self._executor.submit(self._run_partition, job_id, key)
+        return self._progress(job_id, job)
+
+    @staticmethod
+    def _progress(job_id, job):
+        total = job.get('total')
+        partitions = job.get('partitions', {})
+        return {
+            'id': job_id,
+            'year': job.get('year'),
+            'month': job.get('month'),
+            'run': job.get('run'),
+            'status': job.get('status'),
+            'total': total,
+            'processed': job.get('processed', 0),
+            'generated': job.get('generated', 0),
+            'skipped': job.get('skipped', 0),
+            'dropped': job.get('dropped', 0),
+            'percent': min(100, round(100 * job.get('processed', 0) / total)) if total else None,
+            'partitions_done': sum(1 for p in partitions.values() if p.get('done')),
+            'partitions_failed': sum(1 for p in partitions.values() if p.get('failed')),
+            'partitions_total': len(partitions),
+            'errors': job.get('errors', []),
+            'created_at': job.get('created_at'),
+            'updated_at': job.get('updated_at'),
+            'finished_at': job.get('finished_at')
+        }
+
+    # --- Execução de uma faixa ---
+
+    def _run_partition(self, job_id, key):
+        job_ref = self.collection.document(job_id)
+        token = uuid.uuid4().hex
+        retry = False
+        try:
+            claimed = self._claim_partition(job_ref, key, token)
+            if claimed is None:
+                return
+            job, part = claimed
+            self._process_partition(job_ref, key, token, job, part)
+        except Exception as e:
+            logging.error(f"Erro na cobrança em lote {job_id} (faixa {key}): {e}", exc_info=True)
+            retry = self._record_failure(job_ref, key, token, e)
+        finally:
+            if retry:
+                # Nova tentativa a partir do cursor salvo (até MAX_ATTEMPTS)
+                self._executor.submit(self._run_partition, job_id, key)
+            else:
+                with self._running_lock:
+                    self._running.discard((job_id, key))
+
+    def _claim_partition(self, job_ref, key, token):
+        """Assume a faixa se ela está livre (sem concessão válida). Retorna (job, faixa) ou None."""
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            job = snapshot.to_dict()
+            part = job.get('partitions', {}).get(key)
+            now = datetime.now(timezone.utc)
+            if job.get('status') != RUNNING or part is None or part.get('done') or part.get('failed'):
+                return None
+            if part.get('lease_until') and part['lease_until'] > now:
+                return None
+            transaction.update(job_ref, {
+                f'partitions.{key}.owner': token,
+                f'partitions.{key}.lease_until': now + timedelta(seconds=self.lease_seconds),
+                'updated_at': now
+            })
+            return job, part
+
+        return claim(self.db.transaction())
+
+    def _process_partition(self, job_ref, key, token, job, part):
+        year, month = int(job['year']), int(job['month'])
+        _, last_day_of_month = calendar.monthrange(year, month)
+        all_classes = {c['id']: c for c in self.enrollment_service.training_class_service.get_all_classes()}
+        billed = self.payment_service.get_billed_enrollment_ids(year, month)
+        cursor = part.get('cursor')
+
+        while True:
+            page = self.enrollment_service.get_active_enrollments_page(
+                part.get('start'), part.get('end'), cursor, self.page_size
+            )
+            if not page:
+                break
+            now = datetime.now(timezone.utc)
+            new_payments, skipped = [], 0
+            detailed = self.enrollment_service.with_billing_details(page, all_classes)
+            detailed_ids = {e['enrollment_id'] for e in detailed}
+            dropped = [e['enrollment_id'] for e in page if e['enrollment_id'] not in detailed_ids]
+            for enrollment in detailed:
+                enrollment_id = enrollment['enrollment_id']
+                if enrollment_id in billed:
+                    skipped += 1
+                    continue
+                payment_data = self.payment_service.build_monthly_payment(enrollment, year, month, last_day_of_month, now)
+                if payment_data is not None:
+                    new_payments.append((self.payment_service.monthly_payment_id(enrollment_id, year, month), payment_data))
+
+            generated, raced = self.payment_service.create_payments(new_payments)
+            cursor = page[-1]['enrollment_id']
+            if not self._save_progress(job_ref, key, token, {
+                'cursor': cursor, 'processed': len(page), 'generated': generated, 'skipped': skipped + raced,
+                'dropped': dropped
+            }):
+                logging.warning(f"Cobrança em lote {job_ref.id}: faixa {key} assumida por outra execução.")
+                return
+            if len(page) < self.page_size:
+                break
+
+        self._finish_partition(job_ref, key, token)
+
+    def _save_progress(self, job_ref, key, token, progress):
+        """Grava o cursor e os contadores da página, renovando a concessão. False se a faixa mudou de dono."""
+        @firestore.transactional
+        def save(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            job = (snapshot.to_dict() or {}) if snapshot.exists else {}
+            part = job.get('partitions', {}).get(key)
+            if part is None or part.get('owner') != token:
+                return False
+            now = datetime.now(timezone.utc)
+            updates = {
+                f'partitions.{key}.cursor': progress['cursor'],
+                f'partitions.{key}.lease_until': now + timedelta(seconds=self.lease_seconds),
+                f'partitions.{key}.processed': firestore.Increment(progress['processed']),
+                f'partitions.{key}.generated': firestore.Increment(progress['generated']),
+                f'partitions.{key}.skipped': firestore.Increment(progress['skipped']),
+                'processed': firestore.Increment(progress['processed']),
+                'generated': firestore.Increment(progress['generated']),
+                'skipped': firestore.Increment(progress['skipped']),
+                'updated_at': now
+            }
+            dropped = progress.get('dropped') or []
+            if dropped:
+                # Matrículas sem aluno ou turma: contam como lidas, mas ficam registradas para conferência
+                updates['dropped'] = firestore.Increment(len(dropped))
+                updates['errors'] = (job.get('errors', []) + [{
+                    'partition': key, 'cursor': progress['cursor'], 'attempt': part.get('attempts', 0),
+                    'message': f"Matrícula {enrollment_id} não cobrada: aluno ou turma não encontrados",
+                    'at': now
+                } for enrollment_id in dropped])[-MAX_ERRORS:]
+            transaction.update(job_ref, updates)
+            return True
+
+        return save(self.db.transaction())
+
+    def _finish_partition(self, job_ref, key, token, error=None):
+        """
+        Marca a faixa como concluída (ou, com `error`, registra a falha e a
+        libera para nova tentativa) e fecha o job quando todas terminaram.
+        Retorna True se a faixa falhou e ainda pode ser tentada de novo.
+        """
+        @firestore.transactional
+        def finish(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None, False
+            job = snapshot.to_dict()
+            partitions = job.get('partitions', {})
+            part = partitions.get(key)
+            if part is None or part.get('owner') != token:
+                return None, False
+            now = datetime.now(timezone.utc)
+            updates = {f'partitions.{key}.lease_until': None, f'partitions.{key}.owner': None, 'updated_at': now}
+            if error is None:
+                updates[f'partitions.{key}.done'] = True
+                part = {**part, 'done': True}
+            else:
+                attempts = part.get('attempts', 0) + 1
+                updates[f'partitions.{key}.attempts'] = attempts
+                updates['errors'] = (job.get('errors', []) + [{
+                    'partition': key, 'cursor': part.get('cursor'), 'attempt': attempts,
+                    'message': str(error), 'at': now
+                }])[-MAX_ERRORS:]
+                if attempts >= MAX_ATTEMPTS:
+                    updates[f'partitions.{key}.failed'] = True
+                    part = {**part, 'failed': True}
+
+            partitions = {**partitions, key: part}
+            if all(p.get('done') or p.get('failed') for p in partitions.values()):
+                updates['status'] = FAILED if any(p.get('failed') for p in partitions.values()) else COMPLETED
+                updates['finished_at'] = now
+            transaction.update(job_ref, updates)
+            return updates.get('status'), error is not None and not part.get('failed')
+
+        status, retry = finish(self.db.transaction())
+        if status:
+            logging.info(f"Cobrança em lote {job_ref.id} finalizada: {status}")
+        return retry
+
+    def _record_failure(self, job_ref, key, token, error):
+        try:
+            return self._finish_partition(job_ref, key, token, error=error)
+        except Exception as e:
+            logging.error(f"Erro ao registrar falha da cobrança em lote {job_ref.id}: {e}", exc_info=True)
+            return False
@@ -0,0 +1,156 @@
+from datetime import datetime, date, timedelta, timezone
+import logging
+import numpy as np
+from firebase_admin import firestore
+
+# Pesos de cada fator no score final (soma = 1)
+RISK_WEIGHTS = {
+    'absence': 0.40,   # faltas nas aulas esperadas dos últimos 30 dias
+    'recency': 0.25,   # dias desde a última presença
+    'overdue': 0.25,   # mensalidades vencidas em aberto
+    'tenure': 0.10     # alunos recentes desistem com mais frequência
+}
+RECENT_WINDOW_DAYS = 30
+LOOKBACK_DAYS = 90
+MAX_RANKED_STUDENTS = 500
+
+
+class ChurnRiskService:
+    """
+    Calcula o risco de evasão de cada aluno ativo a partir de frequência,
+    pagamentos em atraso e tempo de matrícula, e grava o ranking em um único
+    documento ('analytics/churn_risk') para leitura O(1) pelo dashboard.
+    """
+    def __init__(self, db, enrollment_service, attendance_analytics_service, user_service):
+        self.db = db
+        self.enrollment_service = enrollment_service
+        self.attendance_analytics_service = attendance_analytics_service
+        self.user_service = user_service
+        self.payments_collection = self.db.collection('payments')
+
+    @property
+    def result_ref(self):
+        # Resolvida a cada uso, no cliente do Firestore do processo atual (ver app.models.db)
+        return self.db.collection('analytics').document('churn_risk')
+
+    def compute_scores(self, today=None):
+        """Retorna a lista de alunos ativos ordenada do maior para o menor risco."""
+        today = today or date.today()
+
+        # --- Alunos ativos e tempo de matrícula ---
+        first_enrollment = {}
+        for enrollment in self.enrollment_service.get_active_enrollments():
+            enrolled_on = enrollment.enrollment_date.date() if isinstance(enrollment.enrollment_date, datetime) else today
+            current = first_enrollment.get(enrollment.student_id)
+            if current is None or enrolled_on < current:
+                first_enrollment[enrollment.student_id] = enrolled_on
+
+        student_ids = sorted(first_enrollment)
+        if not student_ids:
+            return []
+        index = {sid: i for i, sid in enumerate(student_ids)}
+        num_students = len(student_ids)
+        today_day = np.datetime64(today, 'D')
+
+        enrollment_age = (today_day - np.array([np.datetime64(first_enrollment[s], 'D') for s in student_ids])).astype(np.int64)
+
+        # --- Frequência (matriz aulas × alunos do período) ---
+        period = self.attendance_analytics_service.get_attendance_matrix(today - timedelta(days=LOOKBACK_DAYS), today)
+        cols = np.array([index.get(sid, -1) for sid in period['student_ids']], dtype=np.int64)
+        known = cols >= 0
+        presence = period['presence'][:, known]
+        expected = period['expected'][:, known]
+        cols = cols[known]
+        dates = period['dates']
+
+        recent = dates >= today_day - np.timedelta64(RECENT_WINDOW_DAYS, 'D')
+        attended_recent = np.zeros(num_students, dtype=np.int64)
+        expected_recent = np.zeros(num_students, dtype=np.int64)
+        attended_recent[cols] = presence[recent].sum(axis=0)
+        expected_recent[cols] = expected[recent].sum(axis=0)
+
+        # Última presença de cada aluno (dias desde 1970); sem presença = início da janela
+        no_show = (today_day - np.timedelta64(LOOKBACK_DAYS, 'D')).astype(np.int64)
+        last_seen = np.full(num_students, no_show, dtype=np.int64)
+        if len(dates):
+            day_numbers = dates.astype(np.int64)[:, None]
+            last_seen[cols] = np.where(presence, day_numbers, no_show).max(axis=0)
+        days_since_last = today_day.astype(np.int64) - last_seen
+
+        # --- Mensalidades vencidas ---
+        overdue_count = np.zeros(num_students, dtype=np.int64)
+        overdue_amount = np.zeros(num_students, dtype=np.float64)
+        # Vencidas antes do dia de referência (`today`), para que um cálculo retroativo use a mesma data da frequência
+        start_of_today = datetime.combine(today, datetime.min.time(), tzinfo=timezone.utc)
+        overdue_docs = self.payments_collection.where(filter=firestore.And([
+            firestore.FieldFilter('status', '==', 'pending'),
+            firestore.FieldFilter('due_date', '<', start_of_today)
+        ])).select(['student_id', 'amount']).stream()
+        for doc in overdue_docs:
+            payment = doc.to_dict()
+            i = index.get(payment.get('student_id'))
+            if i is not None:
+                overdue_count[i] += 1
+                overdue_amount[i] += float(payment.get('amount') or 0)
+
+        # --- Score vetorizado (0 a 100) ---
+        attendance_rate = np.divide(
+            attended_recent, expected_recent,
+            out=np.ones(num_students), where=expected_recent > 0
+        )
+        factors = {
+            'absence': 1.0 - attendance_rate,
+            'recency': np.minimum(days_since_last, 60) / 60.0,
+            'overdue': np.minimum(overdue_count, 3) / 3.0,
+            'tenure': np.exp(-enrollment_age / 180.0)
+        }
+        factor_matrix = np.stack([factors[name] * RISK_WEIGHTS[name] for name in RISK_WEIGHTS], axis=1)
+        scores = factor_matrix.sum(axis=1) * 100
+        main_factor = np.array(list(RISK_WEIGHTS))[factor_matrix.argmax(axis=1)]
+
+        order = np.argsort(-scores, kind='stable')
+        names = self.user_service.get_student_names_map()
+        ranked = []
+        for i in order:
+            sid = student_ids[i]
+            ranked.append({
+                'student_id': sid,
+                'name': names.get(sid, 'Aluno Desconhecido'),
+                'score': round(float(scores[i]), 1),
+                'main_factor': str(main_factor[i]),
+                'attendance_rate_30d': round(float(attendance_rate[i]) * 100, 1),
+                'days_since_last_attendance': int(days_since_last[i]),
+                'overdue_count': int(overdue_count[i]),
+                'overdue_amount': round(float(overdue_amount[i]), 2),
+                'enrollment_age_days': int(enrollment_age[i])
+            })
+        return ranked
+
+    def run(self, today=None):
+        """Calcula o ranking e grava o resultado no documento de análise."""
+        try:
+            ranked = self.compute_scores(today)
+            self.result_ref.set({
+                'generated_at': datetime.now(timezone.utc),
+                'total_students': len(ranked),
+                'weights': RISK_WEIGHTS,
+                'students': ranked[:MAX_RANKED_STUDENTS]
+            })
+            return len(ranked)
+        except Exception as e:
+            logging.error(f"Erro ao calcular risco de evasão: {e}", exc_info=True)
+            raise
+
+    def get_latest_ranking(self, limit=None):
+        """Lê o último ranking calculado (uma única leitura de documento)."""
+        try:
+            doc = self.result_ref.get()
+            if not doc.exists:
+                return {'generated_at': None, 'total_students': 0, 'students': []}
+            data = doc.to_dict()
+            if limit:
+                data['students'] = data.get('students', [])[:limit]
+            return data
+        except Exception as e:
+            print(f"Erro ao buscar ranking de risco de evasão: {e}")
+            return {'generated_at': None, 'total_students': 0, 'students': []}
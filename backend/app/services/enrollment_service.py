@@ -1,6 +1,8 @@
 from datetime import datetime
 from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
 from app.models.enrollment import Enrollment
+from app.utils.cache import TTLCache
 
 class EnrollmentService:
     def __init__(self, db, user_service=None, training_class_service=None):
@@ -8,6 +10,8 @@ class EnrollmentService:
         self.collection = self.db.collection('enrollments')
         self.user_service = user_service
         self.training_class_service = training_class_service
+        # Alunos ativos por turma (usado pelo Kiosk para restringir a comparação facial)
+        self._roster_cache = TTLCache(ttl_seconds=300, max_entries=2)
 
     def create_enrollment(self, data):
         """Cria uma nova matrícula, verificando se já existe."""
@@ -47,6 +51,7 @@ class EnrollmentService:
         
         doc_ref = self.collection.document()
         doc_ref.set(enrollment_data)
+        self._roster_cache.invalidate()
         
         return Enrollment.from_dict(enrollment_data, doc_ref.id)
 
@@ -93,6 +98,33 @@ class EnrollmentService:
             print(f"Erro ao buscar matrículas da turma {class_id}: {e}")
         return enrollments
 
+    def get_active_enrollments(self):
+        """Busca todas as matrículas ativas como objetos Enrollment, sem enriquecimento."""
+        enrollments = []
+        try:
+            docs = self.collection.where(filter=firestore.FieldFilter('status', '==', 'active')).stream()
+            for doc in docs:
+                enrollments.append(Enrollment.from_dict(doc.to_dict(), doc.id))
+        except Exception as e:
+            print(f"Erro ao buscar matrículas ativas: {e}")
+        return enrollments
+
+    def get_roster_map(self):
+        """
+        Retorna {class_id: set(student_ids)} das matrículas ativas, mantido em
+        cache por alguns minutos e lendo apenas os dois campos necessários.
+        """
+        return self._roster_cache.get_or_load('active', self._load_roster_map)
+
+    def _load_roster_map(self):
+        roster = {}
+        docs = self.collection.where(filter=firestore.FieldFilter('status', '==', 'active')) \
+                              .select(['class_id', 'student_id']).stream()
+        for doc in docs:
+            data = doc.to_dict() or {}
+            roster.setdefault(data.get('class_id'), set()).add(data.get('student_id'))
+        return roster
+
     def get_student_ids_by_class_id(self, class_id):
         """Retorna uma lista de IDs de alunos matriculados em uma turma."""
         student_ids = []
@@ -111,7 +143,7 @@ class EnrollmentService:
         """Busca todas as matrículas ativas e as enriquece com detalhes do aluno e da turma."""
         enrollments_details = []
         try:
-            all_students = {s.id: s for s in self.user_service.get_users_by_role('student')}
+            student_names = {s.id: s.name for s in self.user_service.get_users_by_role('student')}
             all_classes = {c['id']: c for c in self.training_class_service.get_all_classes()}
             
             active_enrollments = self.collection.where(filter=firestore.FieldFilter('status', '==', 'active')).stream()
@@ -119,30 +151,75 @@ class EnrollmentService:
             for enrollment_doc in active_enrollments:
                 enrollment_data = enrollment_doc.to_dict()
                 enrollment_data['enrollment_id'] = enrollment_doc.id
-                
-                student_info = all_students.get(enrollment_data['student_id'])
-                class_info = all_classes.get(enrollment_data['class_id'])
 
-                if not student_info or not class_info:
-                    continue
-                
-                enrollment_data['student_name'] = student_info.name
-                enrollment_data['class_name'] = class_info.get('name')
-                
-                enrollment_data['base_monthly_fee'] = class_info.get('default_monthly_fee', 0)
-                enrollment_data.setdefault('due_day', class_info.get('default_due_day', 15))
-
-                enrollments_details.append(enrollment_data)
+                enrollment_data = self._with_details(enrollment_data, student_names, all_classes)
+                if enrollment_data is not None:
+                    enrollments_details.append(enrollment_data)
 
         except Exception as e:
             print(f"Erro ao buscar e enriquecer matrículas ativas: {e}")
             
         return enrollments_details
 
+    @staticmethod
+    def _with_details(enrollment_data, student_names, all_classes):
+        """Acrescenta aluno, turma, mensalidade e vencimento; None se o aluno ou a turma não existem mais."""
+        class_info = all_classes.get(enrollment_data.get('class_id'))
+        if enrollment_data.get('student_id') not in student_names or not class_info:
+            return None
+
+        enrollment_data['student_name'] = student_names[enrollment_data['student_id']]
+        enrollment_data['class_name'] = class_info.get('name')
+
+        enrollment_data['base_monthly_fee'] = class_info.get('default_monthly_fee', 0)
+        enrollment_data.setdefault('due_day', class_info.get('default_due_day', 15))
+        return enrollment_data
+
+    def get_active_enrollments_page(self, start_id=None, end_id=None, after_id=None, page_size=200):
+        """
+        Uma página de matrículas ativas em ordem de ID, no intervalo
+        [start_id, end_id) e depois de `after_id`. Jobs em lote (ex: cobrança
+        mensal) guardam o último ID lido como cursor para retomar de onde pararam.
+        """
+        document_id = FieldPath.document_id()
+        query = self.collection.where(filter=firestore.FieldFilter('status', '==', 'active'))
+        if after_id:
+            query = query.where(filter=firestore.FieldFilter(document_id, '>', self.collection.document(after_id)))
+        elif start_id:
+            query = query.where(filter=firestore.FieldFilter(document_id, '>=', self.collection.document(start_id)))
+        if end_id:
+            query = query.where(filter=firestore.FieldFilter(document_id, '<', self.collection.document(end_id)))
+        docs = query.order_by(document_id).limit(page_size).stream()
+        return [{**doc.to_dict(), 'enrollment_id': doc.id} for doc in docs]
+
+    def with_billing_details(self, enrollments, all_classes=None):
+        """
+        Enriquece uma página de matrículas como `get_all_active_enrollments_with_details`,
+        lendo só os alunos da página (get_user_names, que não guarda em cache
+        alunos ainda inexistentes: um aluno recém-matriculado é encontrado).
+        `all_classes` ({id: dict}) pode ser passado para não reler as turmas a
+        cada página. Matrículas de aluno ou turma inexistente ficam de fora.
+        """
+        student_names = self.user_service.get_user_names(e.get('student_id') for e in enrollments)
+        if all_classes is None:
+            all_classes = {c['id']: c for c in self.training_class_service.get_all_classes()}
+        details = (self._with_details(dict(e), student_names, all_classes) for e in enrollments)
+        return [e for e in details if e is not None]
+
+    def count_active_enrollments(self):
+        """Total de matrículas ativas (consulta de agregação, sem ler os documentos)."""
+        try:
+            result = self.collection.where(filter=firestore.FieldFilter('status', '==', 'active')).count().get()
+            return int(result[0][0].value)
+        except Exception as e:
+            print(f"Erro ao contar matrículas ativas: {e}")
+            return None
+
     def delete_enrollment(self, enrollment_id):
         """Deleta uma matrícula pelo seu ID."""
         try:
             self.collection.document(enrollment_id).delete()
+            self._roster_cache.invalidate()
             return True
         except Exception as e:
             print(f"Erro ao deletar matrícula {enrollment_id}: {e}")
@@ -154,6 +231,7 @@ class EnrollmentService:
             docs = self.collection.where(filter=firestore.FieldFilter('student_id', '==', student_id)).stream()
             for doc in docs:
                 doc.reference.delete()
+            self._roster_cache.invalidate()
             return True
         except Exception as e:
             print(f"Erro ao deletar matrículas do aluno {student_id}: {e}")
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+from app.models.face_embedding import FaceEmbedding, MODEL_DLIB
+
+# Distância máxima de uma amostra até o medoide para ser aceita no cadastro
+DEFAULT_OUTLIER_DISTANCE = float(os.getenv('FACE_ENROLL_OUTLIER_DISTANCE', 0.5))
+# Quantas amostras representativas são guardadas junto com o centroide
+DEFAULT_MAX_EXEMPLARS = int(os.getenv('FACE_ENROLL_MAX_EXEMPLARS', 3))
+
+
+class FaceEnrollmentError(ValueError):
+    """As fotos do cadastro não permitem montar um embedding confiável."""
+
+
+def _pairwise_distances(vectors):
+    sq_norms = (vectors ** 2).sum(axis=1)
+    squared = sq_norms[:, None] - 2 * (vectors @ vectors.T) + sq_norms[None, :]
+    return np.sqrt(np.maximum(squared, 0))
+
+
+def select_exemplars(vectors, centroid, max_exemplars=DEFAULT_MAX_EXEMPLARS):
+    """
+    Escolhe até `max_exemplars` amostras: a mais próxima do centroide e, em
+    seguida, sempre a mais distante das já escolhidas (cobre as variações de
+    pose e iluminação em vez de repetir fotos quase iguais).
+    """
+    chosen = [int(np.argmin(np.linalg.norm(vectors - centroid, axis=1)))]
+    distances = _pairwise_distances(vectors)
+    while len(chosen) < min(max_exemplars, len(vectors)):
+        chosen.append(int(np.argmax(distances[:, chosen].min(axis=1))))
+    return chosen
+
+
+def build_enrollment_embedding(vectors, model=MODEL_DLIB, outlier_distance=DEFAULT_OUTLIER_DISTANCE,
+                               max_exemplars=DEFAULT_MAX_EXEMPLARS):
+    """
+    Combina os encodings das fotos de um cadastro em um único embedding.
+
+    1. O medoide (amostra com a menor soma de distâncias às demais) é a referência.
+    2. Amostras a mais de `outlier_distance` dele são descartadas (foto borrada,
+       outra pessoa no quadro, etc.).
+    3. O embedding gravado é o centroide das aceitas, acompanhado de algumas
+       amostras representativas.
+
+    Se as aceitas não forem a maioria, as fotos provavelmente são de pessoas
+    diferentes e FaceEnrollmentError é lançado.
+
+    Retorna {'embedding': FaceEmbedding, 'accepted': [...], 'rejected': [...],
+    'spread': maior distância de uma aceita até o centroide}, com as posições
+    relativas a `vectors`.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    if not len(vectors):
+        raise FaceEnrollmentError("Nenhum rosto encontrado nas fotos enviadas.")
+
+    distances = _pairwise_distances(vectors)
+    medoid = int(np.argmin(distances.sum(axis=1)))
+    accepted = [i for i in range(len(vectors)) if distances[medoid, i] <= outlier_distance]
+    rejected = [i for i in range(len(vectors)) if i not in accepted]
+    if len(accepted) * 2 <= len(vectors):
+        raise FaceEnrollmentError("As fotos parecem ser de pessoas diferentes. Envie fotos apenas do aluno.")
+
+    samples = vectors[accepted]
+    centroid = samples.mean(axis=0)
+    exemplars = samples[select_exemplars(samples, centroid, max_exemplars)]
+    embedding = FaceEmbedding.from_values(centroid, model)
+    embedding.exemplars = exemplars
+    embedding.sample_count = len(accepted)
+    return {
+        'embedding': embedding,
+        'accepted': accepted,
+        'rejected': rejected,
+        'spread': float(np.linalg.norm(samples - centroid, axis=1).max())
+    }
@@ -0,0 +1,443 @@
+import os
+import logging
+from abc import ABC, abstractmethod
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+class FaceIndex(ABC):
+    """
+    Base dos índices da galeria facial.
+
+    Guarda os vetores float32 (N × 128) e os IDs, com inserção/remoção
+    incremental: remoções apenas marcam a linha como morta e o espaço é
+    compactado quando as linhas mortas passam de 25%. As subclasses decidem
+    como buscar os vizinhos mais próximos.
+    """
+    kind = None
+
+    def __init__(self, dim=ENCODING_SIZE):
+        self.dim = dim
+        self._ids = np.empty(0, dtype=object)
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._row_by_id = {}
+        self.extra = {}
+
+    def __len__(self):
+        return len(self._row_by_id)
+
+    @property
+    def ids(self):
+        return self._ids[self._alive]
+
+    @property
+    def vectors(self):
+        return self._vectors[self._alive]
+
+    def get(self, student_id):
+        """Retorna o vetor guardado para um ID (ou None)."""
+        row = self._row_by_id.get(student_id)
+        return None if row is None else self._vectors[row]
+
+    def add(self, ids, vectors):
+        """Insere (ou substitui) vetores. `ids` e `vectors` têm o mesmo comprimento."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = list(ids)
+        # Um ID já existente é tratado como remoção + inserção
+        self.remove([i for i in ids if i in self._row_by_id])
+
+        first_row = len(self._ids)
+        self._ids = np.concatenate([self._ids, np.array(ids, dtype=object)])
+        self._vectors = np.vstack([self._vectors, vectors])
+        self._sq_norms = np.concatenate([self._sq_norms, (vectors ** 2).sum(axis=1)])
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        for offset, student_id in enumerate(ids):
+            self._row_by_id[student_id] = first_row + offset
+        self._on_add(np.arange(first_row, first_row + len(ids)))
+
+    def remove(self, ids):
+        rows = [self._row_by_id.pop(i) for i in ids if i in self._row_by_id]
+        if not rows:
+            return
+        self._alive[rows] = False
+        self._on_remove(np.array(rows))
+        if (~self._alive).sum() > 0.25 * len(self._alive):
+            self._compact()
+
+    def attach(self, ids, vectors):
+        """
+        Substitui o conteúdo do índice por `ids` e `vectors` sem copiar os
+        vetores (ex: a matriz publicada em memória compartilhada). O array não
+        é alterado no lugar: inclusões e compactações criam cópias privadas.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._ids = np.array(list(ids), dtype=object)
+        self._vectors = vectors
+        self._sq_norms = (vectors ** 2).sum(axis=1)
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._row_by_id = {student_id: row for row, student_id in enumerate(self._ids)}
+        self._rebuild()
+
+    def search(self, query, k):
+        """Retorna (ids, distâncias) dos k vizinhos mais próximos, em ordem crescente."""
+        if not len(self):
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        rows, distances = self._search_rows(query, min(k, len(self)))
+        return self._ids[rows], distances
+
+    def search_batch(self, queries, k):
+        """
+        Busca os k vizinhos de várias consultas (Q × 128). Retorna duas listas
+        com Q itens cada: os arrays de IDs e de distâncias de cada consulta.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if not len(self):
+            return [np.empty(0, dtype=object)] * len(queries), [np.empty(0, dtype=np.float32)] * len(queries)
+        k = min(k, len(self))
+        found_ids, found_distances = [], []
+        for rows, distances in self._search_rows_batch(queries, k):
+            found_ids.append(self._ids[rows])
+            found_distances.append(distances)
+        return found_ids, found_distances
+
+    def search_subset(self, queries, ids, k):
+        """
+        Busca exata restrita aos `ids` informados (ex: alunos das turmas em
+        horário), no mesmo formato de `search_batch`. IDs fora do índice são
+        ignorados. Com poucas dezenas de candidatos, uma multiplicação Q × C
+        é mais barata que qualquer estrutura de índice.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        rows = np.array([self._row_by_id[i] for i in ids if i in self._row_by_id], dtype=np.intp)
+        if not len(rows):
+            return [np.empty(0, dtype=object)] * len(queries), [np.empty(0, dtype=np.float32)] * len(queries)
+        vectors = self._vectors[rows]
+        squared = self._sq_norms[rows][None, :] - 2 * (queries @ vectors.T) + (queries ** 2).sum(axis=1)[:, None]
+        k = min(k, len(rows))
+        found_ids, found_distances = [], []
+        for distances in np.sqrt(np.maximum(squared, 0)):
+            subset_rows, subset_distances = self._top_k(rows, distances, k)
+            found_ids.append(self._ids[subset_rows])
+            found_distances.append(subset_distances)
+        return found_ids, found_distances
+
+    def _search_rows_batch(self, queries, k):
+        return [self._search_rows(query, k) for query in queries]
+
+    def _compact(self):
+        keep = self._alive
+        self._ids = self._ids[keep]
+        self._vectors = self._vectors[keep]
+        self._sq_norms = self._sq_norms[keep]
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._row_by_id = {student_id: row for row, student_id in enumerate(self._ids)}
+        self._rebuild()
+
+    def _distances(self, query, rows=None):
+        """
+        Distâncias euclidianas até `query` via ||v||² - 2 v·q + ||q||², usando as
+        normas pré-calculadas (um produto matriz-vetor, sem copiar a galeria).
+        """
+        if rows is None:
+            squared = self._sq_norms - 2 * (self._vectors @ query) + query @ query
+        else:
+            squared = self._sq_norms[rows] - 2 * (self._vectors[rows] @ query) + query @ query
+        return np.sqrt(np.maximum(squared, 0))
+
+    def _exhaustive_search(self, query, k):
+        distances = self._distances(query)
+        if not self._alive.all():
+            distances[~self._alive] = np.inf
+        return self._top_k(np.arange(len(distances)), distances, k)
+
+    @staticmethod
+    def _top_k(rows, distances, k):
+        if len(rows) > k:
+            part = np.argpartition(distances, k - 1)[:k]
+            rows, distances = rows[part], distances[part]
+        order = np.argsort(distances)
+        return rows[order], distances[order]
+
+    # --- Pontos de extensão ---
+
+    def _on_add(self, rows):
+        pass
+
+    def _on_remove(self, rows):
+        pass
+
+    def _rebuild(self):
+        pass
+
+    @abstractmethod
+    def _search_rows(self, query, k):
+        """Retorna (linhas, distâncias) dos k vizinhos de `query`, em ordem crescente."""
+
+    # --- Persistência ---
+
+    def _state(self):
+        return {}
+
+    def _load_state(self, state):
+        self._rebuild()
+
+    def save(self, path, **extra):
+        """
+        Grava o índice em disco (formato .npz) de forma atômica. Arrays em
+        `extra` (ex: nomes alinhados aos IDs) são gravados junto e devolvidos
+        por `load` em `index.extra`.
+        """
+        if self._alive.size and not self._alive.all():
+            self._compact()
+        arrays = {f'state_{key}': value for key, value in self._state().items()}
+        arrays.update({f'extra_{key}': value for key, value in extra.items()})
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            kind=np.array(self.kind),
+            ids=np.array([str(i) for i in self._ids]),
+            vectors=self._vectors,
+            **arrays
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **params):
+        with np.load(path, allow_pickle=False) as data:
+            index = create_face_index(str(data['kind']), **params)
+            ids = [str(i) for i in data['ids']]
+            index._ids = np.array(ids, dtype=object)
+            index._vectors = data['vectors'].astype(np.float32).reshape(-1, index.dim)
+            index._sq_norms = (index._vectors ** 2).sum(axis=1)
+            index._alive = np.ones(len(ids), dtype=bool)
+            index._row_by_id = {student_id: row for row, student_id in enumerate(ids)}
+            state = {key[len('state_'):]: data[key] for key in data.files if key.startswith('state_')}
+            index.extra = {key[len('extra_'):]: data[key] for key in data.files if key.startswith('extra_')}
+        index._load_state(state)
+        return index
+
+
+class BruteForceIndex(FaceIndex):
+    """Busca exata: distância contra todos os vetores (ideal até alguns milhares)."""
+    kind = 'brute'
+
+    def _search_rows(self, query, k):
+        return self._exhaustive_search(query, k)
+
+    def _search_rows_batch(self, queries, k):
+        # Uma única multiplicação de matrizes (Q × N) para todas as consultas
+        squared = self._sq_norms[None, :] - 2 * (queries @ self._vectors.T) + (queries ** 2).sum(axis=1)[:, None]
+        distances = np.sqrt(np.maximum(squared, 0))
+        if not self._alive.all():
+            distances[:, ~self._alive] = np.inf
+        rows = np.arange(distances.shape[1])
+        return [self._top_k(rows, row_distances, k) for row_distances in distances]
+
+
+class BallTreeIndex(FaceIndex):
+    """
+    Busca exata com Ball Tree (scikit-learn). A árvore é imutável, então
+    inserções recentes ficam em um buffer varrido por força bruta e remoções
+    são filtradas; a árvore é reconstruída quando o buffer cresce demais.
+    """
+    kind = 'balltree'
+
+    def __init__(self, dim=ENCODING_SIZE, leaf_size=40, rebuild_ratio=0.1):
+        super().__init__(dim)
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self._tree = None
+        self._tree_rows = np.empty(0, dtype=np.int64)
+        self._pending_rows = []
+
+    def _on_add(self, rows):
+        self._pending_rows.extend(rows.tolist())
+        if len(self._pending_rows) > max(64, self.rebuild_ratio * len(self._tree_rows)):
+            self._rebuild()
+
+    def _rebuild(self):
+        from sklearn.neighbors import BallTree
+        self._tree_rows = np.flatnonzero(self._alive)
+        self._pending_rows = []
+        self._tree = BallTree(self._vectors[self._tree_rows], leaf_size=self.leaf_size) if len(self._tree_rows) else None
+
+    def _search_rows(self, query, k):
+        rows_parts, dist_parts = [], []
+        if self._tree is not None:
+            # Pede alguns vizinhos a mais para compensar linhas removidas
+            dead = len(self._tree_rows) - int(self._alive[self._tree_rows].sum())
+            tree_k = min(k + dead, len(self._tree_rows))
+            distances, positions = self._tree.query(query[None, :], k=tree_k)
+            rows = self._tree_rows[positions[0]]
+            alive = self._alive[rows]
+            rows_parts.append(rows[alive])
+            dist_parts.append(distances[0][alive].astype(np.float32))
+        if self._pending_rows:
+            pending = np.array(self._pending_rows)
+            pending = pending[self._alive[pending]]
+            rows_parts.append(pending)
+            dist_parts.append(self._distances(query, pending))
+        rows = np.concatenate(rows_parts) if rows_parts else np.empty(0, dtype=np.int64)
+        distances = np.concatenate(dist_parts) if dist_parts else np.empty(0, dtype=np.float32)
+        return self._top_k(rows, distances, k)
+
+
+class IVFIndex(FaceIndex):
+    """
+    Índice aproximado no estilo IVF-SQ8: os vetores são agrupados em `nlist`
+    listas por k-means e guardados quantizados em 8 bits por dimensão. A busca
+    visita apenas as `nprobe` listas mais próximas, usando os códigos de 8 bits,
+    e reordena os `refine` melhores candidatos com os vetores float32 exatos.
+    Enquanto a galeria é pequena demais para treinar, funciona como força bruta.
+    """
+    kind = 'ivf'
+
+    def __init__(self, dim=ENCODING_SIZE, nlist=None, nprobe=8, refine=32, train_iterations=10, seed=0):
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.refine = refine
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self._centroids = None
+        self._assignment = np.empty(0, dtype=np.int32)
+        self._lists = []
+        self._codes = np.empty((0, dim), dtype=np.uint8)
+        self._code_min = None
+        self._code_scale = None
+        self._trained_size = 0
+
+    @property
+    def is_trained(self):
+        return self._centroids is not None
+
+    def _target_nlist(self, size):
+        return self.nlist or max(1, int(np.sqrt(size)))
+
+    def _on_add(self, rows):
+        if not self.is_trained:
+            if len(self) >= 40 * self._target_nlist(len(self)) or len(self) >= 2048:
+                self._rebuild()
+            return
+        if len(self) > 2 * self._trained_size:
+            # A galeria dobrou desde o treino: recalcula as listas para mantê-las equilibradas
+            return self._rebuild()
+        self._codes = np.vstack([self._codes, self._encode(self._vectors[rows])])
+        assignment = self._assign(self._vectors[rows])
+        self._assignment = np.concatenate([self._assignment, assignment])
+        for row, list_id in zip(rows, assignment):
+            self._lists[list_id] = np.append(self._lists[list_id], row)
+
+    def _on_remove(self, rows):
+        if self.is_trained:
+            for list_id in np.unique(self._assignment[rows]):
+                members = self._lists[list_id]
+                self._lists[list_id] = members[self._alive[members]]
+
+    def _rebuild(self):
+        alive_rows = np.flatnonzero(self._alive)
+        if len(alive_rows) < 2 * self._target_nlist(len(alive_rows)) or len(alive_rows) < 256:
+            self._centroids = None
+            return
+        vectors = self._vectors[alive_rows]
+        self._centroids = self._kmeans(vectors, self._target_nlist(len(vectors)))
+        self._code_min = vectors.min(axis=0)
+        self._code_scale = np.maximum(vectors.max(axis=0) - self._code_min, 1e-6) / 255.0
+        self._trained_size = len(vectors)
+        self._index_all_rows()
+
+    def _index_all_rows(self):
+        self._codes = self._encode(self._vectors)
+        self._assignment = self._assign(self._vectors)
+        order = np.argsort(self._assignment, kind='stable')
+        bounds = np.searchsorted(self._assignment[order], np.arange(len(self._centroids) + 1))
+        self._lists = [
+            order[bounds[i]:bounds[i + 1]][self._alive[order[bounds[i]:bounds[i + 1]]]]
+            for i in range(len(self._centroids))
+        ]
+
+    def _kmeans(self, vectors, nlist):
+        rng = np.random.default_rng(self.seed)
+        # Treina em uma amostra para manter a reconstrução rápida
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), 64 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            assignment = self._nearest_centroid(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        return centroids
+
+    @staticmethod
+    def _nearest_centroid(vectors, centroids):
+        # ||v - c||² = ||v||² - 2 v·c + ||c||² (||v||² é constante por linha)
+        scores = (centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ centroids.T
+        return scores.argmin(axis=1).astype(np.int32)
+
+    def _assign(self, vectors):
+        return self._nearest_centroid(vectors, self._centroids)
+
+    def _encode(self, vectors):
+        codes = np.rint((vectors - self._code_min) / self._code_scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def _decode(self, codes):
+        return codes.astype(np.float32) * self._code_scale + self._code_min
+
+    def _search_rows(self, query, k):
+        if not self.is_trained:
+            return self._exhaustive_search(query, k)
+
+        centroid_distances = ((self._centroids - query) ** 2).sum(axis=1)
+        probe = np.argsort(centroid_distances)[:min(self.nprobe, len(self._centroids))]
+        rows = np.concatenate([self._lists[i] for i in probe])
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+
+        approx = np.linalg.norm(self._decode(self._codes[rows]) - query, axis=1)
+        rows, _ = self._top_k(rows, approx, max(k, self.refine))
+        return self._top_k(rows, self._distances(query, rows), k)
+
+    def _state(self):
+        if not self.is_trained:
+            return {}
+        return {'centroids': self._centroids, 'code_min': self._code_min, 'code_scale': self._code_scale}
+
+    def _load_state(self, state):
+        if 'centroids' in state:
+            self._centroids = state['centroids'].astype(np.float32)
+            self._code_min = state['code_min'].astype(np.float32)
+            self._code_scale = state['code_scale'].astype(np.float32)
+            self._trained_size = len(self._ids)
+            self._index_all_rows()
+        else:
+            self._rebuild()
+
+
+FACE_INDEX_TYPES = {cls.kind: cls for cls in (BruteForceIndex, BallTreeIndex, IVFIndex)}
+
+
+def create_face_index(kind='brute', **params):
+    """Cria um índice pelo nome ('brute', 'balltree' ou 'ivf')."""
+    if kind not in FACE_INDEX_TYPES:
+        raise ValueError(f"Tipo de índice facial desconhecido: '{kind}'. Use um de: {', '.join(FACE_INDEX_TYPES)}.")
+    return FACE_INDEX_TYPES[kind](**params)
+
+
+def load_or_create_face_index(path, kind='brute', **params):
+    """Carrega o índice salvo em `path` (se for do mesmo tipo) ou cria um vazio."""
+    if path and os.path.exists(path):
+        try:
+            index = FaceIndex.load(path, **params)
+            if index.kind == kind:
+                return index, True
+            logging.info(f"Índice facial salvo é do tipo '{index.kind}', esperado '{kind}'. Ignorando.")
+        except Exception as e:
+            logging.warning(f"Não foi possível carregar o índice facial de {path}: {e}")
+    return create_face_index(kind, **params), False
@@ -0,0 +1,154 @@
+import os
+import logging
+import threading
+import time
+from collections import deque
+import numpy as np
+from PIL import Image, ImageOps
+
+# Parâmetros do pré-processamento (podem ser ajustados por variáveis de ambiente)
+# Largura máxima da imagem antes da detecção; fotos maiores são reduzidas
+DEFAULT_TARGET_WIDTH = int(os.getenv('FACE_IMAGE_WIDTH', 640))
+# 'hog' (rápido, CPU) ou 'cnn' (mais preciso, muito lento sem GPU)
+DEFAULT_DETECTOR = os.getenv('FACE_DETECTOR', 'hog')
+# Quantas vezes a imagem é ampliada na detecção (ajuda com rostos pequenos, custa ~4x por nível)
+DEFAULT_UPSAMPLE = int(os.getenv('FACE_UPSAMPLE', 0))
+# Reamostragens no cálculo do encoding (1 = sem jitter)
+DEFAULT_NUM_JITTERS = int(os.getenv('FACE_NUM_JITTERS', 1))
+# Modelo de landmarks usado no alinhamento: 'large' (68 pontos) ou 'small' (5 pontos, mais rápido)
+DEFAULT_LANDMARK_MODEL = os.getenv('FACE_LANDMARK_MODEL', 'large')
+
+STAGES = ('decode', 'detect', 'encode', 'total')
+
+_face_recognition = None
+_models_lock = threading.Lock()
+
+
+def load_face_models():
+    """
+    Importa o face_recognition, que carrega o dlib e os modelos de detecção,
+    landmarks e encoding (~100 MB de memória, perto de 1 s). Fica fora do
+    import do módulo para que instâncias que só atendem a API não paguem
+    esse custo; a primeira foto (ou o aquecimento do Kiosk) faz o carregamento.
+    """
+    global _face_recognition
+    if _face_recognition is None:
+        with _models_lock:
+            if _face_recognition is None:
+                started = time.perf_counter()
+                import face_recognition
+                _face_recognition = face_recognition
+                logging.info(f"Modelos faciais carregados em {(time.perf_counter() - started) * 1000:.0f} ms")
+    return _face_recognition
+
+
+class FacePipeline:
+    """
+    Pipeline de pré-processamento das fotos do Kiosk e do cadastro:
+    decodificação respeitando a orientação EXIF, redução para `target_width`,
+    detecção (HOG ou CNN) e encoding apenas do maior rosto (ou de todos).
+
+    Cada execução retorna o tempo de cada etapa, que também é guardado em uma
+    janela com as últimas execuções para consulta de p50/p95.
+    """
+    def __init__(self, target_width=DEFAULT_TARGET_WIDTH, detector=DEFAULT_DETECTOR, upsample=DEFAULT_UPSAMPLE,
+                 num_jitters=DEFAULT_NUM_JITTERS, landmark_model=DEFAULT_LANDMARK_MODEL, history_size=500):
+        if detector not in ('hog', 'cnn'):
+            raise ValueError(f"Detector facial inválido: '{detector}'. Use 'hog' ou 'cnn'.")
+        self.target_width = target_width
+        self.detector = detector
+        self.upsample = upsample
+        self.num_jitters = num_jitters
+        self.landmark_model = landmark_model
+        self._history = deque(maxlen=history_size)
+        self._history_lock = threading.Lock()
+
+    def decode(self, file_stream):
+        """Lê a imagem já na orientação correta, em RGB e com no máximo `target_width` de largura."""
+        image = Image.open(file_stream)
+        if self.target_width:
+            # Em JPEG, o draft decodifica direto em escala reduzida (1/2, 1/4, 1/8), bem mais rápido.
+            # Pede um quadrado para que o lado menor continue >= target_width mesmo após girar pelo EXIF.
+            image.draft('RGB', (self.target_width, self.target_width))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if self.target_width and image.width > self.target_width:
+            height = round(image.height * self.target_width / image.width)
+            image = image.resize((self.target_width, height), Image.BILINEAR)
+        return np.asarray(image)
+
+    @staticmethod
+    def largest_face(locations):
+        """Retorna a localização (top, right, bottom, left) de maior área."""
+        return max(locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
+
+    def process(self, file_stream, all_faces=False):
+        """
+        Executa o pipeline completo. Retorna um dict com:
+        - 'encodings': lista de vetores 128d (só o maior rosto, salvo `all_faces=True`);
+        - 'locations': as localizações correspondentes na imagem reduzida;
+        - 'image_size': (largura, altura) após a redução;
+        - 'timings': milissegundos de cada etapa (decode, detect, encode, total).
+        """
+        face_recognition = load_face_models()
+        started = time.perf_counter()
+        image = self.decode(file_stream)
+        decoded = time.perf_counter()
+
+        locations = face_recognition.face_locations(
+            image, number_of_times_to_upsample=self.upsample, model=self.detector
+        )
+        if locations and not all_faces:
+            locations = [self.largest_face(locations)]
+        detected = time.perf_counter()
+
+        encodings = face_recognition.face_encodings(
+            image, known_face_locations=locations, num_jitters=self.num_jitters, model=self.landmark_model
+        ) if locations else []
+        finished = time.perf_counter()
+
+        timings = {
+            'decode': (decoded - started) * 1000,
+            'detect': (detected - decoded) * 1000,
+            'encode': (finished - detected) * 1000,
+            'total': (finished - started) * 1000
+        }
+        self.record(timings)
+        logging.info(
+            f"Pipeline facial: {len(locations)} rosto(s) em {image.shape[1]}x{image.shape[0]} | "
+            + " ".join(f"{stage}={timings[stage]:.0f}ms" for stage in STAGES)
+        )
+        return {
+            'encodings': encodings,
+            'locations': locations,
+            'image_size': (image.shape[1], image.shape[0]),
+            'timings': timings
+        }
+
+    def record(self, timings):
+        """Guarda os tempos de uma execução (inclusive as feitas em outro processo)."""
+        with self._history_lock:
+            self._history.append(tuple(timings[stage] for stage in STAGES))
+
+    def timing_summary(self):
+        """p50/p95 (ms) de cada etapa nas últimas execuções e a configuração atual."""
+        with self._history_lock:
+            history = np.array(self._history, dtype=np.float64).reshape(-1, len(STAGES))
+        summary = {
+            'samples': len(history),
+            'config': {
+                'target_width': self.target_width,
+                'detector': self.detector,
+                'upsample': self.upsample,
+                'num_jitters': self.num_jitters,
+                'landmark_model': self.landmark_model
+            }
+        }
+        for position, stage in enumerate(STAGES):
+            values = history[:, position]
+            summary[stage] = {
+                'p50_ms': round(float(np.percentile(values, 50)), 1) if len(values) else None,
+                'p95_ms': round(float(np.percentile(values, 95)), 1) if len(values) else None
+            }
+        return summary
@@ -0,0 +1,285 @@
+import os
+import io
+import atexit
+import logging
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+
+# Processos dedicados ao reconhecimento facial (no Cloud Run, um por vCPU)
+DEFAULT_WORKERS = int(os.getenv('FACE_WORKERS', 1))
+# Fotos que podem aguardar na fila além das que já estão em processamento
+DEFAULT_MAX_QUEUE = int(os.getenv('FACE_MAX_QUEUE', 4))
+# Tempo máximo (s) que uma requisição espera pelo resultado
+DEFAULT_JOB_TIMEOUT = float(os.getenv('FACE_JOB_TIMEOUT', 10))
+
+
+class FaceQueueFullError(Exception):
+    """A fila do reconhecimento facial está cheia; o cliente deve tentar novamente."""
+
+
+class FaceJobTimeoutError(Exception):
+    """O processamento da foto excedeu o tempo limite."""
+
+
+# --- Lado do worker (executado nos processos do pool) ---
+
+_worker_pipeline = None
+_worker_gallery = {'name': None, 'shm': None, 'matrix': None, 'sq_norms': None}
+
+
+def _init_worker(pipeline_params):
+    global _worker_pipeline
+    from app.services.face_pipeline import FacePipeline, load_face_models
+    _worker_pipeline = FacePipeline(**pipeline_params)
+    load_face_models()
+
+
+def _attach_gallery(gallery_ref):
+    """Mapeia a matriz da galeria publicada pelo processo principal (sem cópia)."""
+    name, rows, dim = gallery_ref
+    if _worker_gallery['name'] != name:
+        if _worker_gallery['shm'] is not None:
+            _worker_gallery['matrix'] = None
+            _worker_gallery['shm'].close()
+        shm = shared_memory.SharedMemory(name=name)
+        matrix = np.ndarray((rows, dim), dtype=np.float32, buffer=shm.buf)
+        _worker_gallery.update(name=name, shm=shm, matrix=matrix, sq_norms=(matrix ** 2).sum(axis=1))
+    return _worker_gallery['matrix'], _worker_gallery['sq_norms']
+
+
+def _encode_job(image_bytes, all_faces=False):
+    result = _worker_pipeline.process(io.BytesIO(image_bytes), all_faces=all_faces)
+    result['encodings'] = [np.asarray(e, dtype=np.float32) for e in result['encodings']]
+    return result
+
+
+def _encode_many_job(images, all_faces=False):
+    """Codifica várias fotos no mesmo worker; uma foto ilegível vira None sem derrubar as demais."""
+    results = []
+    for image_bytes in images:
+        try:
+            results.append(_encode_job(image_bytes, all_faces))
+        except Exception as e:
+            logging.warning(f"Foto ignorada no encoding em lote: {e}")
+            results.append(None)
+    return results
+
+
+def _identify_job(image_bytes, gallery_ref, k, all_faces=False, rows=None):
+    result = _encode_job(image_bytes, all_faces)
+    result['rows'], result['distances'] = [], []
+    if not result['encodings'] or gallery_ref is None or gallery_ref[1] == 0:
+        return result
+
+    started = time.perf_counter()
+    matrix, sq_norms = _attach_gallery(gallery_ref)
+    if rows is not None:
+        # Só as linhas pedidas (ex: alunos das turmas em horário): Q × C em vez de Q × N
+        rows = np.asarray(rows, dtype=np.intp)
+        matrix, sq_norms = matrix[rows], sq_norms[rows]
+    # Todas as faces da foto contra a galeria de uma vez (Q × N)
+    queries = np.vstack(result['encodings'])
+    squared = sq_norms[None, :] - 2 * (queries @ matrix.T) + (queries ** 2).sum(axis=1)[:, None]
+    distances = np.sqrt(np.maximum(squared, 0))
+    k = min(k, distances.shape[1])
+    for row_distances in distances:
+        nearest = np.argpartition(row_distances, k - 1)[:k] if k < len(row_distances) else np.arange(len(row_distances))
+        nearest = nearest[np.argsort(row_distances[nearest])]
+        result['rows'].append((rows[nearest] if rows is not None else nearest).tolist())
+        result['distances'].append(row_distances[nearest].tolist())
+    result['timings']['match'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+# --- Lado do processo principal ---
+
+class FaceWorkerPool:
+    """
+    Pool limitado de processos para o encoding (dlib, CPU intensivo) e a
+    comparação facial, fora das threads que atendem as requisições.
+
+    - No máximo `max_workers + max_queue` fotos ficam em andamento; acima disso
+      `FaceQueueFullError` é lançado na hora (a rota responde 503).
+    - Cada requisição espera no máximo `job_timeout` segundos (`FaceJobTimeoutError`).
+    - A matriz da galeria é publicada em memória compartilhada; os workers a
+      mapeiam pelo nome em vez de recebê-la serializada a cada chamada. Cada
+      bloco publicado conta os jobs que o usam e só é apagado depois que o
+      último termina, mesmo que uma versão nova já tenha sido publicada.
+
+    Os workers nascem de um forkserver que já importou o dlib e os modelos,
+    então cada processo novo começa pronto e compartilha essas páginas.
+    """
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE,
+                 job_timeout=DEFAULT_JOB_TIMEOUT, pipeline_params=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.pipeline_params = pipeline_params or {}
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # Blocos publicados: nome -> [SharedMemory, jobs que ainda o usam]
+        self._blocks = {}
+        self._blocks_lock = threading.Lock()
+        self._gallery_ref = None
+        atexit.register(self.shutdown)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['face_recognition', 'app.services.face_worker_pool', 'app.services.face_pipeline'])
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=context,
+                    initializer=_init_worker, initargs=(self.pipeline_params,)
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _run(self, fn, *args, on_done=None):
+        def done(_=None):
+            self._slots.release()
+            if on_done is not None:
+                on_done()
+
+        if not self._slots.acquire(blocking=False):
+            if on_done is not None:
+                on_done()
+            raise FaceQueueFullError("Fila do reconhecimento facial cheia.")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            done()
+            raise
+        # A vaga (e o bloco da galeria) só é liberada quando o worker termina, mesmo após timeout
+        future.add_done_callback(done)
+        try:
+            return future.result(timeout=self.job_timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise FaceJobTimeoutError(f"Processamento facial excedeu {self.job_timeout:g}s.") from None
+        except BrokenProcessPool:
+            # Um worker morreu (ex: falta de memória); recria o pool na próxima chamada
+            logging.error("Pool do reconhecimento facial quebrado; recriando.")
+            self._reset_executor()
+            raise
+
+    def encode(self, image_bytes, all_faces=False):
+        """Executa o pipeline facial em um worker. Retorna o mesmo dict de `FacePipeline.process`."""
+        return self._run(_encode_job, image_bytes, all_faces)
+
+    def encode_many(self, images, all_faces=False):
+        """
+        Codifica várias fotos (ex: cadastro com várias amostras) em paralelo.
+        Usa as vagas livres no momento, até uma por worker, e divide as fotos
+        entre elas; sem nenhuma vaga livre, lança FaceQueueFullError. Retorna
+        a lista de resultados na ordem de `images` (None para foto ilegível).
+        """
+        if not images:
+            return []
+        acquired = 0
+        while acquired < min(len(images), self.max_workers) and self._slots.acquire(blocking=False):
+            acquired += 1
+        if not acquired:
+            raise FaceQueueFullError("Fila do reconhecimento facial cheia.")
+
+        chunks = [images[position::acquired] for position in range(acquired)]
+        futures = []
+        try:
+            executor = self._get_executor()
+            for chunk in chunks:
+                future = executor.submit(_encode_many_job, chunk, all_faces)
+                future.add_done_callback(lambda _: self._slots.release())
+                futures.append(future)
+        except Exception:
+            for _ in range(acquired - len(futures)):
+                self._slots.release()
+            raise
+
+        # Cada worker processa a sua parte em sequência: o prazo cresce com o tamanho dela
+        deadline = time.monotonic() + self.job_timeout * len(chunks[0])
+        results = [None] * len(images)
+        try:
+            for offset, future in enumerate(futures):
+                for position, result in enumerate(future.result(timeout=max(0, deadline - time.monotonic()))):
+                    results[offset + position * acquired] = result
+        except FutureTimeoutError:
+            for future in futures:
+                future.cancel()
+            raise FaceJobTimeoutError(f"Processamento facial excedeu {self.job_timeout * len(chunks[0]):g}s.") from None
+        except BrokenProcessPool:
+            logging.error("Pool do reconhecimento facial quebrado; recriando.")
+            self._reset_executor()
+            raise
+        return results
+
+    def identify(self, image_bytes, gallery_ref, k, all_faces=False, rows=None):
+        """
+        Codifica a foto (o maior rosto, ou todos com `all_faces`) e compara
+        contra a galeria publicada. Além do retorno de `encode`, traz 'rows' e
+        'distances': para cada rosto, os k mais próximos (linhas da matriz).
+        Com `rows`, a comparação é só contra essas linhas.
+
+        `gallery_ref` deve vir reservado (`retain_gallery`); a reserva é
+        liberada aqui quando o job termina ou não chega a ser enfileirado.
+        """
+        return self._run(_identify_job, image_bytes, gallery_ref, k, all_faces, rows,
+                         on_done=lambda: self.release_gallery(gallery_ref))
+
+    def publish_gallery(self, matrix):
+        """
+        Copia a matriz (N × 128, float32) para um novo bloco de memória
+        compartilhada e retorna a referência usada pelos workers. Os blocos
+        anteriores são apagados assim que nenhum job em andamento os usa.
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        np.ndarray(matrix.shape, dtype=np.float32, buffer=shm.buf)[:] = matrix
+        with self._blocks_lock:
+            self._blocks[shm.name] = [shm, 0]
+            self._gallery_ref = (shm.name, matrix.shape[0], matrix.shape[1])
+            for name in [n for n, (_, jobs) in self._blocks.items() if jobs == 0 and n != shm.name]:
+                self._unlink_block(name)
+        return self._gallery_ref
+
+    def retain_gallery(self, gallery_ref):
+        """Reserva o bloco de `gallery_ref` para um job (ver `identify`). Retorna a própria referência."""
+        if gallery_ref is not None:
+            with self._blocks_lock:
+                self._blocks[gallery_ref[0]][1] += 1
+        return gallery_ref
+
+    def release_gallery(self, gallery_ref):
+        """Libera a reserva; um bloco substituído é apagado quando o último job que o usa termina."""
+        if gallery_ref is None:
+            return
+        with self._blocks_lock:
+            block = self._blocks.get(gallery_ref[0])
+            if block is None:
+                return
+            block[1] -= 1
+            current = self._gallery_ref[0] if self._gallery_ref else None
+            if block[1] <= 0 and gallery_ref[0] != current:
+                self._unlink_block(gallery_ref[0])
+
+    def _unlink_block(self, name):
+        shm, _ = self._blocks.pop(name)
+        shm.close()
+        shm.unlink()
+
+    def shutdown(self):
+        self._reset_executor()
+        with self._blocks_lock:
+            for name in list(self._blocks):
+                self._unlink_block(name)
+            self._gallery_ref = None
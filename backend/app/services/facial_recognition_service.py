@@ -1,65 +1,586 @@
-import face_recognition
+import os
+import io
 import numpy as np
 import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from app.services.face_index import ENCODING_SIZE, create_face_index, load_or_create_face_index
+from app.services.face_pipeline import FacePipeline, load_face_models
+from app.services.face_worker_pool import FaceQueueFullError, FaceJobTimeoutError
+
+# Parâmetros de identificação (podem ser ajustados por variáveis de ambiente)
+DEFAULT_TOLERANCE = float(os.getenv('FACE_MATCH_TOLERANCE', 0.5))
+# Diferença mínima de distância entre o 1º e o 2º candidato
+DEFAULT_MIN_MARGIN = float(os.getenv('FACE_MATCH_MIN_MARGIN', 0.04))
+# Razão máxima d1/d2 (teste de razão de Lowe); acima disso o resultado é ambíguo
+DEFAULT_MAX_RATIO = float(os.getenv('FACE_MATCH_MAX_RATIO', 0.92))
+# Distância máxima para aceitar um 'match' só entre os alunos da turma, sem olhar a
+# galeria inteira. Mais rígida que a tolerância, porque o teste de margem não vê
+# quem está fora da turma (ex: visitante parecido com um aluno matriculado).
+DEFAULT_CLASS_TOLERANCE = float(os.getenv('FACE_CLASS_MATCH_TOLERANCE', 0.4))
+
+# Índice da galeria: 'brute' (exato), 'balltree' (exato, scikit-learn) ou 'ivf' (aproximado, quantizado)
+DEFAULT_INDEX_TYPE = os.getenv('FACE_INDEX_TYPE', 'brute')
+# Arquivo .npz onde o índice é salvo entre reinícios (vazio = sem persistência)
+DEFAULT_INDEX_PATH = os.getenv('FACE_INDEX_PATH') or None
+# Intervalo (s) entre as consultas às alterações de alunos feitas pela API principal
+DEFAULT_SYNC_SECONDS = float(os.getenv('FACE_GALLERY_SYNC_SECONDS', 5))
+
+MATCH = 'match'
+AMBIGUOUS = 'ambiguous'
+UNKNOWN = 'unknown'
+
 
 class FacialRecognitionService:
+    """
+    Reconhecimento facial do Kiosk.
+
+    Mantém em memória um índice com os encodings de todos os alunos com face
+    cadastrada (ver `face_index`): força bruta exata, Ball Tree ou IVF
+    quantizado, escolhido por FACE_INDEX_TYPE. O índice é atualizado a cada
+    cadastro/remoção, sincronizado periodicamente com o Firestore (apenas as
+    diferenças) e, se FACE_INDEX_PATH estiver definido, salvo em disco para que
+    um reinício não precise reconstruí-lo do zero.
+
+    Alterações feitas em outra instância (ex: edição ou exclusão de aluno pelo
+    painel, na API principal) chegam pela coleção `face_gallery_changes`,
+    consultada a cada `sync_seconds`: só os alunos alterados são relidos.
+
+    Com um `worker_pool`, o encoding e a comparação das fotos rodam em processos
+    separados, que leem a galeria de um bloco de memória compartilhada
+    republicado apenas quando ela muda.
+
+    Com uma `shared_gallery` (vários workers do gunicorn, ver gunicorn.conf.py),
+    a galeria publicada é a fonte da verdade: cada alteração parte da versão
+    mais nova e publica uma nova, e as buscas usam a matriz compartilhada sem
+    copiá-la. Um cadastro feito em um worker vale na hora para todos, e só um
+    deles relê o Firestore a cada `refresh_seconds`. Nesse modo o índice é
+    sempre de força bruta: cada worker adota toda versão nova, e refazer uma
+    Ball Tree ou treinar o IVF em cada um custaria mais que a busca exata.
+    """
+    def __init__(self, user_service=None, tolerance=DEFAULT_TOLERANCE, min_margin=DEFAULT_MIN_MARGIN,
+                 max_ratio=DEFAULT_MAX_RATIO, class_tolerance=DEFAULT_CLASS_TOLERANCE, refresh_seconds=600,
+                 index_type=DEFAULT_INDEX_TYPE, index_path=DEFAULT_INDEX_PATH, persist_seconds=60, pipeline=None,
+                 worker_pool=None, shared_gallery=None, sync_seconds=DEFAULT_SYNC_SECONDS):
+        self.user_service = user_service
+        self.pipeline = pipeline or FacePipeline()
+        self.worker_pool = worker_pool
+        self.shared_gallery = shared_gallery
+        self.tolerance = tolerance
+        self.min_margin = min_margin
+        self.max_ratio = max_ratio
+        self.class_tolerance = min(class_tolerance, tolerance)
+        self.refresh_seconds = refresh_seconds
+        self.index_path = index_path
+        self.persist_seconds = persist_seconds
+        self.sync_seconds = sync_seconds
+        if shared_gallery is not None and index_type != 'brute':
+            logging.warning(f"Índice facial '{index_type}' ignorado com a galeria compartilhada; usando força bruta.")
+            index_type = 'brute'
+        # O índice é alterado no lugar, então buscas e alterações usam o mesmo lock
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._names = {}
+        self._loaded_at = None
+        # Horário (epoch, do servidor) da última alteração de aluno aplicada e da última consulta
+        self._changes_at = 0.0
+        self._changes_checked_at = None
+        self._saved_at = time.monotonic()
+        self._dirty = False
+        # Versão da galeria (incrementada a cada alteração) e a última publicada para os workers
+        self._version = 0
+        self._published = (-1, None, None)
+        self._published_rows = {}
+        # Versão da galeria compartilhada que o índice local reflete
+        self._shared_version = 0
+
+        self._index, restored = load_or_create_face_index(index_path, index_type)
+        if restored:
+            names = self._index.extra.get('names')
+            if names is not None:
+                self._names = dict(zip(self._index.ids, (str(n) for n in names)))
+            # Um arquivo recente evita a releitura completa do Firestore na inicialização
+            age = max(0.0, time.time() - float(self._index.extra.get('saved_at', 0)))
+            self._loaded_at = time.monotonic() - age
+            self._changes_at = float(self._index.extra.get('changes_at', 0))
+            logging.info(f"Índice facial '{index_type}' restaurado de {index_path}: {len(self._index)} aluno(s)")
+
+    # --- Galeria ---
+
+    def load_gallery(self):
+        """Sincroniza o índice com o Firestore, aplicando apenas inclusões, alterações e remoções."""
+        if self.user_service is None:
+            # Sem fonte de dados (ex: scripts de avaliação): a galeria é montada via upsert_student
+            self._loaded_at = time.monotonic()
+            return
+        started = time.perf_counter()
+        # Alterações posteriores a esta já são vistas pela leitura abaixo; as seguintes, pelo _sync_changes
+        latest_change = self._latest_change()
+        entries, names = {}, {}
+        for student_id, name, encoding in self.user_service.get_face_gallery_entries():
+            vector = self._to_vector(encoding)
+            if vector is None:
+                continue
+            entries[student_id] = vector
+            names[student_id] = name
+
+        with self._gallery_update(), self._lock:
+            stale = [student_id for student_id in self._index.ids if student_id not in entries]
+            changed = [
+                student_id for student_id, vector in entries.items()
+                if not np.array_equal(self._index.get(student_id), vector)
+            ]
+            self._index.remove(stale)
+            if changed:
+                self._index.add(changed, np.vstack([entries[i] for i in changed]))
+            self._names = names
+            self._loaded_at = time.monotonic()
+            self._changes_at = max(self._changes_at, latest_change)
+            if stale or changed:
+                self._dirty = True
+                self._version += 1
+        logging.info(
+            f"Galeria facial sincronizada: {len(entries)} aluno(s), {len(changed)} alterado(s), "
+            f"{len(stale)} removido(s) em {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+        self._persist(force=True)
+
+    def _gallery_expired(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds
+
+    def _ensure_gallery(self):
+        self._adopt_shared()
+        if self._gallery_expired():
+            # Apenas uma thread (e, com a galeria compartilhada, um worker) recarrega;
+            # as demais esperam e reaproveitam o resultado
+            shared_load_lock = self.shared_gallery.load_lock() if self.shared_gallery is not None else nullcontext()
+            with self._load_lock, shared_load_lock:
+                # Outro worker pode ter acabado de sincronizar a galeria compartilhada
+                self._adopt_shared()
+                if self._gallery_expired():
+                    self.load_gallery()
+        self._sync_changes()
+        if self._dirty:
+            self._persist()
+
+    def _latest_change(self):
+        changed_at = self.user_service.get_latest_face_gallery_change()
+        return changed_at.timestamp() if changed_at else 0.0
+
+    def _sync_changes(self):
+        """
+        Aplica as alterações de alunos registradas pelo UserService desde a
+        última aplicada. Os alunos são relidos fora do lock; com a galeria
+        compartilhada, o que outro worker já aplicou é ignorado e tudo sai em
+        uma única publicação.
+        """
+        if self.user_service is None:
+            return
+        checked_at = self._changes_checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.sync_seconds:
+            return
+        # Uma thread consulta por vez; as demais seguem com a galeria atual
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._changes_checked_at = time.monotonic()
+            since = datetime.fromtimestamp(self._changes_at, timezone.utc) if self._changes_at else None
+            changes = self.user_service.get_face_gallery_changes(since)
+            if not changes:
+                return
+            fetched = [
+                (student_id, changed_at.timestamp(), self.user_service.get_face_gallery_entry(student_id))
+                for student_id, changed_at in changes
+            ]
+            with self._gallery_update(), self._lock:
+                updated = 0
+                for student_id, changed_at, entry in fetched:
+                    if changed_at <= self._changes_at:
+                        continue
+                    vector = self._to_vector(entry[2]) if entry else None
+                    if vector is None:
+                        if self._index.get(student_id) is not None:
+                            self._index.remove([student_id])
+                            self._names = {k: v for k, v in self._names.items() if k != student_id}
+                            updated += 1
+                    elif not np.array_equal(self._index.get(student_id), vector) or self._names.get(student_id) != entry[1]:
+                        self._index.add([student_id], vector[None, :])
+                        self._names = {**self._names, student_id: entry[1]}
+                        updated += 1
+                    self._changes_at = changed_at
+                if updated:
+                    self._dirty = True
+                    self._version += 1
+            logging.info(f"Galeria facial: {len(changes)} alteração(ões) de aluno recebida(s), {updated} aplicada(s)")
+        except Exception as e:
+            logging.error(f"Erro ao sincronizar alterações da galeria facial: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def _persist(self, force=False):
+        """Salva o índice em disco (se configurado), no máximo a cada `persist_seconds`."""
+        if not self.index_path or not self._dirty:
+            return
+        if not force and time.monotonic() - self._saved_at < self.persist_seconds:
+            return
+        try:
+            with self._lock:
+                names = np.array([self._names.get(i, '') for i in self._index.ids])
+                self._index.save(self.index_path, names=names, saved_at=np.array(time.time()),
+                                 changes_at=np.array(self._changes_at))
+                self._dirty = False
+                self._saved_at = time.monotonic()
+        except Exception as e:
+            logging.error(f"Erro ao salvar o índice facial em {self.index_path}: {e}")
+
+    @contextmanager
+    def _gallery_update(self):
+        """
+        Envolve uma alteração do índice. Com a galeria compartilhada, segura o
+        lock entre processos, adota antes a versão mais nova (para não perder a
+        alteração de outro worker) e publica o resultado ao final.
+        """
+        if self.shared_gallery is None:
+            yield
+            return
+        with self.shared_gallery.lock():
+            self._adopt_shared()
+            before = (self._version, self._loaded_at, self._changes_at)
+            yield
+            # Uma nova leitura do Firestore é publicada mesmo sem alterações, para os outros workers não a repetirem
+            if (self._version, self._loaded_at, self._changes_at) != before:
+                self._publish_shared()
+
+    def _publish_shared(self):
+        with self._lock:
+            ids = list(self._index.ids)
+            names = [self._names.get(student_id, '') for student_id in ids]
+            vectors = self._index.vectors
+            loaded_at = time.time() - (time.monotonic() - self._loaded_at) if self._loaded_at is not None else 0.0
+            changes_at = self._changes_at
+        self.shared_gallery.publish(ids, names, vectors, loaded_at=loaded_at, changes_at=changes_at)
+        # Troca a cópia privada recém-alterada pela matriz publicada
+        self._adopt_shared()
+
+    def _adopt_shared(self):
+        """Se a galeria compartilhada tem uma versão mais nova, passa a buscar nela (sem copiar a matriz)."""
+        if self.shared_gallery is None:
+            return
+        version, ids, names, matrix, loaded_at, changes_at = self.shared_gallery.snapshot()
+        if version == self._shared_version:
+            return
+        index = create_face_index(self._index.kind)
+        index.attach(ids, matrix)
+        with self._lock:
+            self._index = index
+            self._names = dict(zip(ids, names))
+            self._shared_version = version
+            self._version += 1
+            if loaded_at:
+                self._loaded_at = time.monotonic() - max(0.0, time.time() - loaded_at)
+            self._changes_at = max(self._changes_at, changes_at)
+
+    def _shared_gallery(self):
+        """
+        Publica a galeria para os workers se ela mudou; retorna (ids, linha de cada id, referência).
+        A referência volta reservada para um job (`FaceWorkerPool.identify` a libera).
+        """
+        with self._lock:
+            version, ids, ref = self._published
+            if version != self._version:
+                ids = self._index.ids
+                ref = self.worker_pool.publish_gallery(self._index.vectors)
+                self._published = (self._version, ids, ref)
+                self._published_rows = {student_id: row for row, student_id in enumerate(ids)}
+            return ids, self._published_rows, self.worker_pool.retain_gallery(ref)
+
+    def warm_up(self):
+        """Carrega a galeria e os modelos faciais antes da primeira foto (instâncias dedicadas ao Kiosk)."""
+        self._ensure_gallery()
+        self.load_models()
+
+    def load_models(self):
+        """Carrega só os modelos faciais, sem tocar no Firestore (ex: no mestre do gunicorn, antes do fork)."""
+        if self.worker_pool is None:
+            # Com o pool, os modelos são carregados pelo forkserver e pelos workers
+            load_face_models()
+
+    @property
+    def gallery_size(self):
+        return len(self._index)
+
+    def upsert_student(self, student_id, name, encoding):
+        """Inclui ou substitui o encoding de um aluno no índice em memória."""
+        vector = self._to_vector(encoding)
+        if vector is None:
+            return self.remove_student(student_id)
+        with self._gallery_update(), self._lock:
+            self._index.add([student_id], vector[None, :])
+            self._names = {**self._names, student_id: name}
+            self._dirty = True
+            self._version += 1
+        self._persist()
+
+    def remove_student(self, student_id):
+        """Remove um aluno do índice em memória (ex: aluno excluído)."""
+        with self._gallery_update(), self._lock:
+            if self._index.get(student_id) is None:
+                return
+            self._index.remove([student_id])
+            self._names = {k: v for k, v in self._names.items() if k != student_id}
+            self._dirty = True
+            self._version += 1
+        self._persist()
+
+    def refresh_student(self, student_id):
+        """Relê um aluno do Firestore e sincroniza a sua entrada na galeria."""
+        entry = self.user_service.get_face_gallery_entry(student_id)
+        if entry is None:
+            self.remove_student(student_id)
+        else:
+            self.upsert_student(*entry)
+
+    @staticmethod
+    def _to_vector(encoding):
+        if encoding is None:
+            return None
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != ENCODING_SIZE:
+            return None
+        return vector
+
+    # --- Encoding e identificação ---
+
     def get_face_encoding_from_stream(self, file_stream):
         """
         Lê uma imagem de um stream (upload), detecta o rosto e retorna o encoding (vetor 128d).
-        Retorna None se nenhum rosto for encontrado.
+        Se houver mais de um rosto, usa o maior. Retorna None se nenhum rosto for encontrado.
         """
         try:
-            # Carrega a imagem do stream
-            image = face_recognition.load_image_file(file_stream)
-            
-            # Detecta encodings (assume-se que a foto de cadastro tem apenas 1 rosto)
-            encodings = face_recognition.face_encodings(image)
-            
-            if len(encodings) > 0:
-                # Retorna o primeiro rosto encontrado convertido para lista (para salvar em JSON/Firestore)
-                return encodings[0].tolist()
+            if self.worker_pool:
+                result = self.worker_pool.encode(file_stream.read())
+                self.pipeline.record(result['timings'])
+            else:
+                result = self.pipeline.process(file_stream)
+            if result['encodings']:
+                # Convertido para lista (para salvar em JSON/Firestore)
+                return result['encodings'][0].tolist()
             return None
+        except (FaceQueueFullError, FaceJobTimeoutError):
+            raise
         except Exception as e:
             logging.error(f"Erro ao processar imagem para encoding: {e}")
             return None
 
-    def identify_student(self, file_stream, students_with_encodings):
+    def encode_samples(self, images):
+        """
+        Codifica as fotos de um cadastro (bytes), no pool de workers em
+        paralelo quando disponível. Retorna, na ordem das fotos, o vetor do
+        maior rosto de cada uma ou None quando nenhum rosto foi encontrado.
+        """
+        if self.worker_pool:
+            results = self.worker_pool.encode_many(images)
+            for result in results:
+                if result is not None:
+                    self.pipeline.record(result['timings'])
+        else:
+            results = []
+            for image_bytes in images:
+                try:
+                    results.append(self.pipeline.process(io.BytesIO(image_bytes)))
+                except Exception as e:
+                    logging.warning(f"Foto do cadastro ignorada: {e}")
+                    results.append(None)
+        return [
+            np.asarray(result['encodings'][0], dtype=np.float32) if result and result['encodings'] else None
+            for result in results
+        ]
+
+    def identify_encoding(self, encoding, top_k=3):
+        """
+        Busca os vizinhos mais próximos de um encoding no índice e aplica o teste
+        de margem/razão entre os dois candidatos mais próximos.
+
+        Retorna {'status', 'student', 'candidates'}, onde status é:
+        - 'match': o mais próximo está dentro da tolerância e bem separado do 2º;
+        - 'ambiguous': os dois mais próximos estão perto demais para decidir;
+        - 'unknown': ninguém dentro da tolerância.
+        'candidates' traz os `top_k` mais próximos com as distâncias.
+        """
+        self._ensure_gallery()
+        started = time.perf_counter()
+        with self._lock:
+            ids, distances = self._index.search(encoding, max(top_k, 2))
+            names = self._names
+            gallery_size = len(self._index)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logging.info(f"Kiosk: comparação em {elapsed_ms:.2f} ms (galeria={gallery_size}, índice={self._index.kind})")
+        return self._classify(ids, distances, names, top_k)
+
+    def _classify(self, ids, distances, names, top_k):
+        if not len(ids):
+            return {'status': UNKNOWN, 'student': None, 'candidates': []}
+        candidates = [
+            {'id': student_id, 'name': names.get(student_id), 'distance': float(distance)}
+            for student_id, distance in zip(ids, distances)
+        ]
+        best = candidates[0]
+        if best['distance'] > self.tolerance:
+            status = UNKNOWN
+        elif len(candidates) > 1 and self._is_ambiguous(best['distance'], candidates[1]['distance']):
+            status = AMBIGUOUS
+        else:
+            status = MATCH
+
+        return {
+            'status': status,
+            'student': best if status == MATCH else None,
+            'candidates': candidates[:top_k]
+        }
+
+    def _is_ambiguous(self, best_distance, second_distance):
+        if second_distance - best_distance < self.min_margin:
+            return True
+        return second_distance > 0 and best_distance / second_distance > self.max_ratio
+
+    def identify_encodings(self, encodings, top_k=3, candidate_ids=None):
         """
-        Recebe uma imagem do Kiosk e uma lista de alunos (dicionários) que possuem 'face_encoding'.
-        Retorna o aluno identificado ou None.
+        Identifica vários encodings (ex: todos os rostos de uma foto) com uma
+        única busca em lote no índice. Retorna uma lista com o resultado de cada
+        um, no formato de `identify_encoding`, acrescido de 'scope'.
+
+        Com `candidate_ids` (ex: alunos das turmas em horário), a comparação é
+        feita primeiro só contra eles; os rostos sem 'match' confiável (dentro
+        de `class_tolerance`) são buscados de novo na galeria inteira. 'scope'
+        indica onde o resultado foi obtido: 'class' ou 'gallery'.
+        """
+        if not len(encodings):
+            return []
+        self._ensure_gallery()
+        return self._search_with_candidates(np.vstack(encodings), top_k, candidate_ids)
+
+    def _search_with_candidates(self, queries, top_k, candidate_ids, gallery_results=None, class_results=None):
+        """
+        Busca restrita aos candidatos e, para os rostos que ficarem sem 'match',
+        busca na galeria inteira. `class_results` e `gallery_results` permitem
+        reaproveitar uma busca já feita (ex: pelo worker do pool) entre os
+        candidatos ou na galeria inteira.
+        """
+        k = max(top_k, 2)
+        started = time.perf_counter()
+        results = [None] * len(queries)
+        with self._lock:
+            names = self._names
+            if candidate_ids:
+                if class_results is None:
+                    ids, distances = self._index.search_subset(queries, candidate_ids, k)
+                    class_results = [self._classify(i, d, names, top_k) for i, d in zip(ids, distances)]
+                for position, result in enumerate(class_results):
+                    if result['status'] == MATCH and result['student']['distance'] <= self.class_tolerance:
+                        results[position] = {**result, 'scope': 'class'}
+            pending = [position for position, result in enumerate(results) if result is None]
+            if pending and gallery_results is None:
+                ids, distances = self._index.search_batch(queries[pending], k)
+                wide = [self._classify(i, d, names, top_k) for i, d in zip(ids, distances)]
+            else:
+                wide = [gallery_results[position] for position in pending] if pending else []
+            gallery_size = len(self._index)
+        for position, result in zip(pending, wide):
+            results[position] = {**result, 'scope': 'gallery'}
+
+        if candidate_ids:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logging.info(
+                f"Kiosk: {len(queries) - len(pending)}/{len(queries)} rosto(s) resolvidos entre "
+                f"{len(candidate_ids)} candidato(s) da turma; {len(pending)} ampliado(s) para a galeria "
+                f"({gallery_size}) em {elapsed_ms:.2f} ms"
+            )
+        return self._resolve_duplicates(results)
+
+    @staticmethod
+    def _resolve_duplicates(results):
+        """Se dois rostos apontam para o mesmo aluno, só o mais próximo é aceito; os demais ficam ambíguos."""
+        best_by_student = {}
+        for position, result in enumerate(results):
+            if result['status'] != MATCH:
+                continue
+            student = result['student']
+            current = best_by_student.get(student['id'])
+            if current is None or student['distance'] < results[current]['student']['distance']:
+                best_by_student[student['id']] = position
+        for position, result in enumerate(results):
+            if result['status'] == MATCH and best_by_student[result['student']['id']] != position:
+                result['status'], result['student'] = AMBIGUOUS, None
+        return results
+
+    def identify_student(self, file_stream, top_k=3, candidate_ids=None):
+        """
+        Recebe uma imagem do Kiosk e identifica o aluno (o rosto maior) contra o
+        índice em memória. Retorna o resultado de `identify_encoding` acrescido
+        de 'timings' (ms por etapa).
+
+        Com o pool de workers, lança FaceQueueFullError / FaceJobTimeoutError
+        quando não há capacidade para processar a foto a tempo.
+        """
+        result = self.identify_students(file_stream, top_k=top_k, all_faces=False, candidate_ids=candidate_ids)
+        if not result['faces']:
+            return {'status': UNKNOWN, 'student': None, 'candidates': [], 'timings': result['timings']}
+        return {**result['faces'][0], 'timings': result['timings']}
+
+    def identify_students(self, file_stream, top_k=3, all_faces=True, candidate_ids=None):
+        """
+        Detecta todos os rostos de uma imagem (ex: um grupo passando pelo Kiosk)
+        e identifica todos em lote. Retorna {'faces': [...], 'timings': {...},
+        'image_size': (largura, altura)}, onde cada face traz o resultado de
+        `identify_encodings` e a 'location' (top, right, bottom, left) na
+        imagem reduzida, de tamanho 'image_size'.
         """
         try:
-            # Processa a imagem da câmera do tablet
-            unknown_image = face_recognition.load_image_file(file_stream)
-            unknown_encodings = face_recognition.face_encodings(unknown_image)
-
-            if not unknown_encodings:
-                return None # Ninguém na frente da câmera
-
-            # Pega o rosto mais proeminente na imagem
-            unknown_encoding = unknown_encodings[0]
-
-            # Prepara a lista de rostos conhecidos
-            known_encodings = []
-            known_students = []
-
-            for student in students_with_encodings:
-                encoding_list = student.get('face_encoding')
-                if encoding_list:
-                    known_encodings.append(np.array(encoding_list))
-                    known_students.append(student)
-
-            if not known_encodings:
-                return None
-
-            # Compara os rostos (tolerance=0.6 é o padrão, menor é mais estrito)
-            matches = face_recognition.compare_faces(known_encodings, unknown_encoding, tolerance=0.5)
-            
-            if True in matches:
-                first_match_index = matches.index(True)
-                return known_students[first_match_index]
-            
-            return None
+            if self.worker_pool:
+                return self._identify_in_pool(file_stream.read(), top_k, all_faces, candidate_ids)
+
+            processed = self.pipeline.process(file_stream, all_faces=all_faces)
+            started = time.perf_counter()
+            faces = self.identify_encodings(processed['encodings'], top_k=top_k, candidate_ids=candidate_ids)
+            timings = {**processed['timings'], 'match': (time.perf_counter() - started) * 1000}
+        except (FaceQueueFullError, FaceJobTimeoutError):
+            raise
         except Exception as e:
-            logging.error(f"Erro ao identificar aluno: {e}")
-            return None
\ No newline at end of file
+            logging.error(f"Erro ao identificar alunos: {e}")
+            return {'faces': [], 'timings': {}}
+
+        for face, location in zip(faces, processed['locations']):
+            face['location'] = list(location)
+        return {'faces': faces, 'timings': timings, 'image_size': processed.get('image_size')}
+
+    def _identify_in_pool(self, image_bytes, top_k, all_faces, candidate_ids=None):
+        self._ensure_gallery()
+        ids, row_by_id, gallery_ref = self._shared_gallery()
+        # Com candidatos, o worker compara só contra as linhas deles; a galeria inteira fica para quem não resolver
+        rows = [row_by_id[i] for i in candidate_ids if i in row_by_id] if candidate_ids else []
+        processed = self.worker_pool.identify(image_bytes, gallery_ref, max(top_k, 2), all_faces, rows or None)
+        self.pipeline.record(processed['timings'])
+        names = self._names
+        if processed['rows']:
+            faces = [
+                self._classify(ids[rows], distances, names, top_k)
+                for rows, distances in zip(processed['rows'], processed['distances'])
+            ]
+        else:
+            # Galeria vazia: os rostos foram encontrados, mas ninguém para comparar
+            faces = [self._classify([], [], names, top_k) for _ in processed['encodings']]
+        if faces and rows:
+            faces = self._search_with_candidates(
+                np.vstack(processed['encodings']), top_k, candidate_ids, class_results=faces
+            )
+        elif faces:
+            # O worker já comparou contra a galeria inteira (nenhum candidato está nela)
+            faces = self._search_with_candidates(
+                np.vstack(processed['encodings']), top_k, candidate_ids, gallery_results=faces
+            )
+        for face, location in zip(faces, processed['locations']):
+            face['location'] = list(location)
+        return {'faces': faces, 'timings': processed['timings'], 'image_size': processed.get('image_size')}
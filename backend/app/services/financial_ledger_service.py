@@ -0,0 +1,267 @@
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from firebase_admin import firestore
+
+# Limite de operações por lote de escrita do Firestore
+BATCH_LIMIT = 500
+# Rótulo da forma de pagamento quando a fatura foi paga sem informá-la
+UNKNOWN_METHOD = 'nao_informado'
+# Campos das faturas lidos na reconciliação
+LEDGER_FIELDS = [
+    'amount', 'status', 'reference_year', 'reference_month', 'due_day',
+    'due_date', 'payment_method', 'payment_date'
+]
+
+
+class FinancialLedgerService:
+    """
+    Livro-caixa agregado por mês em `financial_ledger/{aaaamm}`, para os
+    resumos financeiros serem uma leitura e não uma varredura das faturas.
+
+    Cada documento guarda, para as faturas com aquele mês de referência, o
+    total e a quantidade pagos (também por forma de pagamento) e pendentes
+    (também por dia de vencimento, para separar o que já venceu). Guarda ainda
+    o recebido no mês pela data do pagamento (`received_*`), que é o
+    faturamento do painel.
+
+    Os contadores são alterados com incrementos no mesmo lote ou transação
+    que grava a fatura (`apply`). O `rebuild` recalcula tudo a partir das
+    faturas; até a primeira reconciliação (`settings/financial_ledger`), os
+    resumos continuam sendo calculados pelas faturas.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.collection = self.db.collection('financial_ledger')
+        self._ready = False
+
+    @property
+    def meta_ref(self):
+        # Resolvida a cada uso, no cliente do Firestore do processo atual (ver app.models.db)
+        return self.db.collection('settings').document('financial_ledger')
+
+    @staticmethod
+    def month_key(year, month):
+        return f"{int(year):04d}{int(month):02d}"
+
+    @staticmethod
+    def reference_of(payment):
+        """(ano, mês) de referência da fatura, com o vencimento como alternativa para faturas antigas."""
+        if payment.get('reference_year') and payment.get('reference_month'):
+            return int(payment['reference_year']), int(payment['reference_month'])
+        due_date = payment.get('due_date')
+        if isinstance(due_date, datetime):
+            return due_date.year, due_date.month
+        return None
+
+    @classmethod
+    def contribution(cls, payment):
+        """
+        Quanto a fatura soma em cada mês do livro-caixa: {aaaamm: {caminho: valor}},
+        com o caminho como tupla (ex: ('paid_by_method', 'pix', 'total')).
+        """
+        entries = defaultdict(lambda: defaultdict(float))
+        reference = cls.reference_of(payment or {}) if payment else None
+        if reference is None:
+            return entries
+
+        year, month = reference
+        amount = float(payment.get('amount') or 0)
+        month_entry = entries[cls.month_key(year, month)]
+        if payment.get('status') == 'paid':
+            method = payment.get('payment_method') or UNKNOWN_METHOD
+            month_entry[('paid_total',)] += amount
+            month_entry[('paid_count',)] += 1
+            month_entry[('paid_by_method', method, 'total')] += amount
+            month_entry[('paid_by_method', method, 'count')] += 1
+            paid_at = payment.get('payment_date')
+            if isinstance(paid_at, datetime):
+                paid_at = paid_at.astimezone(timezone.utc) if paid_at.tzinfo else paid_at
+                received = entries[cls.month_key(paid_at.year, paid_at.month)]
+                received[('received_total',)] += amount
+                received[('received_count',)] += 1
+        else:
+            _, last_day = calendar.monthrange(year, month)
+            due_day = f"{min(int(payment.get('due_day') or 15), last_day):02d}"
+            month_entry[('pending_total',)] += amount
+            month_entry[('pending_count',)] += 1
+            month_entry[('pending_by_due_day', due_day, 'total')] += amount
+            month_entry[('pending_by_due_day', due_day, 'count')] += 1
+        return entries
+
+    @classmethod
+    def delta(cls, old=None, new=None):
+        """Diferença entre a contribuição da fatura depois (`new`) e antes (`old`) de uma alteração."""
+        result = cls.contribution(new)
+        for key, paths in cls.contribution(old).items():
+            for path, value in paths.items():
+                result[key][path] -= value
+        return {
+            key: {path: value for path, value in paths.items() if abs(value) > 1e-9}
+            for key, paths in result.items()
+            if any(abs(value) > 1e-9 for value in paths.values())
+        }
+
+    @classmethod
+    def merge_deltas(cls, deltas):
+        merged = defaultdict(lambda: defaultdict(float))
+        for delta in deltas:
+            for key, paths in delta.items():
+                for path, value in paths.items():
+                    merged[key][path] += value
+        return merged
+
+    @staticmethod
+    def _nested(paths, wrap):
+        data = {}
+        for path, value in paths.items():
+            target = data
+            for part in path[:-1]:
+                target = target.setdefault(part, {})
+            # Quantidades inteiras e valores em centavos, sem acumular o erro do ponto flutuante
+            value = int(round(value)) if path[-1].endswith('count') else round(value, 2)
+            target[path[-1]] = wrap(value)
+        return data
+
+    def apply(self, writer, delta):
+        """
+        Registra `delta` no livro-caixa usando `writer` (transação ou lote),
+        com incrementos: nada é lido, então faturas de um mesmo mês gravadas
+        ao mesmo tempo não disputam o documento do mês.
+        """
+        now = datetime.now(timezone.utc)
+        for key, paths in delta.items():
+            data = self._nested(paths, firestore.Increment)
+            data.update({'year': int(key[:4]), 'month': int(key[4:]), 'updated_at': now})
+            writer.set(self.collection.document(key), data, merge=True)
+        return len(delta)
+
+    def is_ready(self):
+        """Se o livro-caixa já foi reconciliado ao menos uma vez (e os resumos podem confiar nele)."""
+        if not self._ready:
+            self._ready = self.meta_ref.get().exists
+        return self._ready
+
+    @staticmethod
+    def _overdue(entry, key, today):
+        """Soma das pendências já vencidas (vencimento antes de hoje) de um documento do mês."""
+        current = FinancialLedgerService.month_key(today.year, today.month)
+        if key > current:
+            return 0.0
+        by_day = entry.get('pending_by_due_day') or {}
+        if key < current:
+            return sum(float(d.get('total') or 0) for d in by_day.values())
+        return sum(float(d.get('total') or 0) for day, d in by_day.items() if int(day) < today.day)
+
+    def get_month_summary(self, year, month, today=None):
+        """
+        Resumo do mês (pago, pendente, vencido, quantidades e formas de
+        pagamento) com uma leitura. Retorna None antes da primeira reconciliação.
+        """
+        if not self.is_ready():
+            return None
+        today = today or date.today()
+        key = self.month_key(year, month)
+        snapshot = self.collection.document(key).get()
+        entry = snapshot.to_dict() if snapshot.exists else {}
+        overdue = self._overdue(entry, key, today)
+        return {
+            'total_paid': round(float(entry.get('paid_total') or 0), 2),
+            'total_pending': round(float(entry.get('pending_total') or 0) - overdue, 2),
+            'total_overdue': round(overdue, 2),
+            'paid_count': int(entry.get('paid_count') or 0),
+            'pending_count': int(entry.get('pending_count') or 0),
+            'by_method': {
+                method: {'total': round(float(d.get('total') or 0), 2), 'count': int(d.get('count') or 0)}
+                for method, d in (entry.get('paid_by_method') or {}).items()
+                if d.get('count')
+            }
+        }
+
+    def get_dashboard_summary(self, today=None):
+        """
+        Faturamento do mês atual e inadimplência total, lendo o documento do
+        mês e os meses com pendências. Retorna None antes da primeira reconciliação.
+        """
+        if not self.is_ready():
+            return None
+        today = today or date.today()
+        current = self.month_key(today.year, today.month)
+        snapshot = self.collection.document(current).get()
+        received = float((snapshot.to_dict() or {}).get('received_total') or 0) if snapshot.exists else 0.0
+
+        total_overdue = 0.0
+        docs = self.collection.where(filter=firestore.FieldFilter('pending_count', '>', 0)) \
+                              .select(['pending_by_due_day']).stream()
+        for doc in docs:
+            if doc.id <= current:
+                total_overdue += self._overdue(doc.to_dict(), doc.id, today)
+
+        return {
+            "total_paid_this_month": round(received, 2),
+            "total_overdue": round(total_overdue, 2)
+        }
+
+    def rebuild(self, dry_run=False):
+        """
+        Recalcula todos os meses a partir das faturas e regrava os documentos
+        (inclusive zerando meses que não têm mais faturas). Deve rodar com
+        pouco movimento: um pagamento gravado durante a varredura pode ficar
+        de fora até a próxima reconciliação.
+
+        Retorna {months, payments, changed: [aaaamm...]}; com `dry_run` só
+        compara, sem gravar.
+        """
+        totals = defaultdict(lambda: defaultdict(float))
+        payments = 0
+        for doc in self.db.collection('payments').select(LEDGER_FIELDS).stream():
+            payments += 1
+            for key, paths in self.contribution(doc.to_dict()).items():
+                for path, value in paths.items():
+                    totals[key][path] += value
+
+        stored = {doc.id: doc.to_dict() for doc in self.collection.stream()}
+        now = datetime.now(timezone.utc)
+        changed = []
+        writes = []
+        for key in sorted(set(totals) | set(stored)):
+            data = self._nested(totals.get(key, {}), lambda v: v)
+            for field in ('paid_total', 'paid_count', 'pending_total', 'pending_count', 'received_total', 'received_count'):
+                data.setdefault(field, 0)
+            data.setdefault('paid_by_method', {})
+            data.setdefault('pending_by_due_day', {})
+            if not self._same(stored.get(key), data):
+                changed.append(key)
+            data.update({'year': int(key[:4]), 'month': int(key[4:]), 'updated_at': now, 'reconciled_at': now})
+            writes.append((self.collection.document(key), data))
+
+        if not dry_run:
+            for chunk_start in range(0, len(writes), BATCH_LIMIT):
+                batch = self.db.batch()
+                for ref, data in writes[chunk_start:chunk_start + BATCH_LIMIT]:
+                    batch.set(ref, data)
+                batch.commit()
+            self.meta_ref.set({'reconciled_at': now, 'months': len(writes), 'payments': payments})
+            self._ready = True
+            logging.info(f"Livro-caixa reconciliado: {len(writes)} mês(es), {payments} fatura(s), {len(changed)} corrigido(s)")
+
+        return {'months': len(writes), 'payments': payments, 'changed': changed}
+
+    @classmethod
+    def _same(cls, stored, data):
+        """Compara os valores gravados com os recalculados, tolerando arredondamento de centavos."""
+        if stored is None:
+            return not any(cls._flatten(data).values())
+        a, b = cls._flatten(stored), cls._flatten(data)
+        return all(abs(a.get(k, 0) - b.get(k, 0)) < 0.005 for k in set(a) | set(b))
+
+    @classmethod
+    def _flatten(cls, data, prefix=()):
+        flat = {}
+        for name, value in data.items():
+            if isinstance(value, dict):
+                flat.update(cls._flatten(value, prefix + (name,)))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and name not in ('year', 'month'):
+                flat[prefix + (name,)] = float(value)
+        return flat
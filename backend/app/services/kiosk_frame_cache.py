@@ -0,0 +1,104 @@
+import io
+import os
+import numpy as np
+from PIL import Image, ImageOps
+from app.utils.cache import TTLCache
+
+# Janela (s) em que o mesmo rosto no mesmo tablet reaproveita o último resultado
+DEFAULT_WINDOW_SECONDS = float(os.getenv('KIOSK_FRAME_CACHE_SECONDS', 5))
+# Diferença média máxima (0-255) entre as miniaturas em tons de cinza do recorte de cada rosto
+DEFAULT_FRAME_THRESHOLD = float(os.getenv('KIOSK_FRAME_THRESHOLD', 6))
+# Distância máxima entre descritores para considerá-los o mesmo rosto parado na frente do tablet
+DEFAULT_EMBEDDING_THRESHOLD = float(os.getenv('KIOSK_EMBEDDING_THRESHOLD', 0.15))
+
+SIGNATURE_SIZE = 16
+# Largura aproximada em que o quadro é decodificado para recortar os rostos
+DECODE_SIZE = 320
+# Lado mínimo (px, no quadro decodificado) de um recorte comparável
+MIN_CROP_SIZE = 8
+
+
+class KioskFrameCache:
+    """
+    Guarda, por tablet (cabeçalho X-Kiosk-Device), o último resultado do
+    Kiosk junto com a assinatura de cada rosto que o gerou: na foto, a
+    posição do rosto e o recorte dele em miniatura 16×16 em tons de cinza;
+    nos descritores (face-api.js), os próprios vetores.
+
+    Um aluno parado na frente do tablet gera quadros com o mesmo rosto no
+    mesmo lugar: eles recebem o resultado guardado, sem detecção, comparação
+    nem escrita. Outro aluno no mesmo lugar muda o recorte do rosto (o fundo
+    fica de fora da comparação) e é processado normalmente. Quadros sem rosto
+    não são guardados.
+
+    A janela conta a partir do quadro que gerou o resultado; os acertos não a
+    renovam, então um resultado nunca é servido por mais de `window_seconds`.
+    """
+    def __init__(self, window_seconds=DEFAULT_WINDOW_SECONDS, frame_threshold=DEFAULT_FRAME_THRESHOLD,
+                 embedding_threshold=DEFAULT_EMBEDDING_THRESHOLD, max_devices=256):
+        self.window_seconds = window_seconds
+        self.frame_threshold = frame_threshold
+        self.embedding_threshold = embedding_threshold
+        self._entries = TTLCache(window_seconds, max_devices)
+
+    @staticmethod
+    def decode_frame(image_bytes):
+        """Quadro em tons de cinza e resolução reduzida (o draft do JPEG evita decodificar a foto inteira)."""
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('L', (DECODE_SIZE, DECODE_SIZE))
+        return ImageOps.exif_transpose(image).convert('L')
+
+    @staticmethod
+    def face_boxes(locations, image_size):
+        """
+        Converte as localizações (top, right, bottom, left) do pipeline, na
+        imagem de `image_size` (largura, altura), em frações do quadro.
+        """
+        if not locations or not image_size:
+            return []
+        width, height = image_size
+        return [(top / height, right / width, bottom / height, left / width) for top, right, bottom, left in locations]
+
+    @staticmethod
+    def _face_signatures(frame, boxes):
+        signatures = []
+        for top, right, bottom, left in boxes:
+            crop_box = (round(left * frame.width), round(top * frame.height),
+                        round(right * frame.width), round(bottom * frame.height))
+            if min(crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]) < MIN_CROP_SIZE:
+                return None
+            crop = frame.crop(crop_box).resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BILINEAR)
+            signatures.append(np.asarray(crop, dtype=np.int16))
+        return signatures
+
+    def lookup_frame(self, device_id, frame):
+        """Resultado guardado se cada rosto do quadro anterior continua no mesmo lugar e igual."""
+        entry = self._entries.get(('frame', device_id))
+        if entry is None:
+            return None
+        signatures = self._face_signatures(frame, entry['boxes'])
+        if signatures is None:
+            return None
+        for previous, current in zip(entry['signatures'], signatures):
+            if np.abs(previous - current).mean() > self.frame_threshold:
+                return None
+        return entry['result']
+
+    def store_frame(self, device_id, frame, boxes, result):
+        signatures = self._face_signatures(frame, boxes) if boxes else None
+        if not signatures:
+            return
+        self._entries.set(('frame', device_id), {'boxes': boxes, 'signatures': signatures, 'result': result})
+
+    def lookup_embeddings(self, device_id, vectors):
+        """Reaproveita o resultado se cada descritor recebido tiver um correspondente próximo no anterior."""
+        entry = self._entries.get(('embeddings', device_id))
+        if entry is None or len(entry['vectors']) != len(vectors):
+            return None
+        distances = np.linalg.norm(np.asarray(vectors)[:, None, :] - entry['vectors'][None, :, :], axis=2)
+        if (distances.min(axis=1) > self.embedding_threshold).any():
+            return None
+        return entry['result']
+
+    def store_embeddings(self, device_id, vectors, result):
+        self._entries.set(('embeddings', device_id), {'vectors': np.asarray(vectors), 'result': result})
@@ -0,0 +1,35 @@
+import logging
+import threading
+import time
+
+
+class LazyService:
+    """
+    Adia a criação de um serviço (e a importação dos módulos dele) até o
+    primeiro acesso a qualquer atributo. Usado para o reconhecimento facial:
+    instâncias que só atendem o PWA do aluno nunca carregam o dlib.
+
+    As rotas usam o objeto como se fosse o próprio serviço; `get()` devolve a
+    instância real e `loaded` indica se ela já foi criada.
+    """
+    def __init__(self, factory, name='serviço'):
+        self._factory = factory
+        self._name = name
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._instance is not None
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    self._instance = self._factory()
+                    logging.info(f"Serviço de {self._name} criado em {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self._instance
+
+    def __getattr__(self, attribute):
+        return getattr(self.get(), attribute)
@@ -1,22 +1,59 @@
 import os
+import re
+import hashlib
 import calendar
+import unicodedata
 from datetime import date, datetime, timezone, timedelta
 import logging
 from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1.field_path import FieldPath
 import mercadopago
+from mercadopago.http import HttpClient
 from collections import defaultdict
+from app.services.financial_ledger_service import FinancialLedgerService
+
+# Limite de operações por lote de escrita do Firestore
+BATCH_LIMIT = 500
+# URL da API do Mercado Pago usada pelo SDK
+MERCADO_PAGO_API_URL = 'https://api.mercadopago.com'
+# Campos das cobranças exibidos no painel financeiro (projeção da consulta do mês)
+FINANCIAL_STATUS_FIELDS = [
+    'student_id', 'enrollment_id', 'class_name', 'amount', 'status', 'type',
+    'description', 'due_day', 'due_date', 'payment_date', 'payment_method',
+    'reference_month', 'reference_year'
+]
+
+class BaseUrlHttpClient(HttpClient):
+    """
+    Cliente HTTP do SDK do Mercado Pago que troca a URL da API por outra
+    (MERCADO_PAGO_API_BASE_URL), ex: um servidor falso local para testar o
+    checkout e o processamento dos webhooks sem chamar o Mercado Pago.
+    """
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(MERCADO_PAGO_API_URL):
+            url = self.base_url + url[len(MERCADO_PAGO_API_URL):]
+        return super().request(method, url, *args, **kwargs)
+
 
 class PaymentService:
-    def __init__(self, db, enrollment_service=None, user_service=None, training_class_service=None):
+    def __init__(self, db, enrollment_service=None, user_service=None, training_class_service=None, ledger_service=None):
         self.db = db
         self.collection = self.db.collection('payments')
         self.enrollment_service = enrollment_service
         self.user_service = user_service
         self.training_class_service = training_class_service
+        self.ledger_service = ledger_service or FinancialLedgerService(db)
         # Inicializa o SDK do Mercado Pago
         access_token = os.getenv("MERCADO_PAGO_ACCESS_TOKEN")
+        api_base_url = os.getenv("MERCADO_PAGO_API_BASE_URL")
         if access_token:
-            self.sdk = mercadopago.SDK(access_token)
+            http_client = BaseUrlHttpClient(api_base_url) if api_base_url else None
+            self.sdk = mercadopago.SDK(access_token, http_client=http_client)
         else:
             self.sdk = None
             print("AVISO: MERCADO_PAGO_ACCESS_TOKEN não está configurado. A funcionalidade de pagamento estará desabilitada.")
@@ -125,7 +162,8 @@ class PaymentService:
                     'updated_at': datetime.now(timezone.utc),
                     'mercado_pago_payment_id': payment_result.get("id")
                 }
-                payment_doc_ref.update(update_data)
+                # Se o webhook chegou antes e já deu baixa, nada é lançado de novo no livro-caixa
+                self._mark_paid(payment_doc_ref, update_data, only_if_pending=True)
                 return {"status": "success", "message": "Pagamento aprovado!", "paymentId": payment_result.get("id")}
             else:
                 error_message = payment_result.get("message", "Pagamento recusado pelo processador.")
@@ -140,7 +178,11 @@ class PaymentService:
             return {"status": "failed", "message": f"Ocorreu um erro inesperado no servidor: {e}"}
             
     def handle_webhook_notification(self, notification_data):
-        """Processa uma notificação de webhook recebida do Mercado Pago."""
+        """
+        Processa uma notificação de webhook do Mercado Pago de forma síncrona
+        (consulta o pagamento e dá baixa na fatura). A rota do webhook usa o
+        WebhookService, que enfileira a notificação e processa em segundo plano.
+        """
         if not self.sdk:
             print("AVISO: Webhook recebido, mas SDK do Mercado Pago não está configurado.")
             return False
@@ -149,96 +191,190 @@ class PaymentService:
             if notification_data.get("type") == "payment":
                 mp_payment_id = notification_data["data"]["id"]
                 print(f"INFO: Recebida notificação de pagamento para o ID: {mp_payment_id}")
-                
-                payment_info_response = self.sdk.payment().get(mp_payment_id)
-                payment_info = payment_info_response["response"]
-                
-                external_reference = payment_info.get("external_reference")
-                payment_status = payment_info.get("status")
-
-                if not external_reference:
-                    print(f"AVISO: Webhook para o pagamento {mp_payment_id} não possui referência externa. Ignorando.")
+                payment_info = self.fetch_mercado_pago_payment(mp_payment_id)
+                if not payment_info.get("external_reference"):
                     return False
-
-                if payment_status == "approved":
-                    payment_doc_ref = self.collection.document(external_reference)
-                    payment_doc = payment_doc_ref.get()
-                    
-                    if payment_doc.exists and payment_doc.to_dict().get('status') != 'paid':
-                        print(f"INFO: Atualizando fatura {external_reference} para 'pago' via webhook.")
-                        update_data = {
-                            'status': 'paid',
-                            'payment_date': datetime.now(timezone.utc),
-                            'payment_method': payment_info.get("payment_method_id"),
-                            'updated_at': datetime.now(timezone.utc),
-                            'mercado_pago_payment_id': mp_payment_id
-                        }
-                        payment_doc_ref.update(update_data)
-                        return True
-                    else:
-                        print(f"INFO: Fatura {external_reference} não encontrada ou já estava paga. Nenhuma ação necessária.")
-                        
+                self.apply_mercado_pago_payment(mp_payment_id, payment_info)
             return True
         except Exception as e:
             logging.error(f"Erro ao processar notificação de webhook: {e}", exc_info=True)
             return False
 
+    def fetch_mercado_pago_payment(self, mp_payment_id):
+        """Consulta um pagamento no Mercado Pago. Levanta RuntimeError se a consulta falha."""
+        if not self.sdk:
+            raise RuntimeError("O SDK do Mercado Pago não está configurado.")
+        payment_info_response = self.sdk.payment().get(mp_payment_id)
+        if payment_info_response.get("status") != 200:
+            raise RuntimeError(
+                f"Mercado Pago respondeu {payment_info_response.get('status')} ao consultar o pagamento {mp_payment_id}"
+            )
+        return payment_info_response["response"]
+
+    def apply_mercado_pago_payment(self, mp_payment_id, payment_info):
+        """
+        Aplica à fatura (external_reference) o estado de um pagamento do
+        Mercado Pago: se aprovado, dá baixa. Retorna True se a fatura foi alterada.
+        """
+        external_reference = payment_info.get("external_reference")
+        payment_status = payment_info.get("status")
+
+        if not external_reference:
+            print(f"AVISO: Pagamento {mp_payment_id} do Mercado Pago não possui referência externa. Ignorando.")
+            return False
+
+        if payment_status == "approved":
+            update_data = {
+                'status': 'paid',
+                'payment_date': datetime.now(timezone.utc),
+                'payment_method': payment_info.get("payment_method_id"),
+                'updated_at': datetime.now(timezone.utc),
+                'mercado_pago_payment_id': mp_payment_id
+            }
+            if self._mark_paid(self.collection.document(external_reference), update_data, only_if_pending=True):
+                print(f"INFO: Fatura {external_reference} atualizada para 'pago' via webhook.")
+                return True
+            print(f"INFO: Fatura {external_reference} não encontrada ou já estava paga. Nenhuma ação necessária.")
+        return False
+
+    @staticmethod
+    def monthly_payment_id(enrollment_id, year, month):
+        """ID determinístico da mensalidade de uma matrícula: rodar a cobrança de novo não duplica faturas."""
+        return f"{enrollment_id}_{int(year):04d}{int(month):02d}"
+
+    def build_monthly_payment(self, enrollment, year, month, last_day_of_month, now):
+        """Monta a mensalidade de uma matrícula ativa (ou None se não há valor a cobrar)."""
+        total_due = float(enrollment.get('base_monthly_fee', 0)) - float(enrollment.get('discount_amount', 0))
+        if total_due <= 0:
+            return None
+
+        due_day = int(enrollment.get('due_day', 15))
+        valid_due_day = min(due_day, last_day_of_month)
+        due_date_obj = datetime(year, month, valid_due_day, tzinfo=timezone.utc)
+
+        return {
+            'student_id': enrollment['student_id'],
+            'enrollment_id': enrollment['enrollment_id'],
+            'amount': total_due,
+            'status': 'pending',
+            'reference_month': month,
+            'reference_year': year,
+            'due_day': due_day,
+            'due_date': due_date_obj,
+            'type': 'Mensalidade',
+            'description': f"Mensalidade {enrollment.get('class_name', 'N/A')} - {month}/{year}",
+            'class_name': enrollment.get('class_name', 'N/A'),
+            'payment_date': None,
+            'payment_method': None,
+            'created_at': now,
+            'updated_at': now
+        }
+
+    def get_billed_enrollment_ids(self, year, month):
+        """IDs das matrículas que já têm fatura no mês (uma única consulta, só com o campo necessário)."""
+        docs = self.collection.where(filter=firestore.And([
+            firestore.FieldFilter('reference_year', '==', int(year)),
+            firestore.FieldFilter('reference_month', '==', int(month))
+        ])).select(['enrollment_id']).stream()
+        return {doc.to_dict().get('enrollment_id') for doc in docs} - {None}
+
+    def create_payments(self, payments):
+        """
+        Cria faturas com IDs determinísticos em lotes de até 500 operações,
+        usando `create` (falha se o documento já existe). Se um lote esbarra
+        em uma fatura criada por outra execução ao mesmo tempo, as existentes
+        são descartadas e o restante do lote é gravado de novo.
+
+        `payments` é uma lista de (doc_id, dados). Retorna (criadas, já existentes).
+        """
+        created = existing = 0
+        for chunk in self._create_chunks(payments):
+            try:
+                self._commit_creates(chunk)
+            except AlreadyExists:
+                refs = [self.collection.document(doc_id) for doc_id, _ in chunk]
+                found = {snapshot.id for snapshot in self.db.get_all(refs) if snapshot.exists}
+                chunk = [(doc_id, data) for doc_id, data in chunk if doc_id not in found]
+                existing += len(found)
+                if chunk:
+                    self._commit_creates(chunk)
+            created += len(chunk)
+        return created, existing
+
+    @staticmethod
+    def _create_chunks(payments):
+        """
+        Divide as faturas em lotes que cabem em um commit junto com um
+        documento do livro-caixa por mês de referência do lote.
+        """
+        chunk, months = [], set()
+        for doc_id, data in payments:
+            month = FinancialLedgerService.reference_of(data)
+            if len(chunk) + len(months | {month}) + 1 > BATCH_LIMIT:
+                yield chunk
+                chunk, months = [], set()
+            chunk.append((doc_id, data))
+            months.add(month)
+        if chunk:
+            yield chunk
+
+    def _commit_creates(self, chunk):
+        """Cria as faturas e lança os valores pendentes no livro-caixa no mesmo lote (atômico)."""
+        batch = self.db.batch()
+        for doc_id, data in chunk:
+            batch.create(self.collection.document(doc_id), data)
+        delta = self.ledger_service.merge_deltas(self.ledger_service.delta(new=data) for _, data in chunk)
+        self.ledger_service.apply(batch, delta)
+        batch.commit()
+
+    def _mark_paid(self, payment_ref, update_data, only_if_pending=False):
+        """
+        Dá baixa na fatura e lança a diferença no livro-caixa na mesma
+        transação. Com `only_if_pending`, não altera uma fatura já paga (ex:
+        aprovação no checkout e webhook do mesmo pagamento). Retorna True se a
+        fatura foi alterada e False se ela não existe ou já estava paga.
+        """
+        @firestore.transactional
+        def mark(transaction):
+            snapshot = payment_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+            before = snapshot.to_dict()
+            if only_if_pending and before.get('status') == 'paid':
+                return False
+            transaction.update(payment_ref, update_data)
+            self.ledger_service.apply(transaction, self.ledger_service.delta(before, {**before, **update_data}))
+            return True
+
+        return mark(self.db.transaction())
+
     def generate_monthly_payments(self, year, month):
+        """
+        Gera as mensalidades do mês para todas as matrículas ativas. As faturas
+        que já existem no mês são buscadas com uma única consulta e as novas são
+        gravadas em lotes, com ID `{enrollment_id}_{aaaamm}`: rodar de novo
+        (ou em paralelo) não gera cobrança em duplicidade.
+        """
         try:
+            year, month = int(year), int(month)
             active_enrollments = self.enrollment_service.get_all_active_enrollments_with_details()
-            generated_count = 0
-            existing_count = 0
+            billed = self.get_billed_enrollment_ids(year, month)
+            _, last_day_of_month = calendar.monthrange(year, month)
+            now = datetime.now(timezone.utc)
 
+            new_payments = []
+            existing_count = 0
             for enrollment in active_enrollments:
-                student_id = enrollment['student_id']
                 enrollment_id = enrollment['enrollment_id']
-                
-                existing_payment_query = self.collection.where(
-                    filter=firestore.And(
-                        [
-                            firestore.FieldFilter('student_id', '==', student_id),
-                            firestore.FieldFilter('enrollment_id', '==', enrollment_id),
-                            firestore.FieldFilter('reference_year', '==', int(year)),
-                            firestore.FieldFilter('reference_month', '==', int(month))
-                        ]
-                    )
-                ).limit(1).stream()
-                
-                if len(list(existing_payment_query)) > 0:
+                if enrollment_id in billed:
                     existing_count += 1
                     continue
+                payment_data = self.build_monthly_payment(enrollment, year, month, last_day_of_month, now)
+                if payment_data is not None:
+                    new_payments.append((self.monthly_payment_id(enrollment_id, year, month), payment_data))
 
-                total_due = float(enrollment.get('base_monthly_fee', 0)) - float(enrollment.get('discount_amount', 0))
-                
-                if total_due <= 0:
-                    continue
-
-                due_day = int(enrollment.get('due_day', 15))
-                _, last_day_of_month = calendar.monthrange(int(year), int(month))
-                valid_due_day = min(due_day, last_day_of_month)
-                due_date_obj = datetime(int(year), int(month), valid_due_day, tzinfo=timezone.utc)
-
-                payment_data = {
-                    'student_id': student_id,
-                    'enrollment_id': enrollment_id, 
-                    'amount': total_due,
-                    'status': 'pending',
-                    'reference_month': int(month),
-                    'reference_year': int(year),
-                    'due_day': due_day,
-                    'due_date': due_date_obj,
-                    'type': 'Mensalidade',
-                    'description': f"Mensalidade {enrollment.get('class_name', 'N/A')} - {int(month)}/{int(year)}",
-                    'class_name': enrollment.get('class_name', 'N/A'),
-                    'payment_date': None,
-                    'payment_method': None,
-                    'created_at': datetime.now(timezone.utc),
-                    'updated_at': datetime.now(timezone.utc)
-                }
-                self.collection.add(payment_data)
-                generated_count += 1
-            
-            return {"generated": generated_count, "skipped": existing_count}
+            generated_count, raced_count = self.create_payments(new_payments)
+            return {"generated": generated_count, "skipped": existing_count + raced_count}
 
         except Exception as e:
             logging.error(f"Erro ao gerar cobranças mensais para {month}/{year}: {e}", exc_info=True)
@@ -261,55 +397,110 @@ class PaymentService:
             print(f"Erro ao buscar cobranças para o usuário {user_id}: {e}")
             return []
 
-    def get_financial_status(self, year, month):
-        summary = {'total_paid': 0, 'total_pending': 0, 'total_overdue': 0}
-        paid_payments = []
-        pending_payments = []
+    def _month_query(self, year, month):
+        return self.collection.where(filter=firestore.And(
+            [
+                firestore.FieldFilter('reference_year', '==', year),
+                firestore.FieldFilter('reference_month', '==', month)
+            ]
+        ))
+
+    def get_financial_status(self, year, month, page_size=None, cursor=None):
+        """
+        Cobranças de um mês separadas em pagas e pendentes, com o resumo dos
+        totais. Lê apenas os campos exibidos no painel e resolve os nomes só
+        dos alunos referenciados (lote + cache).
+
+        Com `page_size`, retorna uma página em ordem de ID e `next_cursor`
+        (o ID a passar em `cursor` para a próxima página, ou None no fim). O
+        resumo do mês inteiro vem só na primeira página. O resumo é lido do
+        livro-caixa; antes da primeira reconciliação, é calculado pelas faturas.
+        """
+        year, month = int(year), int(month)
+        _, last_day = calendar.monthrange(year, month)
         today = date.today()
+        due_dates = {}
 
-        try:
-            payments_query = self.collection.where(filter=firestore.And(
-                [
-                    firestore.FieldFilter('reference_year', '==', int(year)),
-                    firestore.FieldFilter('reference_month', '==', int(month))
-                ]
-            )).stream()
-            
-            all_students = {s.id: s.name for s in self.user_service.get_users_by_role('student')}
+        def due_date_for(payment):
+            due_day = min(int(payment.get('due_day') or 15), last_day)
+            if due_day not in due_dates:
+                due_dates[due_day] = date(year, month, due_day)
+            return due_dates[due_day]
 
-            for doc in payments_query:
+        try:
+            query = self._month_query(year, month).select(FINANCIAL_STATUS_FIELDS)
+            if page_size:
+                document_id = FieldPath.document_id()
+                if cursor:
+                    query = query.where(filter=firestore.FieldFilter(document_id, '>', self.collection.document(cursor)))
+                query = query.order_by(document_id).limit(page_size)
+
+            payments = []
+            for doc in query.stream():
                 payment = doc.to_dict()
                 payment['id'] = doc.id
-                payment['student_name'] = all_students.get(payment.get('student_id'), "Aluno Desconhecido")
+                payments.append(payment)
+
+            names = self.user_service.get_user_names(p.get('student_id') for p in payments)
+
+            summary = {'total_paid': 0, 'total_pending': 0, 'total_overdue': 0}
+            paid_payments = []
+            pending_payments = []
+            for payment in payments:
+                payment['student_name'] = names.get(payment.get('student_id')) or "Aluno Desconhecido"
                 amount = float(payment.get('amount', 0))
 
                 if payment.get('status') == 'paid':
                     summary['total_paid'] += amount
                     paid_payments.append(payment)
                 else:
-                    _, last_day = calendar.monthrange(int(year), int(month))
-                    due_day = min(int(payment.get('due_day', 15)), last_day)
-                    due_date = date(int(year), int(month), due_day)
+                    due_date = due_date_for(payment)
                     payment['due_date_formatted'] = due_date.strftime('%d/%m/%Y')
 
-                    if due_date < today and payment.get('status') != 'paid':
+                    if due_date < today:
                         summary['total_overdue'] += amount
                         payment['status'] = 'overdue'
                     else:
                         summary['total_pending'] += amount
                         payment['status'] = 'pending'
-                    
+
                     pending_payments.append(payment)
 
-            return {
+            result = {
                 "summary": summary,
                 "paid_payments": paid_payments,
                 "pending_payments": pending_payments
             }
+            if page_size:
+                # Página cheia: pode haver mais; o cursor é o último ID lido
+                result['next_cursor'] = payments[-1]['id'] if len(payments) == page_size else None
+            if page_size and cursor:
+                result['summary'] = None
+            else:
+                ledger_summary = self.ledger_service.get_month_summary(year, month, today)
+                if ledger_summary is not None:
+                    result['summary'] = ledger_summary
+                elif page_size:
+                    result['summary'] = self._month_summary(year, month, due_date_for, today)
+            return result
         except Exception as e:
             logging.error(f"Erro ao obter status financeiro para {month}/{year}: {e}", exc_info=True)
             raise
 
+    def _month_summary(self, year, month, due_date_for, today):
+        """Totais do mês inteiro lendo só valor, status e vencimento de cada cobrança."""
+        summary = {'total_paid': 0, 'total_pending': 0, 'total_overdue': 0}
+        for doc in self._month_query(year, month).select(['amount', 'status', 'due_day']).stream():
+            payment = doc.to_dict()
+            amount = float(payment.get('amount', 0))
+            if payment.get('status') == 'paid':
+                summary['total_paid'] += amount
+            elif due_date_for(payment) < today:
+                summary['total_overdue'] += amount
+            else:
+                summary['total_pending'] += amount
+        return summary
+
     def record_payment(self, data):
         """Registra um pagamento para uma cobrança existente."""
         payment_id = data.get('payment_id')
@@ -326,11 +517,42 @@ class PaymentService:
             'payment_method_details': data.get('payment_method_details', ''),
             'updated_at': datetime.now(timezone.utc)
         }
-        payment_ref.update(update_data)
+        if not self._mark_paid(payment_ref, update_data):
+            raise ValueError("Fatura não encontrada.")
         return True
 
-    def create_misc_invoices(self, data):
-        student_ids = data.get('student_ids', [])
+    @staticmethod
+    def misc_invoice_id(student_id, invoice_type, due_date):
+        """
+        ID determinístico de uma fatura avulsa: o mesmo tipo com o mesmo
+        vencimento para o mesmo aluno é uma única cobrança, mesmo que o pedido
+        seja repetido (ex: clique duplo ou nova tentativa após erro de rede).
+        O slug legível é truncado; o hash do tipo completo separa tipos que
+        começam igual.
+        """
+        normalized = unicodedata.normalize('NFKD', invoice_type).encode('ascii', 'ignore').decode('ascii').lower()
+        slug = re.sub(r'[^a-z0-9]+', '-', normalized).strip('-')
+        digest = hashlib.sha1(invoice_type.strip().lower().encode('utf-8')).hexdigest()[:8]
+        return f"{student_id}_{slug[:40].rstrip('-') or 'avulsa'}-{digest}_{due_date.strftime('%Y%m%d')}"
+
+    def _existing_payment_ids(self, doc_ids):
+        """IDs (entre `doc_ids`) que já têm fatura, com leituras em lote."""
+        found = set()
+        for chunk_start in range(0, len(doc_ids), BATCH_LIMIT):
+            refs = [self.collection.document(doc_id) for doc_id in doc_ids[chunk_start:chunk_start + BATCH_LIMIT]]
+            found.update(snapshot.id for snapshot in self.db.get_all(refs) if snapshot.exists)
+        return found
+
+    def create_misc_invoices(self, data, dry_run=False):
+        """
+        Cria faturas avulsas (ex: taxa de exame ou evento) para vários alunos,
+        em lotes de até 500 escritas e com IDs determinísticos: repetir o
+        pedido não cobra ninguém duas vezes.
+
+        Com `dry_run`, nada é gravado: retorna as faturas que seriam criadas,
+        quais já existem e os totais, para conferência antes de confirmar.
+        """
+        student_ids = list(dict.fromkeys(data.get('student_ids') or []))
         invoice_type = data.get('type')
         amount = float(data.get('amount', 0))
         due_date_str = data.get('due_date')
@@ -339,8 +561,9 @@ class PaymentService:
             raise ValueError("Dados insuficientes para criar faturas avulsas.")
 
         due_date = datetime.strptime(due_date_str, '%Y-%m-%d')
-        
-        created_count = 0
+        now = datetime.now(timezone.utc)
+
+        invoices = []
         for student_id in student_ids:
             payment_data = {
                 'student_id': student_id,
@@ -356,18 +579,58 @@ class PaymentService:
                 'class_name': 'N/A',
                 'payment_date': None,
                 'payment_method': None,
-                'created_at': datetime.now(timezone.utc),
-                'updated_at': datetime.now(timezone.utc)
+                'created_at': now,
+                'updated_at': now
+            }
+            invoices.append((self.misc_invoice_id(student_id, invoice_type, due_date), payment_data))
+
+        existing = self._existing_payment_ids([doc_id for doc_id, _ in invoices])
+        new_invoices = [(doc_id, payment_data) for doc_id, payment_data in invoices if doc_id not in existing]
+
+        if dry_run:
+            student_names = self.user_service.get_student_names_map() if self.user_service else {}
+            return {
+                'dry_run': True,
+                'invoices': [
+                    {
+                        'id': doc_id,
+                        'student_id': payment_data['student_id'],
+                        'student_name': student_names.get(payment_data['student_id'], "Aluno Desconhecido"),
+                        'type': invoice_type,
+                        'amount': amount,
+                        'due_date': due_date_str,
+                        'already_exists': doc_id in existing
+                    }
+                    for doc_id, payment_data in invoices
+                ],
+                'created': 0,
+                'to_create': len(new_invoices),
+                'skipped': len(existing),
+                'total_amount': round(amount * len(new_invoices), 2)
             }
-            self.collection.add(payment_data)
-            created_count += 1
-            
-        return created_count
+
+        created, raced = self.create_payments(new_invoices)
+        return {
+            'dry_run': False,
+            'created': created,
+            'skipped': len(existing) + raced,
+            'total_amount': round(amount * created, 2)
+        }
 
     # --- NOVOS MÉTODOS PARA O DASHBOARD ---
 
     def get_financial_summary_for_dashboard(self):
-        """Calcula o faturamento do mês atual e o total de inadimplência."""
+        """
+        Faturamento do mês atual e total de inadimplência, lidos do
+        livro-caixa. Antes da primeira reconciliação, soma as faturas.
+        """
+        try:
+            ledger_summary = self.ledger_service.get_dashboard_summary()
+            if ledger_summary is not None:
+                return ledger_summary
+        except Exception as e:
+            logging.error(f"Erro ao ler o livro-caixa para o dashboard: {e}", exc_info=True)
+
         now = datetime.now(timezone.utc)
         start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         
@@ -0,0 +1,152 @@
+import os
+import json
+import atexit
+import struct
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from app.services.face_index import ENCODING_SIZE
+
+# Bloco de controle: versão publicada, horário (epoch) da última leitura completa do Firestore,
+# horário da última alteração de aluno aplicada (ver FacialRecognitionService._sync_changes) e nome do segmento
+_CONTROL = struct.Struct('<qdd64s')
+# Cabeçalho de cada segmento: linhas, dimensão e tamanho do JSON com IDs e nomes (depois da matriz)
+_HEADER = struct.Struct('<qqq')
+
+
+class SharedFaceGallery:
+    """
+    Galeria facial (IDs, nomes e matriz N × 128 float32) publicada em memória
+    compartilhada para todos os workers do gunicorn.
+
+    Deve ser criada no processo mestre, antes do fork (`preload_app`): o bloco
+    de controle e o lock entre processos são herdados pelos workers. Cada
+    publicação grava um segmento novo e troca a versão e o nome no bloco de
+    controle; o segmento anterior é apagado, mas quem ainda o mapeia continua
+    lendo dele até adotar a versão nova. Um leitor só reabre o segmento quando
+    a versão muda, então a busca não copia nem desserializa a matriz.
+
+    Criar o bloco de controle no mestre também inicia ali o resource_tracker,
+    herdado pelos workers: o fim de um worker não apaga segmentos em uso, e
+    os que sobrarem são apagados quando o mestre encerra (`close`).
+    """
+    def __init__(self, prefix=None):
+        self._owner_pid = os.getpid()
+        self._prefix = prefix or f"jitakyo_faces_{self._owner_pid}"
+        self._lock = multiprocessing.RLock()
+        self._load_lock = multiprocessing.Lock()
+        self._control = shared_memory.SharedMemory(create=True, size=_CONTROL.size)
+        _CONTROL.pack_into(self._control.buf, 0, 0, 0.0, 0.0, b'')
+        # Segmento e snapshot adotados por este processo; os anteriores são fechados quando ninguém mais os usa
+        self._segment = None
+        self._snapshot = None
+        self._retired = []
+        atexit.register(self.close)
+
+    def lock(self):
+        """
+        Lock entre processos (reentrante) para ler a versão atual, alterá-la e
+        publicar sem sobrescrever a alteração feita por outro worker.
+        """
+        return self._lock
+
+    def load_lock(self):
+        """
+        Lock entre processos para a releitura completa do Firestore: um worker
+        relê e os demais esperam para adotar o resultado. Separado de `lock()`
+        para que buscas e cadastros não parem durante a leitura.
+        """
+        return self._load_lock
+
+    def _read_control(self):
+        version, loaded_at, changes_at, name = _CONTROL.unpack_from(self._control.buf, 0)
+        return version, loaded_at, changes_at, name.rstrip(b'\0').decode()
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._read_control()[0]
+
+    def publish(self, ids, names, matrix, loaded_at=0.0, changes_at=0.0):
+        """
+        Publica uma nova versão da galeria. `names` acompanha `ids` (mesma
+        ordem), `loaded_at` é o horário (time.time) da última leitura completa
+        do Firestore e `changes_at` o da última alteração de aluno já aplicada.
+        Retorna o número da versão publicada.
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        payload = json.dumps({'ids': [str(i) for i in ids], 'names': list(names)}).encode('utf-8')
+        with self._lock:
+            version, _, _, previous = self._read_control()
+            name = f"{self._prefix}_{version + 1}"
+            segment = shared_memory.SharedMemory(
+                name=name, create=True, size=_HEADER.size + matrix.nbytes + len(payload)
+            )
+            _HEADER.pack_into(segment.buf, 0, matrix.shape[0], matrix.shape[1], len(payload))
+            np.ndarray(matrix.shape, dtype=np.float32, buffer=segment.buf, offset=_HEADER.size)[:] = matrix
+            start = _HEADER.size + matrix.nbytes
+            segment.buf[start:start + len(payload)] = payload
+            _CONTROL.pack_into(self._control.buf, 0, version + 1, loaded_at, changes_at, name.encode())
+            segment.close()
+            if previous:
+                self._unlink(previous)
+        logging.info(f"Galeria facial compartilhada: versão {version + 1} publicada ({matrix.shape[0]} aluno(s))")
+        return version + 1
+
+    def snapshot(self):
+        """
+        Retorna (versão, ids, nomes, matriz, loaded_at, changes_at) da versão publicada.
+        A matriz é uma visão somente leitura do segmento compartilhado (sem
+        cópia). Antes da primeira publicação, a versão é 0 e a galeria vazia.
+        """
+        with self._lock:
+            version, loaded_at, changes_at, name = self._read_control()
+            if self._snapshot is not None and self._snapshot[0] == version:
+                return self._snapshot
+            if not name:
+                return 0, [], [], np.empty((0, ENCODING_SIZE), dtype=np.float32), 0.0, 0.0
+            # Aberto sob o lock: nenhuma publicação apaga o segmento entre a leitura do nome e a abertura
+            segment = shared_memory.SharedMemory(name=name)
+            rows, dim, payload_size = _HEADER.unpack_from(segment.buf, 0)
+            matrix = np.ndarray((rows, dim), dtype=np.float32, buffer=segment.buf, offset=_HEADER.size)
+            matrix.flags.writeable = False
+            start = _HEADER.size + matrix.nbytes
+            payload = json.loads(bytes(segment.buf[start:start + payload_size]).decode('utf-8'))
+
+            if self._segment is not None:
+                self._retired.append(self._segment)
+            self._segment = segment
+            self._snapshot = (version, payload['ids'], payload['names'], matrix, loaded_at, changes_at)
+            self._close_retired()
+            return self._snapshot
+
+    def _close_retired(self):
+        """Fecha os segmentos antigos cujas matrizes já não são usadas por nenhum índice."""
+        still_used = []
+        for segment in self._retired:
+            try:
+                segment.close()
+            except BufferError:
+                still_used.append(segment)
+        self._retired = still_used
+
+    @staticmethod
+    def _unlink(name):
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """Apaga o bloco de controle e o segmento atual. Só tem efeito no processo que criou a galeria."""
+        if os.getpid() != self._owner_pid or self._control is None:
+            return
+        _, _, _, name = self._read_control()
+        if name:
+            self._unlink(name)
+        self._control.close()
+        self._control.unlink()
+        self._control = None
@@ -2,12 +2,19 @@ from datetime import datetime
 from firebase_admin import firestore
 from app.models.training_class import TrainingClass
 from app.models.schedule_slot import ScheduleSlot
+from app.utils.cache import TTLCache
+from app.services.attendance_service import WEEKDAY_NAMES
+
+# Janela (minutos antes/depois do início) em que uma aula é considerada "agora" pelo Kiosk
+ACTIVE_CLASS_WINDOW_MINUTES = 45
 
 class TrainingClassService:
     def __init__(self, db, teacher_service=None):
         self.db = db
         self.teacher_service = teacher_service
         self.collection = self.db.collection('classes')
+        # Turmas e horários mudam raramente; evita reler a coleção a cada chamada.
+        self._classes_cache = TTLCache(ttl_seconds=300, max_entries=4)
 
     def get_all_classes(self):
         """
@@ -47,6 +54,48 @@ class TrainingClassService:
             print(f"Erro ao buscar turma por ID '{class_id}': {e}")
             return None
             
+    def get_classes_map(self):
+        """
+        Retorna um mapa {class_id: TrainingClass} de todas as turmas, mantido em
+        cache por alguns minutos. Usado em validações em lote (ex: chamadas).
+        """
+        return self._classes_cache.get_or_load('all', self._load_classes_map)
+
+    def get_active_classes(self, now=None, window_minutes=ACTIVE_CLASS_WINDOW_MINUTES):
+        """
+        Retorna as turmas com aula começando dentro de ±`window_minutes` de
+        `now`, da mais próxima para a mais distante. Usa o mapa em cache,
+        sem consultar o Firestore a cada check-in.
+        """
+        now = now or datetime.now()
+        weekday = WEEKDAY_NAMES[now.weekday()]
+        current_minutes = now.hour * 60 + now.minute
+        active = []
+        for training_class in self.get_classes_map().values():
+            for slot in training_class.schedule:
+                if slot.day_of_week != weekday or not slot.start_time:
+                    continue
+                try:
+                    start_h, start_m = map(int, slot.start_time.split(':'))
+                except ValueError:
+                    continue
+                offset = abs(current_minutes - (start_h * 60 + start_m))
+                if offset <= window_minutes:
+                    active.append((offset, training_class))
+                    break
+        active.sort(key=lambda item: item[0])
+        return [training_class for _, training_class in active]
+
+    def _load_classes_map(self):
+        classes_map = {}
+        try:
+            for doc in self.collection.stream():
+                classes_map[doc.id] = TrainingClass.from_dict(doc.to_dict(), doc.id)
+        except Exception as e:
+            print(f"Erro ao carregar mapa de turmas: {e}")
+            raise e
+        return classes_map
+
     # --- NOVO MÉTODO ADICIONADO ---
     def get_class_by_id_as_dict(self, class_id):
         """Busca uma turma específica e retorna um dicionário enriquecido."""
@@ -90,6 +139,7 @@ class TrainingClassService:
             
             doc_ref = self.collection.document()
             doc_ref.set(class_data)
+            self._classes_cache.invalidate()
             
             # Retorna o dicionário completo para a API
             return self.get_class_by_id_as_dict(doc_ref.id)
@@ -105,6 +155,7 @@ class TrainingClassService:
             
             data['updated_at'] = firestore.SERVER_TIMESTAMP
             self.collection.document(class_id).update(data)
+            self._classes_cache.invalidate()
             return True
         except Exception as e:
             print(f"Erro ao atualizar turma com ID '{class_id}': {e}")
@@ -114,6 +165,7 @@ class TrainingClassService:
         """Deleta uma turma pelo seu ID."""
         try:
             self.collection.document(class_id).delete()
+            self._classes_cache.invalidate()
             return True
         except Exception as e:
             print(f"Erro ao deletar turma com ID '{class_id}': {e}")
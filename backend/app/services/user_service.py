@@ -5,6 +5,14 @@ from datetime import datetime, timedelta
 from firebase_admin import auth, firestore
 from flask_mail import Message
 from app.models.user import User
+from app.models.face_embedding import FaceEmbedding, LEGACY_FIELDS
+from app.utils.cache import TTLCache
+
+# Máximo de documentos por leitura em lote (get_all) de nomes
+NAMES_BATCH_SIZE = 300
+_NOT_CACHED = object()
+# Campos do usuário que afetam a galeria facial do Kiosk
+FACE_GALLERY_FIELDS = ('name', 'role', 'face_embedding', 'face_encoding', 'face_descriptor', 'has_face_registered')
 
 class UserService:
     def __init__(self, db, mail=None):
@@ -15,8 +23,13 @@ class UserService:
         """
         self.db = db
         self.collection = self.db.collection('users')
+        # Alunos alterados, para o serviço do Kiosk atualizar a galeria sem reler todos
+        self.face_changes = self.db.collection('face_gallery_changes')
         self.mail = mail
         self.enrollment_service = None
+        self._names_cache = TTLCache(ttl_seconds=300, max_entries=8)
+        # Nome por usuário, para resolver só os IDs referenciados (ex: cobranças de um mês)
+        self._user_names_cache = TTLCache(ttl_seconds=300, max_entries=5000)
 
     def set_enrollment_service(self, enrollment_service):
         """Define o serviço de matrículas para resolver dependências circulares."""
@@ -108,6 +121,7 @@ class UserService:
                 'updated_at': firestore.SERVER_TIMESTAMP
             }
             self.collection.document(user_id).set(user_data)
+            self._names_cache.invalidate()
             return self.get_user_by_id(user_id)
         except Exception as e:
             logging.error(f"Erro ao criar registro de usuário: {e}")
@@ -140,6 +154,7 @@ class UserService:
             if 'guardians' in user_data: db_user_data['guardians'] = user_data['guardians']
 
             self.collection.document(uid).set(db_user_data)
+            self._names_cache.invalidate()
             
             # 3. Matrículas
             if self.enrollment_service and enrollments_data:
@@ -185,6 +200,100 @@ class UserService:
             logging.error(f"Erro por role {role}: {e}")
         return users
         
+    def get_student_names_map(self):
+        """
+        Retorna um mapa {student_id: nome} de todos os alunos, mantido em cache
+        por alguns minutos. Usado para enriquecer relatórios e exportações.
+        """
+        return self._names_cache.get_or_load('students', self._load_student_names_map)
+
+    def _load_student_names_map(self):
+        names = {}
+        docs = self.collection.where(filter=firestore.FieldFilter('role', '==', 'student')).select(['name']).stream()
+        for doc in docs:
+            names[doc.id] = (doc.to_dict() or {}).get('name')
+        return names
+
+    def get_user_names(self, user_ids):
+        """
+        Retorna {user_id: nome} apenas para os IDs informados. Os que não
+        estão em cache são lidos em lote (get_all), trazendo só o campo 'name'.
+        IDs sem documento ficam de fora do mapa (e fora do cache, para um
+        usuário recém-criado aparecer na próxima consulta).
+        """
+        names = {}
+        missing = []
+        for uid in dict.fromkeys(u for u in user_ids if u):
+            name = self._user_names_cache.get(uid, _NOT_CACHED)
+            if name is _NOT_CACHED:
+                missing.append(uid)
+            else:
+                names[uid] = name
+
+        for chunk_start in range(0, len(missing), NAMES_BATCH_SIZE):
+            refs = [self.collection.document(uid) for uid in missing[chunk_start:chunk_start + NAMES_BATCH_SIZE]]
+            for snapshot in self.db.get_all(refs, field_paths=['name']):
+                if not snapshot.exists:
+                    continue
+                name = (snapshot.to_dict() or {}).get('name')
+                self._user_names_cache.set(snapshot.id, name)
+                names[snapshot.id] = name
+        return names
+
+    @staticmethod
+    def _face_gallery_entry(doc):
+        data = doc.to_dict() or {}
+        if data.get('role', 'student') != 'student':
+            return None
+        embedding = FaceEmbedding.from_firestore(data)
+        if embedding is None:
+            return None
+        return doc.id, data.get('name'), embedding.vector
+
+    def get_face_gallery_entries(self):
+        """
+        Retorna (id, nome, encoding) de todos os alunos com face cadastrada,
+        lendo apenas os campos necessários para a galeria do Kiosk.
+        """
+        entries = []
+        try:
+            docs = self.collection.where(filter=firestore.FieldFilter('has_face_registered', '==', True)) \
+                                  .select(['name', 'role', 'face_embedding', 'face_embedding_model', 'face_encoding', 'face_descriptor']).stream()
+            for doc in docs:
+                entry = self._face_gallery_entry(doc)
+                if entry:
+                    entries.append(entry)
+        except Exception as e:
+            logging.error(f"Erro ao carregar galeria facial: {e}")
+        return entries
+
+    def get_face_gallery_entry(self, uid):
+        """Retorna (id, nome, encoding) de um aluno, ou None se não tiver face cadastrada."""
+        try:
+            doc = self.collection.document(uid).get()
+            return self._face_gallery_entry(doc) if doc.exists else None
+        except Exception as e:
+            logging.error(f"Erro ao buscar face do usuário {uid}: {e}")
+            return None
+
+    def _mark_face_gallery_change(self, writer, uid):
+        """Registra, no mesmo lote da alteração do usuário, que a entrada dele na galeria mudou."""
+        writer.set(self.face_changes.document(uid), {'changed_at': firestore.SERVER_TIMESTAMP})
+
+    def get_latest_face_gallery_change(self):
+        """Horário (do servidor) da alteração mais recente da galeria, ou None."""
+        docs = self.face_changes.order_by('changed_at', direction=firestore.Query.DESCENDING).limit(1).stream()
+        for doc in docs:
+            return doc.to_dict().get('changed_at')
+        return None
+
+    def get_face_gallery_changes(self, since=None):
+        """Retorna [(id, changed_at)] dos alunos alterados depois de `since`, do mais antigo ao mais novo."""
+        query = self.face_changes
+        if since is not None:
+            query = query.where(filter=firestore.FieldFilter('changed_at', '>', since))
+        return [(doc.id, doc.to_dict().get('changed_at')) for doc in query.order_by('changed_at').stream()]
+
     def get_all_users(self):
         users = []
         try:
@@ -210,6 +319,16 @@ class UserService:
             logging.error(f"Erro pesquisa: {e}")
         return students
 
+    @staticmethod
+    def _embedding_from_update(data):
+        """Converte o embedding recebido (objeto ou lista legada) em FaceEmbedding, se houver."""
+        if isinstance(data.get('face_embedding'), FaceEmbedding):
+            return data['face_embedding']
+        for field, model in LEGACY_FIELDS:
+            if data.get(field):
+                return FaceEmbedding.from_values(data[field], model)
+        return None
+
     def update_user(self, uid, data):
         """Atualiza dados e suporta biometria facial e PAR-Q."""
         try:
@@ -217,10 +336,21 @@ class UserService:
             auth_update_data = {}
 
             # IMPORTANTE: par_q_data e par_q_filled foram adicionados à lista de campos permitidos
-            fields = ['name', 'email', 'role', 'phone', 'guardians', 'face_descriptor', 'has_face_registered', 'par_q_data', 'par_q_filled']
+            fields = ['name', 'email', 'role', 'phone', 'guardians', 'has_face_registered', 'par_q_data', 'par_q_filled']
             for f in fields:
                 if f in data: update_data[f] = data[f]
 
+            embedding = self._embedding_from_update(data)
+            if embedding is not None:
+                # Uma única representação binária; os campos legados em lista são removidos
+                update_data.update(embedding.to_firestore())
+                update_data['face_encoding'] = firestore.DELETE_FIELD
+                update_data['face_descriptor'] = firestore.DELETE_FIELD
+                if 'face_exemplars' not in update_data:
+                    # Cadastro com uma única amostra: descarta as amostras do cadastro anterior
+                    update_data['face_exemplars'] = firestore.DELETE_FIELD
+                    update_data['face_sample_count'] = firestore.DELETE_FIELD
+
             if 'name' in data: auth_update_data['display_name'] = data['name']
             if 'email' in data: auth_update_data['email'] = data['email']
 
@@ -231,16 +361,24 @@ class UserService:
                     update_data['date_of_birth'] = firestore.DELETE_FIELD
             
             # Garantir booleano para o controle de face
-            if 'face_descriptor' in data and data['face_descriptor']:
+            if embedding is not None:
                 update_data['has_face_registered'] = True
 
             if update_data:
                 update_data['updated_at'] = firestore.SERVER_TIMESTAMP
-                self.collection.document(uid).update(update_data)
+                batch = self.db.batch()
+                batch.update(self.collection.document(uid), update_data)
+                if any(f in update_data for f in FACE_GALLERY_FIELDS):
+                    self._mark_face_gallery_change(batch, uid)
+                batch.commit()
 
             if auth_update_data:
                 auth.update_user(uid, **auth_update_data)
 
+            if 'name' in data:
+                self._user_names_cache.invalidate(uid)
+                self._names_cache.invalidate()
+
             return self.get_user_by_id(uid)
         except Exception as e:
             logging.error(f"Erro ao atualizar {uid}: {e}")
@@ -256,7 +394,13 @@ class UserService:
                     batch.delete(ref)
 
             batch.delete(self.collection.document(uid))
+            self._mark_face_gallery_change(batch, uid)
             batch.commit()
+            if self.enrollment_service:
+                # As matrículas apagadas no lote não passam pelo EnrollmentService
+                self.enrollment_service._roster_cache.invalidate()
+            self._user_names_cache.invalidate(uid)
+            self._names_cache.invalidate()
             auth.delete_user(uid)
             return True
         except Exception as e:
@@ -0,0 +1,274 @@
+import os
+import uuid
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from firebase_admin import firestore
+
+# Threads que consultam o Mercado Pago em paralelo (rajadas de notificações)
+DEFAULT_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+# Tempo após o qual um evento preso em processamento pode ser assumido de novo
+LEASE_SECONDS = 60
+# Tentativas por evento antes de marcá-lo como falha
+MAX_ATTEMPTS = 5
+# Espera antes de cada nova tentativa (multiplicada pelo número de tentativas)
+RETRY_DELAY_SECONDS = 5
+# IDs de notificação guardados por evento para reconhecer os reenvios
+MAX_NOTIFICATION_IDS = 20
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WebhookService:
+    """
+    Fila das notificações de pagamento do Mercado Pago em
+    `payment_webhook_events/{id do pagamento no MP}`.
+
+    A rota só grava a notificação e responde; a consulta ao Mercado Pago e a
+    baixa da fatura são feitas por um pool de threads. Reenvios da mesma
+    notificação (mesmo `id`) não geram trabalho, e notificações que chegam
+    enquanto o pagamento já está na fila são agrupadas em um único
+    processamento. Depois da consulta, o par (pagamento, status) é a chave de
+    idempotência: um status já aplicado não grava nada de novo.
+
+    Eventos que ficaram na fila (ex: instância reiniciada) são retomados
+    pelo `process_pending`, chamado pelo script webhook_job.py.
+
+    No Cloud Run, as threads continuam depois da resposta só porque a API
+    principal roda com CPU sempre alocada (`--no-cpu-throttling`, ver
+    cloudbuild.yaml). O webhook_job.py roda como job do Cloud Run, disparado
+    pelo Cloud Scheduler a cada 10 minutos, para o que ainda assim sobrar.
+    """
+    def __init__(self, db, payment_service, max_workers=DEFAULT_WORKERS, lease_seconds=LEASE_SECONDS,
+                 retry_delay_seconds=RETRY_DELAY_SECONDS):
+        self.db = db
+        self.collection = self.db.collection('payment_webhook_events')
+        self.payment_service = payment_service
+        self.lease_seconds = lease_seconds
+        self.retry_delay_seconds = retry_delay_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mp-webhook')
+        # Eventos em andamento neste processo (evita submeter o mesmo duas vezes)
+        self._running = set()
+        self._running_lock = threading.Lock()
+
+    @staticmethod
+    def idempotency_key(mp_payment_id, status):
+        return f"{mp_payment_id}_{status}"
+
+    # --- Recebimento ---
+
+    def receive(self, notification):
+        """
+        Persiste a notificação e a coloca na fila, sem consultar o Mercado
+        Pago. Retorna o ID do evento, ou None se a notificação não é de
+        pagamento (nada a processar).
+        """
+        if notification.get('type') != 'payment' or not (notification.get('data') or {}).get('id'):
+            return None
+        mp_payment_id = str(notification['data']['id'])
+        notification_id = str(notification.get('id') or '')
+        event_ref = self.collection.document(mp_payment_id)
+
+        @firestore.transactional
+        def store(transaction):
+            snapshot = event_ref.get(transaction=transaction)
+            now = datetime.now(timezone.utc)
+            if not snapshot.exists:
+                transaction.set(event_ref, {
+                    'mp_payment_id': mp_payment_id,
+                    'state': QUEUED,
+                    'sequence': 1,
+                    'attempts': 0,
+                    'raw': notification,
+                    'notification_ids': [notification_id] if notification_id else [],
+                    'processed_keys': [],
+                    'duplicates': 0,
+                    'received_at': now,
+                    'last_received_at': now
+                })
+                return True
+
+            event = snapshot.to_dict()
+            notification_ids = event.get('notification_ids', [])
+            if notification_id and notification_id in notification_ids:
+                # Reenvio de uma notificação já registrada
+                transaction.update(event_ref, {'duplicates': firestore.Increment(1), 'last_received_at': now})
+                return False
+
+            updates = {
+                'sequence': firestore.Increment(1),
+                'raw': notification,
+                'last_received_at': now
+            }
+            if notification_id:
+                updates['notification_ids'] = (notification_ids + [notification_id])[-MAX_NOTIFICATION_IDS:]
+            if event.get('state') in (DONE, FAILED):
+                # O status do pagamento pode ter mudado: consulta de novo
+                updates.update({'state': QUEUED, 'attempts': 0, 'last_error': None})
+            # Em processamento, a nova sequência faz o evento voltar para a fila ao terminar
+            transaction.update(event_ref, updates)
+            return event.get('state') != PROCESSING
+
+        if store(self.db.transaction()):
+            self._dispatch(mp_payment_id)
+        return mp_payment_id
+
+    def process_pending(self):
+        """
+        Submete os eventos na fila e os que ficaram presos em processamento
+        (concessão vencida). Retorna quantos foram submetidos.
+        """
+        now = datetime.now(timezone.utc)
+        queued = self.collection.where(filter=firestore.FieldFilter('state', '==', QUEUED)).select(['state']).stream()
+        stale = self.collection.where(filter=firestore.And([
+            firestore.FieldFilter('state', '==', PROCESSING),
+            firestore.FieldFilter('lease_until', '<', now)
+        ])).select(['state']).stream()
+        event_ids = [doc.id for doc in queued] + [doc.id for doc in stale]
+        for event_id in event_ids:
+            self._dispatch(event_id)
+        return len(event_ids)
+
+    def wait(self, poll_seconds=0.5):
+        """Aguarda os eventos em andamento neste processo (usado pelo script de linha de comando)."""
+        while True:
+            with self._running_lock:
+                if not self._running:
+                    return
+            time.sleep(poll_seconds)
+
+    def _dispatch(self, event_id):
+        with self._running_lock:
+            if event_id in self._running:
+                return
+            self._running.add(event_id)
+        self._executor.submit(self._run_event, event_id)
+
+    # --- Processamento ---
+
+    def _run_event(self, event_id):
+        event_ref = self.collection.document(event_id)
+        token = uuid.uuid4().hex
+        again = retry_in = None
+        try:
+            claimed = self._claim(event_ref, token)
+            if claimed is None:
+                return
+            try:
+                result = self._process(claimed)
+            except Exception as e:
+                logging.error(f"Erro ao processar o webhook do pagamento {event_id}: {e}", exc_info=True)
+                retry_in = self._record_failure(event_ref, token, e)
+                return
+            again = self._finish(event_ref, token, claimed['sequence'], result)
+        except Exception as e:
+            logging.error(f"Erro na fila de webhooks (pagamento {event_id}): {e}", exc_info=True)
+        finally:
+            if again:
+                # Chegou notificação nova durante o processamento
+                self._executor.submit(self._run_event, event_id)
+            elif retry_in:
+                threading.Timer(retry_in, self._executor.submit, [self._run_event, event_id]).start()
+            else:
+                with self._running_lock:
+                    self._running.discard(event_id)
+
+    def _claim(self, event_ref, token):
+        """Assume o evento se ele está na fila (ou preso com a concessão vencida). Retorna o evento ou None."""
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = event_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            event = snapshot.to_dict()
+            now = datetime.now(timezone.utc)
+            state = event.get('state')
+            if state == PROCESSING and event.get('lease_until') and event['lease_until'] > now:
+                return None
+            if state not in (QUEUED, PROCESSING):
+                return None
+            transaction.update(event_ref, {
+                'state': PROCESSING,
+                'owner': token,
+                'lease_until': now + timedelta(seconds=self.lease_seconds),
+                'attempts': event.get('attempts', 0) + 1
+            })
+            return event
+
+        return claim(self.db.transaction())
+
+    def _process(self, event):
+        """Consulta o pagamento no Mercado Pago e aplica o status na fatura, se ainda não aplicado."""
+        mp_payment_id = event['mp_payment_id']
+        payment_info = self.payment_service.fetch_mercado_pago_payment(mp_payment_id)
+        status = payment_info.get('status')
+        key = self.idempotency_key(mp_payment_id, status)
+        result = {
+            'key': key,
+            'mp_status': status,
+            'external_reference': payment_info.get('external_reference'),
+            'changed': False
+        }
+        if key not in event.get('processed_keys', []):
+            result['changed'] = self.payment_service.apply_mercado_pago_payment(mp_payment_id, payment_info)
+        return result
+
+    def _finish(self, event_ref, token, sequence, result):
+        """
+        Registra o resultado e conclui o evento. Se chegou notificação nova
+        durante o processamento, o evento volta para a fila e retorna True.
+        """
+        @firestore.transactional
+        def finish(transaction):
+            snapshot = event_ref.get(transaction=transaction)
+            event = snapshot.to_dict() if snapshot.exists else None
+            if event is None or event.get('owner') != token:
+                return False
+            requeue = event.get('sequence') != sequence
+            transaction.update(event_ref, {
+                'state': QUEUED if requeue else DONE,
+                'owner': None,
+                'lease_until': None,
+                'attempts': 0 if requeue else event.get('attempts', 0),
+                'processed_keys': firestore.ArrayUnion([result['key']]),
+                'mp_status': result['mp_status'],
+                'external_reference': result['external_reference'],
+                'last_error': None,
+                'processed_at': datetime.now(timezone.utc)
+            })
+            return requeue
+
+        return finish(self.db.transaction())
+
+    def _record_failure(self, event_ref, token, error):
+        """
+        Devolve o evento para a fila (ou marca como falha após MAX_ATTEMPTS).
+        Retorna a espera em segundos até a nova tentativa, ou None.
+        """
+        @firestore.transactional
+        def fail(transaction):
+            snapshot = event_ref.get(transaction=transaction)
+            event = snapshot.to_dict() if snapshot.exists else None
+            if event is None or event.get('owner') != token:
+                return None
+            attempts = event.get('attempts', 0)
+            failed = attempts >= MAX_ATTEMPTS
+            transaction.update(event_ref, {
+                'state': FAILED if failed else QUEUED,
+                'owner': None,
+                'lease_until': None,
+                'last_error': str(error),
+                'updated_at': datetime.now(timezone.utc)
+            })
+            return None if failed else self.retry_delay_seconds * attempts
+
+        try:
+            return fail(self.db.transaction())
+        except Exception as e:
+            logging.error(f"Erro ao registrar falha do webhook {event_ref.id}: {e}", exc_info=True)
+            return None
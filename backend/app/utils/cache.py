@@ -0,0 +1,63 @@
+# /app/utils/cache.py
+
+import threading
+import time
+
+
+class TTLCache:
+    """
+    Cache simples em memória, com expiração por tempo (TTL), seguro para as
+    threads do gunicorn. Cada instância do Cloud Run mantém a sua própria cópia.
+    """
+    def __init__(self, ttl_seconds=60, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            if len(self._data) >= self.max_entries and key not in self._data:
+                self._evict_locked()
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def get_or_load(self, key, loader):
+        """Retorna o valor cacheado ou executa `loader()` e guarda o resultado."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Remove uma chave específica ou, sem argumentos, todo o cache."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        expired = [k for k, (expires_at, _) in self._data.items() if expires_at < now]
+        for k in expired:
+            del self._data[k]
+        if len(self._data) >= self.max_entries:
+            # Remove a entrada que expira primeiro
+            oldest = min(self._data, key=lambda k: self._data[k][0])
+            del self._data[oldest]
+
+
+_MISSING = object()
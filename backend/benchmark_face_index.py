@@ -0,0 +1,87 @@
+# backend/benchmark_face_index.py
+
+import os
+import sys
+import argparse
+import tempfile
+import time
+import numpy as np
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from app.services.face_index import ENCODING_SIZE, FACE_INDEX_TYPES, FaceIndex, create_face_index
+
+
+def synthetic_gallery(size, queries, seed=0):
+    """
+    Gera uma galeria sintética com a escala dos encodings do dlib (norma ~1,
+    mesma pessoa a ~0,3 de distância) e consultas que são novas "fotos" de
+    pessoas cadastradas.
+    """
+    rng = np.random.default_rng(seed)
+    gallery = rng.normal(0, 0.09, size=(size, ENCODING_SIZE)).astype(np.float32)
+    targets = rng.integers(0, size, size=queries)
+    probes = gallery[targets] + rng.normal(0, 0.025, size=(queries, ENCODING_SIZE)).astype(np.float32)
+    return gallery, probes
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def main():
+    """
+    Compara os índices da galeria facial (recall@1 contra a busca exata e
+    latência por consulta) em galerias sintéticas de vários tamanhos.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark dos índices da galeria facial.")
+    parser.add_argument('--sizes', default='1000,10000,50000', help="Tamanhos de galeria separados por vírgula")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--indexes', default=','.join(FACE_INDEX_TYPES), help="Índices a comparar")
+    parser.add_argument('--nprobe', type=int, default=8, help="Listas visitadas pelo índice IVF")
+    args = parser.parse_args()
+
+    kinds = args.indexes.split(',')
+    print(f"{'tamanho':>8} {'índice':>9} {'build ms':>9} {'recall@1':>9} {'p50 ms':>8} {'p95 ms':>8} {'save+load ms':>13}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        gallery, probes = synthetic_gallery(size, args.queries)
+        ids = [f"aluno{i}" for i in range(size)]
+        expected = None
+
+        for kind in kinds:
+            params = {'nprobe': args.nprobe} if kind == 'ivf' else {}
+            index = create_face_index(kind, **params)
+            started = time.perf_counter()
+            index.add(ids, gallery)
+            index._rebuild()
+            build_ms = (time.perf_counter() - started) * 1000
+
+            found, times = [], []
+            for probe in probes:
+                started = time.perf_counter()
+                result_ids, _ = index.search(probe, 2)
+                times.append(time.perf_counter() - started)
+                found.append(result_ids[0])
+            found = np.array(found, dtype=object)
+            if expected is None:
+                # O primeiro índice da lista é a referência (por padrão, a força bruta exata)
+                expected = found
+            recall = float((found == expected).mean())
+
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'index.npz')
+                started = time.perf_counter()
+                index.save(path)
+                FaceIndex.load(path, **params)
+                persist_ms = (time.perf_counter() - started) * 1000
+
+            print(f"{size:>8} {kind:>9} {build_ms:>9.0f} {recall:>9.3f} {percentile_ms(times, 50):>8.3f} "
+                  f"{percentile_ms(times, 95):>8.3f} {persist_ms:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# backend/benchmark_face_recognition.py
+
+import os
+import io
+import sys
+import json
+import argparse
+import time
+import numpy as np
+from PIL import Image
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from app.services.face_index import ENCODING_SIZE
+from app.services.face_enrollment import build_enrollment_embedding, FaceEnrollmentError
+from app.services.facial_recognition_service import FacialRecognitionService, MATCH, AMBIGUOUS
+from app.services.face_pipeline import FacePipeline, STAGES
+from evaluate_face_recognition import load_labelled_images, percentile_ms
+
+DEFAULT_BASELINE = os.path.join(project_root, 'face_benchmark_baseline.json')
+
+# Métricas de acurácia em que maior é melhor; as demais taxas e as latências (*_ms) devem cair
+HIGHER_IS_BETTER = ('identification_rate', 'class_identification_rate')
+# Variação absoluta (ms) abaixo da qual uma latência nunca conta como regressão (ruído de medição)
+LATENCY_NOISE_MS = 0.25
+
+# Quadros sintéticos (sem rostos) para medir decodificação e detecção: foto do celular
+# (com EXIF girado), Full HD da webcam do tablet e HD
+SYNTHETIC_FRAME_SIZES = ((4032, 3024, 6), (1920, 1080, 1), (1280, 720, 1))
+
+
+class SyntheticGallerySource:
+    """Substitui o UserService: entrega a galeria sintética no formato de `get_face_gallery_entries`."""
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def get_face_gallery_entries(self):
+        return [(f"aluno{i}", f"Aluno {i}", vector) for i, vector in enumerate(self.vectors)]
+
+    # A galeria sintética não muda durante o benchmark: nenhuma alteração de aluno a sincronizar
+    def get_latest_face_gallery_change(self):
+        return None
+
+    def get_face_gallery_changes(self, since=None):
+        return []
+
+
+def synthetic_identities(count, mode, rng, lookalike_distance=0.45):
+    """
+    Centros de identidade com a escala dos encodings do dlib (norma ~1).
+    No modo 'perturbed', 20% das pessoas são "sósias" de outra, a cerca de
+    `lookalike_distance`, para exercitar os testes de margem e de razão.
+    """
+    centers = rng.normal(0, 0.09, size=(count, ENCODING_SIZE)).astype(np.float32)
+    if mode == 'perturbed' and count > 1:
+        lookalikes = rng.choice(np.arange(1, count), size=count // 5, replace=False)
+        sigma = lookalike_distance / np.sqrt(ENCODING_SIZE)
+        for i in lookalikes:
+            centers[i] = centers[rng.integers(0, i)] + rng.normal(0, sigma, ENCODING_SIZE)
+    return centers
+
+
+def synthetic_photos(center, count, noise, rng):
+    """Novas "fotos" (encodings) de uma pessoa: o centro mais ruído de pose/iluminação."""
+    return center + rng.normal(0, noise, size=(count, ENCODING_SIZE)).astype(np.float32)
+
+
+def run_gallery_benchmark(size, mode, args):
+    """Acurácia e latência da comparação contra uma galeria sintética de `size` alunos."""
+    rng = np.random.default_rng(args.seed + size)
+    impostor_count = max(1, int(size * args.impostor_ratio))
+    centers = synthetic_identities(size + impostor_count, mode, rng)
+
+    enrolled, enroll_failures = [], 0
+    for center in centers[:size]:
+        photos = synthetic_photos(center, args.enroll_photos, args.noise, rng)
+        try:
+            enrolled.append(build_enrollment_embedding(photos)['embedding'].vector)
+        except FaceEnrollmentError:
+            # No cadastro real a recepção tiraria novas fotos; aqui fica a primeira
+            enroll_failures += 1
+            enrolled.append(photos[0])
+    service = FacialRecognitionService(
+        user_service=SyntheticGallerySource(enrolled), index_type=args.index, index_path=None
+    )
+    started = time.perf_counter()
+    service.load_gallery()
+    load_ms = (time.perf_counter() - started) * 1000
+
+    targets = rng.integers(0, size, size=args.queries)
+    genuine = [synthetic_photos(centers[t], 1, args.noise, rng)[0] for t in targets]
+    impostors = [
+        synthetic_photos(centers[size + i % impostor_count], 1, args.noise, rng)[0]
+        for i in range(max(1, args.queries // 5))
+    ]
+
+    counts = {'correct': 0, 'wrong': 0, 'ambiguous': 0, 'missed': 0, 'false_accept': 0}
+    match_times = []
+    for target, probe in zip(targets, genuine):
+        started = time.perf_counter()
+        result = service.identify_encoding(probe)
+        match_times.append(time.perf_counter() - started)
+        if result['status'] == MATCH:
+            counts['correct' if result['student']['id'] == f"aluno{target}" else 'wrong'] += 1
+        elif result['status'] == AMBIGUOUS:
+            counts['ambiguous'] += 1
+        else:
+            counts['missed'] += 1
+    for probe in impostors:
+        if service.identify_encoding(probe)['status'] == MATCH:
+            counts['false_accept'] += 1
+
+    # Grupo na frente do Kiosk: 4 rostos por chamada
+    batch_times = []
+    for start in range(0, len(genuine) - 3, 4):
+        started = time.perf_counter()
+        service.identify_encodings(genuine[start:start + 4])
+        batch_times.append(time.perf_counter() - started)
+
+    # Busca restrita aos alunos da turma em horário (30 candidatos, incluindo o aluno certo)
+    class_times, class_correct = [], 0
+    for target, probe in zip(targets, genuine):
+        candidates = {f"aluno{i}" for i in rng.choice(size, size=min(29, size), replace=False)}
+        candidates.add(f"aluno{target}")
+        started = time.perf_counter()
+        result = service.identify_encodings([probe], candidate_ids=candidates)[0]
+        class_times.append(time.perf_counter() - started)
+        if result['status'] == MATCH and result['student']['id'] == f"aluno{target}":
+            class_correct += 1
+
+    queries = len(genuine)
+    return {
+        'identification_rate': round(counts['correct'] / queries, 4),
+        'misidentification_rate': round(counts['wrong'] / queries, 4),
+        'ambiguous_rate': round(counts['ambiguous'] / queries, 4),
+        'missed_rate': round(counts['missed'] / queries, 4),
+        'false_accept_rate': round(counts['false_accept'] / len(impostors), 4),
+        'class_identification_rate': round(class_correct / queries, 4),
+        'enroll_failure_rate': round(enroll_failures / size, 4),
+        'load_ms': round(load_ms, 1),
+        'match_p50_ms': round(percentile_ms(match_times, 50), 3),
+        'match_p95_ms': round(percentile_ms(match_times, 95), 3),
+        'batch4_p50_ms': round(percentile_ms(batch_times, 50), 3),
+        'batch4_p95_ms': round(percentile_ms(batch_times, 95), 3),
+        'class_p50_ms': round(percentile_ms(class_times, 50), 3),
+        'class_p95_ms': round(percentile_ms(class_times, 95), 3)
+    }
+
+
+def synthetic_frames(count, rng):
+    """Quadros JPEG com ruído (sem rostos): a detecção percorre a imagem inteira mesmo assim."""
+    frames = []
+    for position in range(count):
+        width, height, orientation = SYNTHETIC_FRAME_SIZES[position % len(SYNTHETIC_FRAME_SIZES)]
+        pixels = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels).resize((width, height), Image.BILINEAR)
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85, exif=exif.tobytes())
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def run_pipeline_benchmark(args):
+    """Latência por etapa do pipeline (decode, detect, encode) em quadros sintéticos e, se houver, em fotos reais."""
+    pipeline = FacePipeline()
+    images = synthetic_frames(args.frames, np.random.default_rng(args.seed))
+    if args.images:
+        for paths in load_labelled_images(args.images).values():
+            for path in paths:
+                with open(path, 'rb') as stream:
+                    images.append(stream.read())
+    for image_bytes in images:
+        pipeline.process(io.BytesIO(image_bytes))
+
+    summary = pipeline.timing_summary()
+    metrics = {}
+    for stage in STAGES:
+        metrics[f"{stage}_p50_ms"] = summary[stage]['p50_ms']
+        metrics[f"{stage}_p95_ms"] = summary[stage]['p95_ms']
+    return metrics
+
+
+def compare(baseline, current, latency_tolerance, accuracy_tolerance):
+    """Retorna a lista de regressões de `current` em relação ao `baseline` (seções e métricas em comum)."""
+    regressions = []
+    for section, metrics in current.items():
+        for metric, value in metrics.items():
+            reference = baseline.get(section, {}).get(metric)
+            if reference is None or value is None:
+                continue
+            if metric.endswith('_ms'):
+                if value > reference * (1 + latency_tolerance) and value - reference > LATENCY_NOISE_MS:
+                    regressions.append(f"{section} {metric}: {value} ms (baseline {reference} ms)")
+            elif metric in HIGHER_IS_BETTER:
+                if value < reference - accuracy_tolerance:
+                    regressions.append(f"{section} {metric}: {value} (baseline {reference})")
+            elif value > reference + accuracy_tolerance:
+                regressions.append(f"{section} {metric}: {value} (baseline {reference})")
+    return regressions
+
+
+def main():
+    """
+    Benchmark e teste de regressão do reconhecimento facial, sem Firebase.
+
+    Gera galerias sintéticas (encodings aleatórios ou com "sósias") e mede a
+    acurácia da identificação e a latência da comparação (individual, em grupo
+    e restrita à turma). Com `--frames` e/ou `--images`, mede também as
+    etapas do pipeline de imagem. Com `--check`, compara com o baseline
+    gravado e termina com código 1 se algo piorou além das tolerâncias.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark e regressão do reconhecimento facial.")
+    parser.add_argument('--sizes', default='1000,10000', help="Tamanhos de galeria separados por vírgula")
+    parser.add_argument('--modes', default='random,perturbed', help="Galerias: 'random' e/ou 'perturbed' (com sósias)")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--impostor-ratio', type=float, default=0.05, help="Pessoas fora da galeria, em proporção ao tamanho")
+    parser.add_argument('--enroll-photos', type=int, default=3, help="Fotos por aluno no cadastro (centroide)")
+    parser.add_argument('--noise', type=float, default=0.03, help="Desvio por dimensão entre fotos da mesma pessoa")
+    parser.add_argument('--index', default='brute', help="Índice da galeria (FACE_INDEX_TYPE)")
+    parser.add_argument('--frames', type=int, default=0, help="Quadros sintéticos para medir o pipeline de imagem")
+    parser.add_argument('--images', help="Diretório <pessoa>/<foto> com imagens reais para o pipeline")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--check', action='store_true', help="Falha (código 1) se houver regressão em relação ao baseline")
+    parser.add_argument('--update-baseline', action='store_true', help="Grava os resultados atuais como baseline")
+    parser.add_argument('--latency-tolerance', type=float, default=0.5, help="Piora relativa aceita nas latências")
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.01, help="Piora absoluta aceita nas taxas")
+    args = parser.parse_args()
+
+    params = {key: getattr(args, key) for key in ('queries', 'impostor_ratio', 'enroll_photos', 'noise', 'index', 'seed')}
+    results = {}
+    for mode in args.modes.split(','):
+        for size in (int(s) for s in args.sizes.split(',')):
+            section = f"{mode}/{size}"
+            results[section] = run_gallery_benchmark(size, mode, args)
+            print(f"{section}: " + " ".join(f"{k}={v}" for k, v in results[section].items()))
+    if args.frames or args.images:
+        results['pipeline'] = run_pipeline_benchmark(args)
+        print("pipeline: " + " ".join(f"{k}={v}" for k, v in results['pipeline'].items()))
+
+    exit_code = 0
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"Baseline não encontrado: {args.baseline}")
+            sys.exit(2)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"Parâmetros diferentes do baseline ({baseline.get('params')}); os resultados não são comparáveis.")
+            sys.exit(2)
+        regressions = compare(baseline.get('results', {}), results, args.latency_tolerance, args.accuracy_tolerance)
+        for regression in regressions:
+            print(f"REGRESSÃO: {regression}")
+        if regressions:
+            exit_code = 1
+        else:
+            print("Sem regressões em relação ao baseline.")
+
+    if args.update_baseline:
+        baseline = {'params': params, 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                previous = json.load(f)
+            if previous.get('params') == params:
+                baseline['results'] = previous.get('results', {})
+        baseline['results'].update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline gravado em {args.baseline}")
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# backend/billing_job.py
+
+import os
+import sys
+import argparse
+from datetime import date
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from churn_risk_job import get_database
+from app.services.user_service import UserService
+from app.services.teacher_service import TeacherService
+from app.services.training_class_service import TrainingClassService
+from app.services.enrollment_service import EnrollmentService
+from app.services.payment_service import PaymentService
+from app.services.billing_job_service import BillingJobService
+
+
+def print_progress(job):
+    percent = f"{job['percent']}%" if job.get('percent') is not None else "?"
+    print(f"  {job['id']} (execução {job['run']}): {job['status']}, {percent} | "
+          f"{job['generated']} gerada(s), {job['skipped']} já existente(s), "
+          f"{job.get('dropped', 0)} sem aluno/turma, "
+          f"{job['partitions_done']}/{job['partitions_total']} faixa(s) concluída(s)")
+    for error in job.get('errors', [])[-5:]:
+        print(f"    erro na faixa {error['partition']}: {error['message']}")
+
+
+def main():
+    """
+    Executa ou retoma a geração das mensalidades fora da API. Sem --year e
+    --month, retoma os jobs que ficaram em andamento (ex: instância reiniciada);
+    pode ser agendado no Cloud Scheduler como garantia.
+    """
+    parser = argparse.ArgumentParser(description="Gera ou retoma a cobrança mensal em lote.")
+    parser.add_argument('--emulator', help="host:porta do emulador do Firestore (ex: localhost:8080)")
+    parser.add_argument('--project', help="ID do projeto do Firebase/GCP")
+    parser.add_argument('--year', type=int, help="Ano da cobrança a gerar")
+    parser.add_argument('--month', type=int, help="Mês da cobrança a gerar (1-12)")
+    parser.add_argument('--current', action='store_true', help="Gera a cobrança do mês atual")
+    args = parser.parse_args()
+
+    db = get_database(args.emulator, args.project)
+
+    user_service = UserService(db)
+    teacher_service = TeacherService(db, user_service=user_service)
+    training_class_service = TrainingClassService(db, teacher_service=teacher_service)
+    enrollment_service = EnrollmentService(db, user_service=user_service, training_class_service=training_class_service)
+    payment_service = PaymentService(db, enrollment_service, user_service, training_class_service)
+    billing_job_service = BillingJobService(db, payment_service, enrollment_service)
+
+    if args.current:
+        today = date.today()
+        args.year, args.month = today.year, today.month
+
+    if args.year and args.month:
+        job, created = billing_job_service.start_monthly_billing(args.year, args.month, started_by='billing_job')
+        print("Job iniciado." if created else "Job já estava em andamento; retomando.")
+        job_ids = [job['id']]
+    elif args.year or args.month:
+        parser.error("Informe --year e --month juntos (ou --current).")
+    else:
+        job_ids = [job['id'] for job in billing_job_service.resume_running_jobs()]
+        if not job_ids:
+            print("Nenhum job de cobrança em andamento.")
+            return
+
+    billing_job_service.wait()
+    for job_id in job_ids:
+        print_progress(billing_job_service.get_job_progress(job_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# backend/churn_risk_job.py
+
+import os
+import sys
+import argparse
+from datetime import datetime
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from app.services.user_service import UserService
+from app.services.training_class_service import TrainingClassService
+from app.services.enrollment_service import EnrollmentService
+from app.services.attendance_service import AttendanceService
+from app.services.attendance_analytics_service import AttendanceAnalyticsService
+from app.services.churn_risk_service import ChurnRiskService
+
+
+def get_database(emulator_host=None, project_id=None):
+    """
+    Retorna o cliente do Firestore. Com --emulator (ou FIRESTORE_EMULATOR_HOST
+    definido), conecta-se ao emulador local, sem credenciais, para testes.
+    """
+    if emulator_host:
+        os.environ['FIRESTORE_EMULATOR_HOST'] = emulator_host
+
+    if os.getenv('FIRESTORE_EMULATOR_HOST'):
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import firestore as gcloud_firestore
+        project_id = project_id or os.getenv('GOOGLE_CLOUD_PROJECT', 'jitakyoapp-local')
+        print(f"Usando o emulador do Firestore em {os.environ['FIRESTORE_EMULATOR_HOST']} (projeto {project_id}).")
+        return gcloud_firestore.Client(project=project_id, credentials=AnonymousCredentials())
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    if not firebase_admin._apps:
+        options = {'projectId': project_id} if project_id else None
+        firebase_admin.initialize_app(credentials.ApplicationDefault(), options)
+    return firestore.client()
+
+
+def main():
+    """Job diário: recalcula o ranking de risco de evasão dos alunos ativos."""
+    parser = argparse.ArgumentParser(description="Calcula o risco de evasão dos alunos ativos.")
+    parser.add_argument('--emulator', help="host:porta do emulador do Firestore (ex: localhost:8080)")
+    parser.add_argument('--project', help="ID do projeto do Firebase/GCP")
+    parser.add_argument('--date', type=lambda v: datetime.strptime(v, '%Y-%m-%d').date(),
+                        help="Data de referência (AAAA-MM-DD); padrão: hoje")
+    parser.add_argument('--top', type=int, default=10, help="Quantidade de alunos exibidos ao final")
+    args = parser.parse_args()
+
+    db = get_database(args.emulator, args.project)
+
+    user_service = UserService(db)
+    training_class_service = TrainingClassService(db)
+    enrollment_service = EnrollmentService(db, user_service=user_service, training_class_service=training_class_service)
+    attendance_service = AttendanceService(db, user_service, enrollment_service, training_class_service)
+    analytics_service = AttendanceAnalyticsService(db, attendance_service, enrollment_service, training_class_service, user_service)
+    churn_risk_service = ChurnRiskService(db, enrollment_service, analytics_service, user_service)
+
+    total = churn_risk_service.run(args.date)
+    print(f"Ranking de risco atualizado para {total} aluno(s).")
+
+    for entry in churn_risk_service.get_latest_ranking(limit=args.top).get('students', []):
+        print(f"  {entry['score']:5.1f}  {entry['name']}  ({entry['main_factor']})")
+
+
+if __name__ == '__main__':
+    main()
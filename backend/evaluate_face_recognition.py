@@ -0,0 +1,123 @@
+# backend/evaluate_face_recognition.py
+
+import os
+import sys
+import argparse
+import time
+import numpy as np
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from app.services.facial_recognition_service import FacialRecognitionService, MATCH, AMBIGUOUS
+from app.services.face_pipeline import FacePipeline, STAGES
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_labelled_images(root):
+    """Lê um diretório no formato <root>/<rótulo>/<imagem> e retorna {rótulo: [caminhos]}."""
+    dataset = {}
+    for label in sorted(os.listdir(root)):
+        label_dir = os.path.join(root, label)
+        if not os.path.isdir(label_dir):
+            continue
+        images = sorted(
+            os.path.join(label_dir, name) for name in os.listdir(label_dir)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if images:
+            dataset[label] = images
+    return dataset
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000 if samples else 0.0
+
+
+def main():
+    """
+    Avalia a identificação facial em um conjunto local de imagens rotuladas.
+
+    As primeiras `--enroll` imagens de cada pessoa formam a galeria; as demais
+    são usadas como consultas. As últimas `--impostors` pessoas não são
+    cadastradas, para medir falsos aceites.
+    """
+    parser = argparse.ArgumentParser(description="Avalia acurácia e latência do reconhecimento facial.")
+    parser.add_argument('dataset', help="Diretório com subpastas por pessoa")
+    parser.add_argument('--enroll', type=int, default=1, help="Imagens por pessoa usadas no cadastro")
+    parser.add_argument('--impostors', type=int, default=0, help="Pessoas deixadas fora da galeria")
+    parser.add_argument('--tolerance', type=float, default=None)
+    parser.add_argument('--min-margin', type=float, default=None)
+    parser.add_argument('--max-ratio', type=float, default=None)
+    parser.add_argument('--width', type=int, default=None, help="Largura alvo do pré-processamento (0 = sem redução)")
+    parser.add_argument('--detector', choices=('hog', 'cnn'), default=None)
+    parser.add_argument('--upsample', type=int, default=None)
+    args = parser.parse_args()
+
+    pipeline = FacePipeline()
+    for option, attribute in (('width', 'target_width'), ('detector', 'detector'), ('upsample', 'upsample')):
+        if getattr(args, option) is not None:
+            setattr(pipeline, attribute, getattr(args, option))
+    service = FacialRecognitionService(pipeline=pipeline)
+    for option in ('tolerance', 'min_margin', 'max_ratio'):
+        if getattr(args, option) is not None:
+            setattr(service, option, getattr(args, option))
+
+    dataset = load_labelled_images(args.dataset)
+    labels = list(dataset)
+    impostor_labels = set(labels[len(labels) - args.impostors:]) if args.impostors else set()
+
+    encode_times, match_times = [], []
+    probes = []
+    for label, images in dataset.items():
+        for position, path in enumerate(images):
+            started = time.perf_counter()
+            with open(path, 'rb') as stream:
+                encoding = service.get_face_encoding_from_stream(stream)
+            encode_times.append(time.perf_counter() - started)
+            if encoding is None:
+                print(f"AVISO: nenhum rosto em {path}")
+                continue
+            if label not in impostor_labels and position < args.enroll:
+                service.upsert_student(label, label, encoding)
+            else:
+                probes.append((label, encoding))
+
+    counts = {'correct': 0, 'wrong': 0, 'ambiguous': 0, 'missed': 0, 'false_accept': 0, 'rejected': 0}
+    for label, encoding in probes:
+        started = time.perf_counter()
+        result = service.identify_encoding(encoding)
+        match_times.append(time.perf_counter() - started)
+
+        if label in impostor_labels:
+            counts['false_accept' if result['status'] == MATCH else 'rejected'] += 1
+        elif result['status'] == MATCH:
+            counts['correct' if result['student']['id'] == label else 'wrong'] += 1
+        elif result['status'] == AMBIGUOUS:
+            counts['ambiguous'] += 1
+        else:
+            counts['missed'] += 1
+
+    genuine = sum(counts[k] for k in ('correct', 'wrong', 'ambiguous', 'missed'))
+    impostors = counts['false_accept'] + counts['rejected']
+    print(f"\nGaleria: {service.gallery_size} pessoa(s) | consultas: {genuine} genuínas, {impostors} impostoras")
+    print(f"Parâmetros: tolerância={service.tolerance} margem={service.min_margin} razão={service.max_ratio}")
+    if genuine:
+        print(f"Acurácia (top-1 aceito e correto): {counts['correct'] / genuine:.1%}")
+        print(f"Trocas de identidade: {counts['wrong']} | ambíguos: {counts['ambiguous']} | não reconhecidos: {counts['missed']}")
+    if impostors:
+        print(f"Falsos aceites: {counts['false_accept']} de {impostors} ({counts['false_accept'] / impostors:.1%})")
+    timings = pipeline.timing_summary()
+    print(f"Pipeline: {timings['config']}")
+    for stage in STAGES:
+        print(f"  {stage}: p50={timings[stage]['p50_ms']} ms  p95={timings[stage]['p95_ms']} ms")
+    print(f"Encoding: p50={percentile_ms(encode_times, 50):.1f} ms  p95={percentile_ms(encode_times, 95):.1f} ms")
+    print(f"Comparação: p50={percentile_ms(match_times, 50):.3f} ms  p95={percentile_ms(match_times, 95):.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
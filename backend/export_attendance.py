@@ -0,0 +1,55 @@
+# backend/export_attendance.py
+
+import os
+import sys
+import argparse
+import contextlib
+from datetime import datetime
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from create_admin import initialize_firebase
+from app.services.user_service import UserService
+from app.services.training_class_service import TrainingClassService
+from app.services.attendance_service import AttendanceService, EXPORT_FORMATS
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main():
+    """Exporta o histórico de presenças em CSV ou NDJSON, em streaming."""
+    parser = argparse.ArgumentParser(description="Exporta registros de presença do Firestore.")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--class-id', help="Filtra por turma")
+    parser.add_argument('--student-id', help="Filtra por aluno")
+    parser.add_argument('--start', type=parse_date, help="Data inicial (AAAA-MM-DD)")
+    parser.add_argument('--end', type=parse_date, help="Data final (AAAA-MM-DD)")
+    parser.add_argument('--output', '-o', help="Arquivo de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    # As mensagens de inicialização vão para stderr para não poluir a exportação em stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        db = initialize_firebase()
+    user_service = UserService(db)
+    training_class_service = TrainingClassService(db)
+    attendance_service = AttendanceService(db, user_service, None, training_class_service)
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        for chunk in attendance_service.stream_attendance_export(
+            args.format, args.class_id, args.student_id, args.start, args.end
+        ):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+# backend/fake_mercado_pago.py
+
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PAYMENT_PATH = re.compile(r'^/v1/payments/([^/?]+)')
+_CONTROL_PATH = re.compile(r'^/_fake/payments/([^/?]+)')
+
+
+class FakeMercadoPagoServer:
+    """
+    Servidor HTTP local que imita as rotas do Mercado Pago usadas pelo
+    PaymentService, para testar o checkout e a fila de webhooks (com o
+    emulador do Firestore) sem chamar a API real. O SDK é apontado para ele
+    por MERCADO_PAGO_API_BASE_URL (ou --mp-base-url no webhook_job.py).
+
+    - GET /v1/payments/{id}: o pagamento cadastrado, ou 404.
+    - POST /checkout/preferences: uma preferência com `init_point` local.
+    - POST /_fake/payments/{id}: cadastra ou altera um pagamento (JSON com
+      status, external_reference, payment_method_id), e opcionalmente
+      `fail` (quantas consultas seguintes respondem 500).
+
+    Em testes, os mesmos controles existem como métodos (`set_payment`,
+    `fail_next`) e `delay_seconds` atrasa as consultas, para simular uma
+    notificação chegando durante o processamento.
+    """
+    def __init__(self, host='127.0.0.1', port=0, delay_seconds=0.0):
+        self.delay_seconds = delay_seconds
+        self.payments = {}
+        # Consultas recebidas por pagamento e falhas programadas
+        self.requests = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_payment(self, mp_payment_id, status, external_reference=None, payment_method_id='pix'):
+        with self._lock:
+            self.payments[str(mp_payment_id)] = {
+                'id': str(mp_payment_id),
+                'status': status,
+                'external_reference': external_reference,
+                'payment_method_id': payment_method_id
+            }
+
+    def fail_next(self, mp_payment_id, count=1):
+        """As próximas `count` consultas do pagamento respondem 500."""
+        with self._lock:
+            self._failures[str(mp_payment_id)] = count
+
+    def request_count(self, mp_payment_id):
+        with self._lock:
+            return self.requests.get(str(mp_payment_id), 0)
+
+    def _get_payment(self, mp_payment_id):
+        with self._lock:
+            self.requests[mp_payment_id] = self.requests.get(mp_payment_id, 0) + 1
+            if self._failures.get(mp_payment_id):
+                self._failures[mp_payment_id] -= 1
+                return 500, {'message': 'internal_error', 'status': 500}
+            payment = self.payments.get(mp_payment_id)
+        if self.delay_seconds:
+            time.sleep(self.delay_seconds)
+        if payment is None:
+            return 404, {'message': 'Payment not found', 'status': 404}
+        return 200, dict(payment)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+            def do_GET(self):
+                match = _PAYMENT_PATH.match(self.path)
+                if not match:
+                    return self._send(404, {'message': 'not_found', 'status': 404})
+                self._send(*fake._get_payment(match.group(1)))
+
+            def do_POST(self):
+                body = self._read_json()
+                match = _CONTROL_PATH.match(self.path)
+                if match:
+                    fake.set_payment(match.group(1), body.get('status', 'approved'),
+                                     body.get('external_reference'), body.get('payment_method_id', 'pix'))
+                    if body.get('fail'):
+                        fake.fail_next(match.group(1), int(body['fail']))
+                    return self._send(200, fake.payments[match.group(1)])
+                if self.path.startswith('/checkout/preferences'):
+                    preference_id = uuid.uuid4().hex
+                    return self._send(201, {
+                        'id': preference_id,
+                        'external_reference': body.get('external_reference'),
+                        'init_point': f"{fake.url}/checkout/{preference_id}"
+                    })
+                self._send(404, {'message': 'not_found', 'status': 404})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    """Sobe o servidor falso do Mercado Pago (ex: para o webhook_job.py --mp-base-url)."""
+    parser = argparse.ArgumentParser(description="Servidor falso da API do Mercado Pago para testes locais.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--delay', type=float, default=0.0, help="Atraso (s) de cada consulta de pagamento")
+    args = parser.parse_args()
+
+    server = FakeMercadoPagoServer(args.host, args.port, delay_seconds=args.delay)
+    print(f"Mercado Pago falso em {server.url} (Ctrl+C para encerrar).")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
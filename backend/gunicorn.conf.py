@@ -0,0 +1,49 @@
+# backend/gunicorn.conf.py
+"""
+Configuração do gunicorn, usada pela API principal (main:app) e pelo serviço
+do Kiosk (kiosk_main:app). Tudo é ajustável por variáveis de ambiente, para a
+mesma imagem servir os dois serviços do Cloud Run.
+
+Com GUNICORN_WORKERS > 1, a aplicação é carregada uma única vez no processo
+mestre (preload_app) e os workers nascem por fork:
+- o dlib, os modelos (com FACE_PRELOAD=true) e a galeria carregados na
+  subida ficam em páginas compartilhadas (copy-on-write) em vez de uma cópia
+  por worker;
+- a matriz da galeria é publicada em memória compartilhada
+  (FACE_SHARED_GALLERY), então um cadastro feito em um worker vale para todos;
+- o cliente do Firestore é recriado em cada worker logo após o fork, e só
+  então a galeria facial é lida (nada abre o Firestore no mestre).
+
+Nesse modo os próprios workers do gunicorn dão o paralelismo de CPU; use
+FACE_WORKERS=0 para não abrir um pool de processos dentro de cada um.
+"""
+import os
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ('true', '1', 't')
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+# Worker sem dar sinal por mais que isso (s) é reiniciado. Nenhuma requisição longa roda mais
+# no worker (a cobrança é um job em segundo plano); a subida do worker também conta, por isso
+# o serviço do Kiosk, que carrega modelos e galeria nela, usa um valor maior (cloudbuild.yaml)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = _env_flag('GUNICORN_PRELOAD', str(workers > 1))
+
+if preload_app:
+    # Avisa a aplicação (app.bootstrap) que ela sobe no mestre e só o que não abre o Firestore roda antes do fork
+    os.environ['GUNICORN_PRELOAD'] = 'true'
+    # O gRPC (Firestore) precisa preparar as suas threads para o fork; tem de ser definido antes de importá-lo
+    os.environ.setdefault('GRPC_ENABLE_FORK_SUPPORT', 'true')
+    os.environ.setdefault('GRPC_POLL_STRATEGY', 'poll')
+    if workers > 1:
+        os.environ.setdefault('FACE_SHARED_GALLERY', 'true')
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app.bootstrap import reinit_firebase_after_fork
+        reinit_firebase_after_fork()
@@ -0,0 +1,43 @@
+import os
+from dotenv import load_dotenv
+from flask import Flask
+from app.bootstrap import configure_app, init_firebase, create_core_services, create_facial_recognition_service
+
+def create_kiosk_app():
+    """
+    Aplicação dedicada ao Kiosk e ao cadastro facial (APP_MODULE=kiosk_main:app).
+
+    Registra apenas as rotas de reconhecimento facial, com os mesmos serviços
+    de usuários, turmas, matrículas e presenças da API principal. Assim o
+    processamento de imagem (CPU intensivo) escala separado das chamadas JSON
+    do painel e do PWA. A galeria e os modelos são carregados já na subida
+    (FACE_PRELOAD=false desativa).
+    """
+    app = Flask(__name__)
+    load_dotenv()
+
+    mail = configure_app(app)
+    db = init_firebase()
+
+    core = create_core_services(db, mail=mail)
+    facial_recognition_service = create_facial_recognition_service(core.user_service, preload=True)
+
+    from app.routes.kiosk_routes import kiosk_api_bp, init_kiosk_bp
+    from app.utils.decorators import init_decorators
+
+    init_decorators(core.user_service)
+    init_kiosk_bp(core.user_service, core.training_class_service, core.enrollment_service,
+                  core.attendance_service, facial_recognition_service)
+    app.register_blueprint(kiosk_api_bp)
+
+    @app.route('/')
+    def index():
+        return "JitaKyoApp Kiosk API is running!"
+
+    return app
+
+app = create_kiosk_app()
+
+if __name__ == '__main__':
+    port = int(os.environ.get("PORT", 8081))
+    app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,43 @@
+# backend/ledger_job.py
+
+import os
+import sys
+import argparse
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from churn_risk_job import get_database
+from app.services.financial_ledger_service import FinancialLedgerService
+
+
+def main():
+    """
+    Reconstrói o livro-caixa mensal (financial_ledger) a partir das faturas.
+    Deve ser rodado uma vez após a implantação, para os resumos passarem a
+    ler do livro-caixa, e depois quando se quiser conferir os totais (ex:
+    após uma correção manual de faturas no console).
+    """
+    parser = argparse.ArgumentParser(description="Reconcilia o livro-caixa mensal com as faturas.")
+    parser.add_argument('--emulator', help="host:porta do emulador do Firestore (ex: localhost:8080)")
+    parser.add_argument('--project', help="ID do projeto do Firebase/GCP")
+    parser.add_argument('--dry-run', action='store_true', help="Só compara e lista os meses divergentes, sem gravar")
+    args = parser.parse_args()
+
+    db = get_database(args.emulator, args.project)
+    ledger_service = FinancialLedgerService(db)
+
+    report = ledger_service.rebuild(dry_run=args.dry_run)
+    print(f"{report['payments']} fatura(s) lida(s), {report['months']} mês(es) no livro-caixa.")
+    if report['changed']:
+        action = "divergente(s)" if args.dry_run else "corrigido(s)"
+        print(f"{len(report['changed'])} mês(es) {action}: {', '.join(report['changed'])}")
+    else:
+        print("Nenhuma divergência encontrada.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,80 +1,55 @@
 import os
 from dotenv import load_dotenv
 from flask import Flask
-from werkzeug.middleware.proxy_fix import ProxyFix
-import firebase_admin
-from firebase_admin import credentials, firestore
-from flask_cors import CORS
-from flask_mail import Mail
+from app.bootstrap import configure_app, init_firebase, create_core_services, create_facial_recognition_service
 
 def create_app():
     """Cria e configura a instância da aplicação Flask."""
-    
+
     app = Flask(__name__)
     load_dotenv()
-    
+
     # --- Configuração de Middlewares e Mail ---
-    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
-    
-    allowed_origins = [
-        "https://jitakyoapp.web.app",
-        "https://aluno-jitakyoapp.web.app"
-    ]
-    CORS(app, resources={r"/api/*": {"origins": allowed_origins}}, supports_credentials=True)
-
-    app.config.update(
-        MAIL_SERVER=os.getenv('MAIL_SERVER'),
-        MAIL_PORT=int(os.getenv('MAIL_PORT', 587)),
-        MAIL_USE_TLS=os.getenv('MAIL_USE_TLS', 'true').lower() in ('true', '1', 't'),
-        MAIL_USERNAME=os.getenv('MAIL_USERNAME'),
-        MAIL_PASSWORD=os.getenv('MAIL_PASSWORD'),
-        MAIL_DEFAULT_SENDER=os.getenv('MAIL_DEFAULT_SENDER')
-    )
-    mail = Mail(app)
+    mail = configure_app(app)
 
     # --- Inicialização do Firebase ---
-    try:
-        if not firebase_admin._apps:
-            cred = credentials.ApplicationDefault()
-            firebase_admin.initialize_app(cred)
-    except Exception as e:
-        print(f"ERRO FATAL ao inicializar o Firebase Admin SDK: {e}")
-
-    db = firestore.client()
-    
+    db = init_firebase()
+
     # --- Importação e Inicialização de Serviços ---
-    from app.services.enrollment_service import EnrollmentService
-    from app.services.user_service import UserService
-    from app.services.teacher_service import TeacherService
-    from app.services.training_class_service import TrainingClassService
-    from app.services.attendance_service import AttendanceService
     from app.services.payment_service import PaymentService
+    from app.services.financial_ledger_service import FinancialLedgerService
     from app.services.notification_service import NotificationService
-    from app.services.facial_recognition_service import FacialRecognitionService
-    
-    # Nível 0
-    user_service = UserService(db, mail=mail)
-    teacher_service = TeacherService(db, user_service=user_service)
-    training_class_service = TrainingClassService(db, teacher_service=teacher_service)
-    
-    # Nível 1
-    enrollment_service = EnrollmentService(db, user_service=user_service, training_class_service=training_class_service)
-    
-    # Nível 2
-    attendance_service = AttendanceService(db, user_service, enrollment_service, training_class_service)
-    payment_service = PaymentService(db, enrollment_service, user_service, training_class_service)
-    
+    from app.services.attendance_analytics_service import AttendanceAnalyticsService
+    from app.services.churn_risk_service import ChurnRiskService
+    from app.services.billing_job_service import BillingJobService
+    from app.services.webhook_service import WebhookService
+
+    # Níveis 0 a 2 (usuários, turmas, matrículas e presenças), compartilhados com o kiosk_main
+    core = create_core_services(db, mail=mail)
+    user_service = core.user_service
+    teacher_service = core.teacher_service
+    training_class_service = core.training_class_service
+    enrollment_service = core.enrollment_service
+    attendance_service = core.attendance_service
+
+    ledger_service = FinancialLedgerService(db)
+    payment_service = PaymentService(db, enrollment_service, user_service, training_class_service, ledger_service=ledger_service)
+    attendance_analytics_service = AttendanceAnalyticsService(db, attendance_service, enrollment_service, training_class_service, user_service)
+    churn_risk_service = ChurnRiskService(db, enrollment_service, attendance_analytics_service, user_service)
+    billing_job_service = BillingJobService(db, payment_service, enrollment_service)
+    webhook_service = WebhookService(db, payment_service)
+
     # --- CORREÇÃO APLICADA AQUI ---
     # O NotificationService precisa do enrollment_service para buscar alunos por turma.
     notification_service = NotificationService(db, enrollment_service=enrollment_service)
-    facial_recognition_service = FacialRecognitionService()
 
-    # Resolução de dependência circular
-    user_service.set_enrollment_service(enrollment_service)
+    # Criado só na primeira requisição facial; FACE_PRELOAD=true carrega galeria e modelos na subida
+    facial_recognition_service = create_facial_recognition_service(user_service)
 
     # --- IMPORTAÇÃO E REGISTRO DE ROTAS (BLUEPRINTS) ---
     from app.routes.user_routes import user_api_bp, init_user_bp
     from app.routes.admin_routes import admin_api_bp, init_admin_bp
+    from app.routes.kiosk_routes import kiosk_api_bp, init_kiosk_bp
     from app.routes.student_routes import student_api_bp, init_student_bp
     from app.routes.teacher_routes import teacher_api_bp, init_teacher_bp
     from app.routes.webhook_routes import webhook_api_bp, init_webhook_bp
@@ -82,13 +57,15 @@ def create_app():
 
     init_decorators(user_service)
     init_user_bp(user_service)
-    init_admin_bp(db, user_service, teacher_service, training_class_service, enrollment_service, attendance_service, payment_service, notification_service, facial_recognition_service)
+    init_admin_bp(db, user_service, teacher_service, training_class_service, enrollment_service, attendance_service, payment_service, notification_service, attendance_analytics_service, churn_risk_service, billing_job_service)
+    init_kiosk_bp(user_service, training_class_service, enrollment_service, attendance_service, facial_recognition_service)
     init_teacher_bp(user_service, teacher_service, training_class_service, attendance_service)
     init_student_bp(user_service, enrollment_service, training_class_service, attendance_service, payment_service, notification_service)
-    init_webhook_bp(payment_service)
+    init_webhook_bp(payment_service, webhook_service)
 
-    app.register_blueprint(user_api_bp) 
+    app.register_blueprint(user_api_bp)
     app.register_blueprint(admin_api_bp)
+    app.register_blueprint(kiosk_api_bp)
     app.register_blueprint(student_api_bp)
     app.register_blueprint(teacher_api_bp)
     app.register_blueprint(webhook_api_bp)
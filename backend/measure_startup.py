@@ -0,0 +1,116 @@
+# backend/measure_startup.py
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+HEAVY_MODULES = ('face_recognition', 'dlib', 'cv2', 'numpy', 'PIL.Image', 'sklearn')
+
+# Executado em um processo novo a cada medição, para simular a subida a frio do contêiner
+CHILD_SCRIPT = r'''
+import os, sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, PROJECT_ROOT)
+
+# Firebase sem credenciais (emulador): nada é lido do Firestore durante a subida
+os.environ.setdefault('FIRESTORE_EMULATOR_HOST', 'localhost:8080')
+import firebase_admin
+from firebase_admin import credentials
+from google.auth.credentials import AnonymousCredentials
+
+class AnonymousCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+firebase_admin.initialize_app(AnonymousCredential(), {'projectId': 'jitakyoapp-local'})
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+import main
+result = {
+    'startup_ms': (time.perf_counter() - started) * 1000,
+    'startup_rss_mb': rss_mb(),
+    'loaded_at_startup': [m for m in HEAVY_MODULES if m in sys.modules]
+}
+
+if MEASURE_FACE:
+    # Primeira requisição facial: cria o serviço e carrega os modelos
+    from app.routes import kiosk_routes
+    started = time.perf_counter()
+    service = kiosk_routes.facial_recognition_service
+    service.pipeline
+    import face_recognition
+    result['first_face_ms'] = (time.perf_counter() - started) * 1000
+    result['face_rss_mb'] = rss_mb()
+    result['loaded_after_face'] = [m for m in HEAVY_MODULES if m in sys.modules]
+
+print('RESULT ' + json.dumps(result))
+'''
+
+
+def measure_once(root, measure_face):
+    code = (
+        f"PROJECT_ROOT = {root!r}\nHEAVY_MODULES = {HEAVY_MODULES!r}\nMEASURE_FACE = {measure_face!r}\n"
+        + CHILD_SCRIPT
+    )
+    env = {**os.environ, 'FACE_PRELOAD': 'false', 'FACE_WORKERS': '0'}
+    process = subprocess.run([sys.executable, '-c', code], cwd=root, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Falha ao medir a subida:\n{process.stderr}")
+    output = process.stdout
+    for line in output.splitlines():
+        if line.startswith('RESULT '):
+            return json.loads(line[len('RESULT '):])
+    raise RuntimeError(f"Medição sem resultado:\n{output}")
+
+
+def main():
+    """
+    Mede o tempo de subida (import de main + create_app) e a memória (RSS) da
+    API em processos novos, e opcionalmente o custo da primeira requisição
+    facial. Com --root, mede outra cópia do backend (ex: um checkout anterior)
+    para comparar antes/depois.
+    """
+    parser = argparse.ArgumentParser(description="Mede tempo de subida e memória da API.")
+    parser.add_argument('--runs', type=int, default=5, help="Processos medidos (usa a mediana)")
+    parser.add_argument('--root', default=project_root, help="Diretório do backend a medir")
+    parser.add_argument('--no-face', action='store_true', help="Não mede a primeira requisição facial")
+    parser.add_argument('--json', action='store_true', help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    runs = [measure_once(os.path.abspath(args.root), not args.no_face) for _ in range(args.runs)]
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 1)
+        for key in ('startup_ms', 'startup_rss_mb', 'first_face_ms', 'face_rss_mb') if key in runs[0]
+    }
+    summary['loaded_at_startup'] = runs[0]['loaded_at_startup']
+    if 'loaded_after_face' in runs[0]:
+        summary['loaded_after_face'] = runs[0]['loaded_after_face']
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"Subida (mediana de {args.runs}): {summary['startup_ms']} ms, RSS {summary['startup_rss_mb']} MB")
+    print(f"  Módulos pesados já carregados: {', '.join(summary['loaded_at_startup']) or 'nenhum'}")
+    if 'first_face_ms' in summary:
+        print(f"Primeira requisição facial: +{summary['first_face_ms']} ms, RSS {summary['face_rss_mb']} MB")
+        print(f"  Módulos pesados depois dela: {', '.join(summary['loaded_after_face'])}")
+
+
+if __name__ == '__main__':
+    main()
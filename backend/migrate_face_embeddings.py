@@ -0,0 +1,112 @@
+# backend/migrate_face_embeddings.py
+
+import os
+import sys
+import argparse
+import numpy as np
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from firebase_admin import firestore
+from churn_risk_job import get_database
+from app.models.face_embedding import FaceEmbedding, LEGACY_FIELDS
+
+BATCH_LIMIT = 500
+PAGE_SIZE = 500
+FIELDS = ['face_embedding', 'face_embedding_model', 'face_encoding', 'face_descriptor']
+
+
+def plan_migration(data):
+    """
+    Decide o que gravar para um documento. Retorna (update, situação) ou
+    (None, situação) quando não há nada a fazer.
+
+    Com os dois campos legados, o encoding do servidor (dlib) é mantido; se
+    forem praticamente iguais, conta como duplicado, senão como conflito.
+    """
+    legacy = {field: data.get(field) for field, _ in LEGACY_FIELDS if data.get(field)}
+    if data.get('face_embedding'):
+        if not legacy:
+            return None, 'already_migrated'
+        # Já migrado, mas sobraram campos antigos
+        return {field: firestore.DELETE_FIELD for field in legacy}, 'cleaned'
+    if not legacy:
+        return None, 'no_face'
+
+    embeddings = {}
+    for field, model in LEGACY_FIELDS:
+        if field in legacy:
+            try:
+                embeddings[field] = FaceEmbedding.from_values(legacy[field], model)
+            except (ValueError, TypeError):
+                pass
+    if not embeddings:
+        return None, 'invalid'
+
+    status = 'converted'
+    if len(embeddings) == 2:
+        same = np.allclose(embeddings['face_encoding'].vector, embeddings['face_descriptor'].vector, atol=1e-4)
+        status = 'deduplicated' if same else 'conflict'
+    chosen = embeddings.get('face_encoding') or embeddings['face_descriptor']
+
+    update = chosen.to_firestore()
+    update.update({field: firestore.DELETE_FIELD for field in legacy})
+    update['has_face_registered'] = True
+    return update, status
+
+
+def main():
+    """
+    Converte 'face_encoding' / 'face_descriptor' (listas de floats) para o
+    campo binário 'face_embedding' (512 bytes float32) com a tag do modelo,
+    removendo os campos antigos. Pode ser executado mais de uma vez.
+    """
+    parser = argparse.ArgumentParser(description="Migra os embeddings faciais para o formato binário float32.")
+    parser.add_argument('--emulator', help="host:porta do emulador do Firestore (ex: localhost:8080)")
+    parser.add_argument('--project', help="ID do projeto do Firebase/GCP")
+    parser.add_argument('--dry-run', action='store_true', help="Apenas mostra o que seria alterado")
+    args = parser.parse_args()
+
+    db = get_database(args.emulator, args.project)
+    collection = db.collection('users')
+
+    counts = {}
+    batch, pending = db.batch(), 0
+    last_doc = None
+    while True:
+        query = collection.order_by('__name__').select(FIELDS).limit(PAGE_SIZE)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = list(query.stream())
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        for doc in docs:
+            update, status = plan_migration(doc.to_dict() or {})
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'conflict':
+                print(f"  Aviso: {doc.id} tinha encodings diferentes; mantido o do servidor (dlib).")
+            if update is None or args.dry_run:
+                continue
+            batch.update(doc.reference, update)
+            pending += 1
+            if pending == BATCH_LIMIT:
+                batch.commit()
+                batch, pending = db.batch(), 0
+
+    if pending:
+        batch.commit()
+
+    prefix = "[simulação] " if args.dry_run else ""
+    print(f"{prefix}Resultado da migração:")
+    for status, total in sorted(counts.items()):
+        print(f"  {status}: {total}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""
+Fila de webhooks do Mercado Pago sem emulador: um Firestore em memória e um
+PaymentService falso. Cobre a sequência recebimento → _claim → _process →
+_finish / _record_failure; a integração com o Firestore e com o SDK do
+Mercado Pago fica em test_webhook_service.py.
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import copy
+import time
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import webhook_service as webhook_module
+from app.services.webhook_service import WebhookService, QUEUED, PROCESSING, DONE, FAILED
+
+
+# --- Firestore em memória (apenas o que o WebhookService usa) ---
+
+class _Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class _ArrayUnion:
+    def __init__(self, values):
+        self.values = values
+
+
+class _FieldFilter:
+    def __init__(self, field, op, value):
+        self.field, self.op, self.value = field, op, value
+
+    def matches(self, data):
+        current = data.get(self.field)
+        if self.op == '==':
+            return current == self.value
+        if self.op == '<':
+            return current is not None and current < self.value
+        raise NotImplementedError(self.op)
+
+
+class _And:
+    def __init__(self, filters):
+        self.filters = filters
+
+    def matches(self, data):
+        return all(f.matches(data) for f in self.filters)
+
+
+class _Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = copy.deepcopy(data)
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class _DocumentRef:
+    def __init__(self, collection, doc_id):
+        self.collection, self.id = collection, doc_id
+
+    def get(self, transaction=None):
+        return _Snapshot(self.id, self.collection.docs.get(self.id))
+
+    def set(self, data):
+        self.collection.docs[self.id] = copy.deepcopy(data)
+
+    def update(self, updates):
+        data = self.collection.docs[self.id]
+        for field, value in updates.items():
+            if isinstance(value, _Increment):
+                data[field] = data.get(field, 0) + value.value
+            elif isinstance(value, _ArrayUnion):
+                current = data.get(field) or []
+                data[field] = current + [v for v in value.values if v not in current]
+            else:
+                data[field] = copy.deepcopy(value)
+
+
+class _Query:
+    def __init__(self, collection, filter):
+        self.collection, self.filter = collection, filter
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        return [_Snapshot(doc_id, data) for doc_id, data in list(self.collection.docs.items())
+                if self.filter.matches(data)]
+
+
+class _Collection:
+    def __init__(self):
+        self.docs = {}
+
+    def document(self, doc_id):
+        return _DocumentRef(self, doc_id)
+
+    def where(self, filter):
+        return _Query(self, filter)
+
+
+class _Transaction:
+    def set(self, ref, data):
+        ref.set(data)
+
+    def update(self, ref, updates):
+        ref.update(updates)
+
+
+class FakeFirestore:
+    """Banco em memória; as transações são serializadas por um lock."""
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.RLock()
+
+    def collection(self, name):
+        return self.collections.setdefault(name, _Collection())
+
+    def transaction(self):
+        return _Transaction()
+
+    def transactional(self, fn):
+        def run(transaction):
+            with self.lock:
+                return fn(transaction)
+        return run
+
+    def module(self):
+        """Substituto do `firebase_admin.firestore` dentro do webhook_service."""
+        return SimpleNamespace(transactional=self.transactional, Increment=_Increment, ArrayUnion=_ArrayUnion,
+                               FieldFilter=_FieldFilter, And=_And)
+
+
+class FakePaymentService:
+    """Responde às consultas do WebhookService sem o Mercado Pago; falhas e bloqueios programáveis."""
+    def __init__(self):
+        self.status = {}
+        self.fetches = {}
+        self.applied = []
+        self.failures = {}
+        self.gate = None
+        self._lock = threading.Lock()
+
+    def fetch_mercado_pago_payment(self, mp_payment_id):
+        with self._lock:
+            self.fetches[mp_payment_id] = self.fetches.get(mp_payment_id, 0) + 1
+            fail = self.failures.get(mp_payment_id, 0)
+            if fail:
+                self.failures[mp_payment_id] = fail - 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if fail:
+            raise RuntimeError("Mercado Pago respondeu 500")
+        return {'id': mp_payment_id, 'status': self.status.get(mp_payment_id, 'approved'),
+                'external_reference': f"invoice_{mp_payment_id}"}
+
+    def apply_mercado_pago_payment(self, mp_payment_id, payment_info):
+        with self._lock:
+            self.applied.append((mp_payment_id, payment_info['status']))
+        return True
+
+
+class WebhookQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeFirestore()
+        patcher = mock.patch.object(webhook_module, 'firestore', self.db.module())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.payment_service = FakePaymentService()
+        self.service = WebhookService(self.db, self.payment_service, max_workers=2, retry_delay_seconds=0.01)
+
+    # --- Auxiliares ---
+
+    def _notify(self, mp_payment_id, notification_id):
+        return self.service.receive({'id': notification_id, 'type': 'payment', 'data': {'id': mp_payment_id}})
+
+    def _event(self, mp_payment_id):
+        return self.service.collection.document(mp_payment_id).get().to_dict()
+
+    def _wait_for_state(self, mp_payment_id, state, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if (self._event(mp_payment_id) or {}).get('state') == state:
+                return
+            time.sleep(0.01)
+        self.fail(f"O evento {mp_payment_id} não chegou ao estado {state}.")
+
+    # --- Cenários ---
+
+    def test_non_payment_notification_is_ignored(self):
+        self.assertIsNone(self.service.receive({'type': 'merchant_order', 'data': {'id': '1'}}))
+        self.assertIsNone(self.service.receive({'type': 'payment', 'data': {}}))
+        self.assertEqual(self.service.collection.docs, {})
+
+    def test_resent_notification_is_processed_once(self):
+        self._notify('mp1', 'n1')
+        self.service.wait(0.01)
+        self._notify('mp1', 'n1')
+        self.service.wait(0.01)
+
+        event = self._event('mp1')
+        self.assertEqual(event['state'], DONE)
+        self.assertEqual(event['duplicates'], 1)
+        self.assertEqual(event['processed_keys'], ['mp1_approved'])
+        self.assertIsNone(event['owner'])
+        self.assertEqual(self.payment_service.fetches['mp1'], 1)
+        self.assertEqual(self.payment_service.applied, [('mp1', 'approved')])
+
+    def test_notifications_during_processing_are_coalesced(self):
+        self.payment_service.gate = threading.Event()
+
+        self._notify('mp1', 'n1')
+        self._wait_for_state('mp1', PROCESSING)
+        self._notify('mp1', 'n2')
+        self._notify('mp1', 'n3')
+        event = self._event('mp1')
+        self.assertEqual(event['state'], PROCESSING)
+        self.assertEqual(event['sequence'], 3)
+
+        self.payment_service.gate.set()
+        self.service.wait(0.01)
+        event = self._event('mp1')
+        self.assertEqual(event['state'], DONE)
+        # A consulta em andamento e uma única nova consulta pelas duas notificações recebidas durante ela
+        self.assertEqual(self.payment_service.fetches['mp1'], 2)
+        # O mesmo status não é aplicado duas vezes
+        self.assertEqual(self.payment_service.applied, [('mp1', 'approved')])
+
+    def test_new_status_is_applied_after_done(self):
+        self._notify('mp1', 'n1')
+        self.service.wait(0.01)
+        self.payment_service.status['mp1'] = 'refunded'
+        self._notify('mp1', 'n2')
+        self.service.wait(0.01)
+
+        self.assertEqual(self._event('mp1')['processed_keys'], ['mp1_approved', 'mp1_refunded'])
+        self.assertEqual(self.payment_service.applied, [('mp1', 'approved'), ('mp1', 'refunded')])
+
+    def test_transient_failure_is_retried(self):
+        self.payment_service.failures['mp1'] = 2
+
+        self._notify('mp1', 'n1')
+        self.service.wait(0.01)
+
+        event = self._event('mp1')
+        self.assertEqual(event['state'], DONE)
+        self.assertEqual(event['attempts'], 3)
+        self.assertIsNone(event['last_error'])
+        self.assertEqual(self.payment_service.fetches['mp1'], 3)
+        self.assertEqual(self.payment_service.applied, [('mp1', 'approved')])
+
+    def test_event_fails_after_max_attempts_and_new_notification_requeues(self):
+        self.payment_service.failures['mp1'] = webhook_module.MAX_ATTEMPTS
+
+        self._notify('mp1', 'n1')
+        self.service.wait(0.01)
+
+        event = self._event('mp1')
+        self.assertEqual(event['state'], FAILED)
+        self.assertEqual(event['attempts'], webhook_module.MAX_ATTEMPTS)
+        self.assertIn('500', event['last_error'])
+        self.assertEqual(self.payment_service.applied, [])
+        # Parado em falha, o evento não é retomado pelo webhook_job.py
+        self.assertEqual(self.service.process_pending(), 0)
+
+        self._notify('mp1', 'n2')
+        self.service.wait(0.01)
+        event = self._event('mp1')
+        self.assertEqual(event['state'], DONE)
+        self.assertEqual(event['attempts'], 1)
+        self.assertEqual(self.payment_service.fetches['mp1'], webhook_module.MAX_ATTEMPTS + 1)
+        self.assertEqual(self.payment_service.applied, [('mp1', 'approved')])
+
+    def test_queued_and_stale_events_are_resumed_by_job(self):
+        # Instância que morreu antes de processar: o evento fica na fila sem ninguém o submeter
+        self.service._dispatch = lambda event_id: None
+        self._notify('mp1', 'n1')
+        self._notify('mp2', 'n2')
+        self.assertEqual(self._event('mp1')['state'], QUEUED)
+        # ... e outra que morreu no meio do processamento, com a concessão já vencida
+        self.service.collection.document('mp2').update({
+            'state': PROCESSING, 'owner': 'instancia_morta',
+            'lease_until': webhook_module.datetime.now(webhook_module.timezone.utc) - webhook_module.timedelta(seconds=1)
+        })
+
+        job = WebhookService(self.db, self.payment_service, max_workers=2, retry_delay_seconds=0.01)
+        self.assertEqual(job.process_pending(), 2)
+        job.wait(0.01)
+        self.assertEqual(self._event('mp1')['state'], DONE)
+        self.assertEqual(self._event('mp2')['state'], DONE)
+        self.assertEqual(sorted(self.payment_service.applied), [('mp1', 'approved'), ('mp2', 'approved')])
+
+    def test_finish_by_another_owner_is_ignored(self):
+        self.service._dispatch = lambda event_id: None
+        self._notify('mp1', 'n1')
+        event_ref = self.service.collection.document('mp1')
+        claimed = self.service._claim(event_ref, 'token_a')
+        self.assertIsNotNone(claimed)
+        # Já em processamento com concessão válida: ninguém mais assume
+        self.assertIsNone(self.service._claim(event_ref, 'token_b'))
+
+        result = self.service._process(claimed)
+        self.assertFalse(self.service._finish(event_ref, 'token_b', claimed['sequence'], result))
+        self.assertEqual(self._event('mp1')['state'], PROCESSING)
+        self.assertFalse(self.service._finish(event_ref, 'token_a', claimed['sequence'], result))
+        self.assertEqual(self._event('mp1')['state'], DONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Fila de webhooks do Mercado Pago contra o emulador do Firestore e o servidor
+falso do Mercado Pago (fake_mercado_pago.py).
+
+    firebase emulators:start --only firestore
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m unittest discover -s tests
+"""
+import os
+import sys
+import time
+import uuid
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_mercado_pago import FakeMercadoPagoServer
+from app.services import webhook_service as webhook_module
+from app.services.webhook_service import WebhookService, QUEUED, PROCESSING, DONE, FAILED
+
+
+@unittest.skipUnless(os.getenv('FIRESTORE_EMULATOR_HOST'), "Requer o emulador do Firestore (FIRESTORE_EMULATOR_HOST).")
+class WebhookServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from churn_risk_job import get_database
+        cls.fake = FakeMercadoPagoServer().start()
+        cls._environ = {key: os.environ.get(key) for key in ('MERCADO_PAGO_ACCESS_TOKEN', 'MERCADO_PAGO_API_BASE_URL')}
+        os.environ['MERCADO_PAGO_ACCESS_TOKEN'] = 'TEST-fake-token'
+        os.environ['MERCADO_PAGO_API_BASE_URL'] = cls.fake.url
+        cls.db = get_database()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        for key, value in cls._environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def setUp(self):
+        from app.services.payment_service import PaymentService
+        self.fake.delay_seconds = 0.0
+        self.payment_service = PaymentService(self.db)
+        self.service = WebhookService(self.db, self.payment_service, max_workers=2, retry_delay_seconds=0.01)
+
+    # --- Auxiliares ---
+
+    def _invoice(self, mp_payment_id, status='approved'):
+        """Cria uma fatura pendente e o pagamento correspondente no Mercado Pago falso."""
+        invoice_id = f"test_{uuid.uuid4().hex}"
+        self.db.collection('payments').document(invoice_id).set({
+            'student_id': 'aluno_teste', 'amount': 100.0, 'status': 'pending', 'type': 'monthly_fee',
+            'reference_year': 2026, 'reference_month': 1, 'due_day': 10
+        })
+        self.fake.set_payment(mp_payment_id, status, external_reference=invoice_id)
+        return invoice_id
+
+    def _notify(self, mp_payment_id, notification_id):
+        return self.service.receive({'id': notification_id, 'type': 'payment', 'data': {'id': mp_payment_id}})
+
+    def _event(self, mp_payment_id):
+        return self.service.collection.document(mp_payment_id).get().to_dict()
+
+    def _invoice_status(self, invoice_id):
+        return self.db.collection('payments').document(invoice_id).get().to_dict()['status']
+
+    def _wait_for_state(self, mp_payment_id, state, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if (self._event(mp_payment_id) or {}).get('state') == state:
+                return
+            time.sleep(0.02)
+        self.fail(f"O evento {mp_payment_id} não chegou ao estado {state}.")
+
+    # --- Cenários ---
+
+    def test_resent_notification_is_processed_once(self):
+        mp_payment_id = uuid.uuid4().hex
+        invoice_id = self._invoice(mp_payment_id)
+
+        self._notify(mp_payment_id, 'n1')
+        self.service.wait(0.02)
+        self._notify(mp_payment_id, 'n1')
+        self.service.wait(0.02)
+
+        event = self._event(mp_payment_id)
+        self.assertEqual(event['state'], DONE)
+        self.assertEqual(event['duplicates'], 1)
+        self.assertEqual(event['processed_keys'], [f"{mp_payment_id}_approved"])
+        self.assertEqual(self.fake.request_count(mp_payment_id), 1)
+        self.assertEqual(self._invoice_status(invoice_id), 'paid')
+
+    def test_notifications_during_processing_are_coalesced(self):
+        mp_payment_id = uuid.uuid4().hex
+        invoice_id = self._invoice(mp_payment_id)
+        self.fake.delay_seconds = 0.5
+
+        self._notify(mp_payment_id, 'n1')
+        self._wait_for_state(mp_payment_id, PROCESSING)
+        self._notify(mp_payment_id, 'n2')
+        self._notify(mp_payment_id, 'n3')
+        event = self._event(mp_payment_id)
+        self.assertEqual(event['state'], PROCESSING)
+        self.assertEqual(event['sequence'], 3)
+
+        self.service.wait(0.02)
+        event = self._event(mp_payment_id)
+        self.assertEqual(event['state'], DONE)
+        # A consulta em andamento e uma única nova consulta pelas duas notificações recebidas durante ela
+        self.assertEqual(self.fake.request_count(mp_payment_id), 2)
+        self.assertEqual(self._invoice_status(invoice_id), 'paid')
+
+    def test_transient_failure_is_retried(self):
+        mp_payment_id = uuid.uuid4().hex
+        invoice_id = self._invoice(mp_payment_id)
+        self.fake.fail_next(mp_payment_id, 2)
+
+        self._notify(mp_payment_id, 'n1')
+        self.service.wait(0.02)
+
+        event = self._event(mp_payment_id)
+        self.assertEqual(event['state'], DONE)
+        self.assertEqual(event['attempts'], 3)
+        self.assertIsNone(event['last_error'])
+        self.assertEqual(self.fake.request_count(mp_payment_id), 3)
+        self.assertEqual(self._invoice_status(invoice_id), 'paid')
+
+    def test_event_fails_after_max_attempts_and_new_notification_requeues(self):
+        mp_payment_id = uuid.uuid4().hex
+        invoice_id = self._invoice(mp_payment_id)
+        self.fake.fail_next(mp_payment_id, webhook_module.MAX_ATTEMPTS)
+
+        self._notify(mp_payment_id, 'n1')
+        self.service.wait(0.02)
+
+        event = self._event(mp_payment_id)
+        self.assertEqual(event['state'], FAILED)
+        self.assertEqual(event['attempts'], webhook_module.MAX_ATTEMPTS)
+        self.assertIn('500', event['last_error'])
+        self.assertEqual(self._invoice_status(invoice_id), 'pending')
+        # Parado em falha, o evento não é retomado pelo webhook_job.py
+        submitted = []
+        self.service._dispatch = submitted.append
+        self.service.process_pending()
+        self.assertNotIn(mp_payment_id, submitted)
+        del self.service._dispatch
+
+        self._notify(mp_payment_id, 'n2')
+        self.service.wait(0.02)
+        self.assertEqual(self._event(mp_payment_id)['state'], DONE)
+        self.assertEqual(self.fake.request_count(mp_payment_id), webhook_module.MAX_ATTEMPTS + 1)
+        self.assertEqual(self._invoice_status(invoice_id), 'paid')
+
+    def test_queued_event_is_resumed_by_job(self):
+        mp_payment_id = uuid.uuid4().hex
+        invoice_id = self._invoice(mp_payment_id)
+        # Instância que morreu antes de processar: o evento fica na fila sem ninguém o submeter
+        self.service._dispatch = lambda event_id: None
+        self._notify(mp_payment_id, 'n1')
+        self.assertEqual(self._event(mp_payment_id)['state'], QUEUED)
+
+        job = WebhookService(self.db, self.payment_service, max_workers=2, retry_delay_seconds=0.01)
+        self.assertGreaterEqual(job.process_pending(), 1)
+        job.wait(0.02)
+        self.assertEqual(self._event(mp_payment_id)['state'], DONE)
+        self.assertEqual(self._invoice_status(invoice_id), 'paid')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# backend/webhook_job.py
+
+import os
+import sys
+import argparse
+
+# --- Configuração do Caminho ---
+# Permite importar os módulos da aplicação a partir do diretório 'backend'.
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+# -----------------------------
+
+from churn_risk_job import get_database
+from app.services.payment_service import PaymentService
+from app.services.webhook_service import WebhookService
+
+
+def main():
+    """
+    Processa as notificações do Mercado Pago que ficaram na fila (ex:
+    instância reiniciada antes de processá-las). Roda como o job do Cloud Run
+    jitakyoapp-webhook-job, agendado no Cloud Scheduler (ver cloudbuild.yaml).
+    Com --mp-base-url, consulta um servidor falso local (fake_mercado_pago.py)
+    em vez da API do Mercado Pago (testes com o emulador).
+    """
+    parser = argparse.ArgumentParser(description="Processa a fila de webhooks do Mercado Pago.")
+    parser.add_argument('--emulator', help="host:porta do emulador do Firestore (ex: localhost:8080)")
+    parser.add_argument('--project', help="ID do projeto do Firebase/GCP")
+    parser.add_argument('--mp-base-url', help="URL da API do Mercado Pago (ex: http://localhost:9090)")
+    args = parser.parse_args()
+
+    if args.mp_base_url:
+        os.environ['MERCADO_PAGO_API_BASE_URL'] = args.mp_base_url
+
+    db = get_database(args.emulator, args.project)
+    payment_service = PaymentService(db)
+    webhook_service = WebhookService(db, payment_service)
+
+    submitted = webhook_service.process_pending()
+    print(f"{submitted} evento(s) pendente(s) submetido(s).")
+    webhook_service.wait()
+    print("Fila de webhooks processada.")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,17 @@ const statusIcon = document.getElementById('status-icon');
 const statusTitle = document.getElementById('status-title');
 const statusMessage = document.getElementById('status-message');
 
+// Identificador fixo deste tablet, enviado em X-Kiosk-Device (o servidor só reaproveita resultados por tablet)
+function getDeviceId() {
+    let deviceId = localStorage.getItem('kioskDeviceId');
+    if (!deviceId) {
+        deviceId = (crypto.randomUUID ? crypto.randomUUID() : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`);
+        localStorage.setItem('kioskDeviceId', deviceId);
+    }
+    return deviceId;
+}
+const DEVICE_ID = getDeviceId();
+
 // 1. Iniciar Câmera
 async function startCamera() {
     try {
@@ -39,6 +50,7 @@ async function verifyAttendance() {
         try {
             const response = await fetch(`${API_URL}/attendance/kiosk/recognize`, {
                 method: 'POST',
+                headers: { 'X-Kiosk-Device': DEVICE_ID },
                 body: formData
             });
 
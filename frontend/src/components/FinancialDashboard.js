@@ -214,7 +214,25 @@ async function openMiscInvoiceModal(onSave) {
             };
 
             try {
-                // NOTE: This endpoint needs to be created in the backend (e.g., in admin_routes.py)
+                // Pré-visualização (dry_run): confere quantas faturas serão geradas e o total antes de gravar
+                const previewResponse = await fetchWithAuth('/api/admin/financial/generate-misc-invoice', {
+                    method: 'POST',
+                    body: JSON.stringify({ ...payload, dry_run: true })
+                });
+                const preview = await previewResponse.json();
+                if (!previewResponse.ok) throw preview;
+
+                const { to_create: toCreate, skipped, total_amount: totalAmount } = preview.details;
+                if (toCreate === 0) {
+                    showModal('Atenção', `<p>Nenhuma fatura nova: os ${skipped} alunos selecionados já têm esta cobrança.</p>`);
+                    return;
+                }
+                const totalFormatted = totalAmount.toLocaleString('pt-BR', { style: 'currency', currency: 'BRL' });
+                const skippedNote = skipped ? ` ${skipped} aluno(s) já têm esta cobrança e serão ignorados.` : '';
+                if (!confirm(`Serão geradas ${toCreate} fatura(s), total de ${totalFormatted}.${skippedNote} Confirmar?`)) {
+                    return;
+                }
+
                 const response = await fetchWithAuth('/api/admin/financial/generate-misc-invoice', {
                     method: 'POST',
                     body: JSON.stringify(payload)
@@ -422,6 +440,17 @@ export function renderFinancialDashboard(targetElement) {
         }
     };
     
+    const waitForBillingJob = async (job) => {
+        while (job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 1500));
+            const response = await fetchWithAuth(`/api/admin/financial/billing-jobs/${job.id}`);
+            const result = await response.json();
+            if (!response.ok) throw new Error(result.error || 'Falha ao consultar o progresso das cobranças');
+            job = result;
+        }
+        return job;
+    };
+
     const handleGenerateBillingsClick = async () => {
         showLoading();
         try {
@@ -433,8 +462,15 @@ export function renderFinancialDashboard(targetElement) {
             });
             const result = await response.json();
             if (!response.ok) throw new Error(result.error || 'Falha ao gerar cobranças');
-            
-            showModal('Sucesso', `<p>${result.details.generated} cobranças geradas. ${result.details.skipped} já existiam.</p>`);
+
+            // A geração roda em segundo plano: acompanha o job até terminar
+            const job = await waitForBillingJob(result.job);
+            if (job.status === 'completed') {
+                showModal('Sucesso', `<p>${job.generated} cobranças geradas. ${job.skipped} já existiam.</p>`);
+            } else {
+                const lastError = job.errors.length ? job.errors[job.errors.length - 1].message : 'erro desconhecido';
+                showModal('Erro', `<p>A geração terminou com falhas: ${job.generated} cobranças geradas, ${job.skipped} já existiam.</p><p>${lastError}</p>`);
+            }
             fetchAndRenderData();
         } catch (error) {
             showModal('Erro', `<p>${error.message}</p>`);